@@ -1,36 +1,45 @@
 import time
 import json
-import struct
+import os
 import threading
 import pigpio
 import paho.mqtt.client as mqtt
 from enum import Enum
 
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
+import telemetry_codec
+from modbus_driver import ModbusDriver, Register, RegisterMap
+from run_logger import RunLogger
+from clock_sync import ClockClient
 
 BROKER_IP = "192.168.2.1"
 DEVICE_ID = "dcu"
 CONTACTOR_PIN = 27
-class TorqueDriver:
+TELEMETRY_ENCODING = "json"  # "json" or "binary", see telemetry_codec.py
+SENSOR_TIMEOUT = 0.1          # a torque/RPM block reply at 19200 baud takes ~10 ms
+SENSOR_ERROR_BACKOFF = 0.05
+CONTACTOR_CHECK_INTERVAL = 0.5  # readback watchdog; actuation itself is event-driven
+TIMING_PUBLISH_INTERVAL = 1.0
+
+# Every torque/RPM sample is logged locally while in RUN_CONTINUOUS
+RUN_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_logs")
+RUN_LOG_FIELDS = (("torque", "f"), ("rpm", "f"), ("contactor", "B"))
+
+TORQUE_REGISTERS = RegisterMap([
+    Register("torque", 0x00, "int32", 0.1),
+    Register("rpm", 0x02, "int32", 0.1),
+])
+
+class TorqueDriver(ModbusDriver):
     def __init__(self, port, baudrate, parity, stopbits, bytesize, timeout, slave_id):
-        self.client = ModbusSerialClient(
-            port=port,
-            baudrate=baudrate,
-            timeout=timeout,
-            parity=parity,
-            stopbits=stopbits,
-            bytesize=bytesize
-        )
-        self.slave_id = slave_id
-        try:
-            self.connected = self.client.connect()
-        except Exception as e:
-            print(f"Modbus connect error: {e}")
-            self.connected = False
+        super().__init__(port, baudrate, parity, stopbits, bytesize, timeout, slave_id)
+        self.connect()
 
-    def __del__(self):
-        self.client.close()
+    def read_torque_rpm(self):
+        """Torque and RPM from one block read of 0x00-0x03."""
+        values = self.read_map(TORQUE_REGISTERS)
+        if values is None:
+            print("Failed to read torque/RPM")
+        return values
 
     def read_torque(self):
         result = self.read_parameter(0x00, 2, signed=True)
@@ -48,25 +57,6 @@ class TorqueDriver:
             print("Failed to read RPM")
             return None
 
-    def read_parameter(self, address, length=1, signed=False):
-        try:
-            response = self.client.read_holding_registers(address=address, count=length, slave=self.slave_id)
-            if not response.isError():
-                if length == 1:
-                    value = response.registers[0]
-                    if signed:
-                        value = struct.unpack('>h', struct.pack('>H', value))[0]
-                elif length == 2:
-                    value = (response.registers[0] << 16) | response.registers[1]
-                    if signed:
-                        value = struct.unpack('>i', struct.pack('>I', value))[0]
-                return value
-            else:
-                print(f"Modbus read failed at {hex(address)}")
-        except Exception as e:
-            print(f"Modbus read exception at {hex(address)}: {e}")
-        return None
-
 class Mode(Enum):
     IDLE = 0
     RUN_CONTINUOUS = 2
@@ -79,19 +69,27 @@ class Direction(Enum):
 # === Main Contactor Controller ===
 class ContactorController:
     def __init__(self):
+        self.clock = ClockClient()
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.client.connect(BROKER_IP, 1883, 60)
         self.client.loop_start()
         self.client.subscribe(f"{DEVICE_ID}/cmd")
         self.client.on_message = self.on_message
 
-        self.mode = Mode.IDLE
-        self.direction = Direction.OFF
+        # Replaced as one tuple: the watchdog thread must never see a new mode with the old direction
+        self.command = (Mode.IDLE, Direction.OFF)
 
         # Initialize GPIO for contactor
         self.pi = pigpio.pi()
         self.pi.set_mode(CONTACTOR_PIN, pigpio.OUTPUT)
         self.pi.write(CONTACTOR_PIN, 0)  # Start with contactor OFF
+        self.contactor_lock = threading.Lock()
+        self.contactor_commanded = False
+        self.contactor_state = self.pi.read(CONTACTOR_PIN)  # cached readback
+        self.actuations = 0
+        self.readback_faults = 0
+        self.command_latency_last = 0.0
+        self.command_latency_max = 0.0
 
         # Initialize torque sensor
         self.torque_sensor = TorqueDriver(
@@ -100,7 +98,7 @@ class ContactorController:
             parity="N",
             stopbits=1,
             bytesize=8,
-            timeout=1,
+            timeout=SENSOR_TIMEOUT,
             slave_id=1
         )
         if not self.torque_sensor.connected:
@@ -108,73 +106,170 @@ class ContactorController:
 
         self.torque_value = 0.0
         self.rpm_value = 0.0
+        self.sensor_time = 0.0
+        self.sensor_samples = 0
+        self.sensor_errors = 0
+        self.sensor_rate = 0.0
+        self.run_logger = RunLogger(RUN_LOG_DIR, DEVICE_ID, RUN_LOG_FIELDS)
+        self.run_marked = False  # log started by an MCU run_marker: only its stop marker ends it
 
         self.running = True
         threading.Thread(target=self.run, daemon=True).start()
+        threading.Thread(target=self.sensor_loop, daemon=True).start()
         threading.Thread(target=self.publish_status, daemon=True).start()
 
     def read_sensors(self):
         try:
-            torque = self.torque_sensor.read_parameter(0x00, 2, signed=True)
-            rpm = self.torque_sensor.read_parameter(0x02, 2, signed=True)
-            
-            if torque is not None:
-                self.torque_value = torque / 10
-            if rpm is not None:
-                self.rpm_value = rpm/10
+            values = self.torque_sensor.read_torque_rpm()
+            if values is not None:
+                self.torque_value = values["torque"]
+                self.rpm_value = values["rpm"]
+                self.sensor_time = self.clock.now()
+                return True
         except Exception as e:
             print(f"Sensor read error: {e}")
+        return False
+
+    def sensor_loop(self):
+        """Samples torque/RPM back to back; nothing else waits on the serial link."""
+        window_start = time.monotonic()
+        window_samples = 0
+        while self.running:
+            if self.read_sensors():
+                self.sensor_samples += 1
+                window_samples += 1
+                self.run_logger.log(self.sensor_time, (self.torque_value, self.rpm_value, self.contactor_state))
+            else:
+                self.sensor_errors += 1
+                time.sleep(SENSOR_ERROR_BACKOFF)
+            now = time.monotonic()
+            if now - window_start >= 1.0:
+                self.sensor_rate = window_samples / (now - window_start)
+                window_start = now
+                window_samples = 0
 
     def on_message(self, client, userdata, msg):
         try:
             data = json.loads(msg.payload.decode())
+            if "clock_ping" in data:
+                self.client.publish(f"{DEVICE_ID}/clock", json.dumps(self.clock.on_ping(data)))
+                return
+            if "run_marker" in data:
+                self.handle_run_marker(data)
+                return
+            received = time.monotonic()
             new_mode = Mode(data.get("mode", 0))
             new_direction = Direction(data.get("direction", 0))
             
-            # If switching to IDLE, immediately turn off contactor
-            if new_mode == Mode.IDLE:
-                self.set_contactor(False)
-                print("Immediate stop command received - contactor OFF")
-            
-            self.mode = new_mode
-            self.direction = new_direction
+            self.command = (new_mode, new_direction)
+            # Apply on the MQTT thread right away instead of waiting for a control tick
+            if self.apply_contactor():
+                latency = time.monotonic() - received
+                self.command_latency_last = latency
+                if latency > self.command_latency_max:
+                    self.command_latency_max = latency
+
+            if not self.run_marked:  # the MCU's run markers own a marked log
+                if new_mode == Mode.RUN_CONTINUOUS:
+                    run_id = data.get("run_id")
+                    if not self.run_logger.running or (run_id and run_id != self.run_logger.run_id):
+                        self.run_logger.start(run_id)
+                else:
+                    self.run_logger.stop()
 
             print(f"Received: Mode={self.mode.name}, Dir={self.direction.name}")
         except Exception as e:
             self.send_error(f"MQTT command error: {e}")
 
-    def set_contactor(self, state):
-        """Set contactor state: True for ON, False for OFF"""
-        self.pi.write(CONTACTOR_PIN, 1 if state else 0)
+    def handle_run_marker(self, data):
+        """MCU run start/stop marker: log under the shared run_id and report our clock offset."""
+        received = self.clock.now()
+        run_id = data.get("run_id")
+        if data["run_marker"] == "start":
+            self.run_logger.start(run_id)
+            self.run_marked = True
+        else:
+            self.run_logger.stop()
+            self.run_marked = False
+        self.client.publish(f"{DEVICE_ID}/run", json.dumps({
+            "run_id": run_id,
+            "event": data["run_marker"],
+            "offset": received - data.get("mcu_time", received),
+        }))
+
+    @property
+    def mode(self):
+        return self.command[0]
+
+    @property
+    def direction(self):
+        return self.command[1]
+
+    def desired_contactor(self):
+        mode, direction = self.command
+        return mode == Mode.RUN_CONTINUOUS and direction == Direction.ON
+
+    def apply_contactor(self):
+        """Drive the contactor to the commanded state; returns True if the pin was written."""
+        return self.set_contactor(self.desired_contactor())
+
+    def set_contactor(self, state, force=False):
+        """Set contactor state: True for ON, False for OFF. Only writes GPIO on a change."""
+        with self.contactor_lock:
+            if not force and state == self.contactor_commanded and self.contactor_state == int(state):
+                return False
+            self.pi.write(CONTACTOR_PIN, 1 if state else 0)
+            self.contactor_commanded = state
+            self.contactor_state = self.pi.read(CONTACTOR_PIN)
+            self.actuations += 1
+        if self.contactor_state != int(state):
+            self.readback_faults += 1
+            self.send_error(f"Contactor readback {self.contactor_state}, commanded {int(state)}")
         print(f"Contactor {'ON' if state else 'OFF'}")
+        return True
 
     def run(self):
+        """Readback watchdog: re-applies the commanded state if the pin drifted."""
         while self.running:
-            self.read_sensors()
-
-            if self.mode == Mode.IDLE:
-                self.set_contactor(False)
-            elif self.mode == Mode.RUN_CONTINUOUS:
-                if self.direction == Direction.ON:
-                    self.set_contactor(True)
-                else:
-                    self.set_contactor(False)
-            else:
-                self.set_contactor(False)
+            with self.contactor_lock:
+                self.contactor_state = self.pi.read(CONTACTOR_PIN)
+            if self.contactor_state != int(self.desired_contactor()):
+                self.apply_contactor()
+            time.sleep(CONTACTOR_CHECK_INTERVAL)
 
-            time.sleep(0.05)
+    def timing_stats(self):
+        return {
+            "actuations": self.actuations,
+            "readback_faults": self.readback_faults,
+            "command_latency_last_ms": round(self.command_latency_last * 1000, 3),
+            "command_latency_max_ms": round(self.command_latency_max * 1000, 3),
+            "sensor": {
+                "samples": self.sensor_samples,
+                "samples_per_sec": round(self.sensor_rate, 1),
+                "errors": self.sensor_errors,
+                "age_ms": round((self.clock.now() - self.sensor_time) * 1000, 1) if self.sensor_time else None,
+                "link": self.torque_sensor.stats(),
+            },
+            "clock": self.clock.stats(),
+        }
 
     def publish_status(self):
+        last_timing = 0.0
         while self.running:
-            contactor_state = self.pi.read(CONTACTOR_PIN)
             status = {
                 "mode": self.mode.value,
                 "direction": self.direction.value,
-                "contactor_state": contactor_state,
+                "contactor_state": self.contactor_state,
                 "rpm": round(self.rpm_value, 1),
                 "torque": round(self.torque_value, 2),
+                "ts": self.clock.stamp(self.sensor_time or None),
             }
-            self.client.publish(f"{DEVICE_ID}/data", json.dumps(status))
+            self.client.publish(f"{DEVICE_ID}/data", telemetry_codec.dumps("dcu_data", status, TELEMETRY_ENCODING))
+
+            now = time.monotonic()
+            if now - last_timing >= TIMING_PUBLISH_INTERVAL:
+                self.client.publish(f"{DEVICE_ID}/timing", json.dumps(self.timing_stats()))
+                last_timing = now
             time.sleep(0.2)
 
     def send_error(self, msg):
@@ -184,8 +279,9 @@ class ContactorController:
 
     def stop(self):
         self.running = False
+        self.run_logger.stop(wait=True)  # flush the run to disk before exiting
         self.client.loop_stop()
-        self.set_contactor(False)  # Ensure contactor is OFF when stopping
+        self.set_contactor(False, force=True)  # Ensure contactor is OFF when stopping
         self.pi.stop()
         print("DCU stopped.")
 
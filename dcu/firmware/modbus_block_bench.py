@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Sampling-rate benchmark: separate torque/RPM reads vs one block read.
+
+By default runs against a fake Modbus RTU slave on a local pty pair, which
+answers function 0x03 with CRC-correct frames and holds each frame for
+its on-the-wire time at --baud (11 bits per byte) plus --turnaround, so
+the numbers track a real 19200-baud link without hardware. Point --port
+at a real sensor or serial loopback to measure the actual device.
+
+    python3 modbus_block_bench.py [--baud 19200] [--reads 200] [--port /dev/ttyACM0]
+"""
+import argparse
+import os
+import struct
+import threading
+import time
+import tty
+
+from firmware import TORQUE_REGISTERS
+from modbus_driver import ModbusDriver, crc16
+
+
+class FakeSlave:
+    """Answers read_holding_registers on the master side of a pty."""
+
+    def __init__(self, baud, turnaround, slave_id=1):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.byte_time = 11.0 / baud
+        self.turnaround = turnaround
+        self.slave_id = slave_id
+        # torque -1234 (-123.4), rpm 14805 (1480.5), as big-endian int32 pairs
+        self.registers = list(struct.unpack('>4H', struct.pack('>ii', -1234, 14805)))
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        buf = b""
+        while True:
+            buf += os.read(self.master, 256)
+            while len(buf) >= 8:
+                request, buf = buf[:8], buf[8:]
+                unit, function, address, count = struct.unpack('>BBHH', request[:6])
+                if crc16(request[:6]) != request[6:] or function != 0x03:
+                    buf = b""
+                    break
+                words = [self.registers[a] if a < len(self.registers) else 0
+                         for a in range(address, address + count)]
+                body = struct.pack(f'>BBB{count}H', unit, function, 2 * count, *words)
+                response = body + crc16(body)
+                time.sleep((len(request) + len(response)) * self.byte_time + self.turnaround)
+                os.write(self.master, response)
+
+
+def bench(driver, reads, read_fn):
+    ok = 0
+    start = time.perf_counter()
+    for _ in range(reads):
+        if read_fn() is not None:
+            ok += 1
+    elapsed = time.perf_counter() - start
+    return ok / elapsed, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus block read benchmark")
+    parser.add_argument("--port", help="real serial port; default is a local fake slave")
+    parser.add_argument("--baud", type=int, default=19200)
+    parser.add_argument("--turnaround", type=float, default=0.002, help="fake slave reply delay, s")
+    parser.add_argument("--reads", type=int, default=200)
+    args = parser.parse_args()
+
+    port = args.port
+    if port is None:
+        port = FakeSlave(args.baud, args.turnaround).port
+    driver = ModbusDriver(port, args.baud, "N", 1, 8, 1, 1)
+    if not driver.connect():
+        print(f"Could not open {port}")
+        return
+
+    def separate():
+        torque = driver.read_parameter(0x00, 2, signed=True)
+        rpm = driver.read_parameter(0x02, 2, signed=True)
+        return None if torque is None or rpm is None else (torque / 10, rpm / 10)
+
+    def block():
+        return driver.read_map(TORQUE_REGISTERS)
+
+    print(f"port {port} at {args.baud} baud, {args.reads} samples each")
+    print(f"separate reads: {separate()}")
+    print(f"block read:     {block()}")
+    rate_sep, ok_sep = bench(driver, args.reads, separate)
+    rate_blk, ok_blk = bench(driver, args.reads, block)
+    print(f"{'method':<16} {'samples/s':>10} {'ok':>6}")
+    print(f"{'2 x int32 read':<16} {rate_sep:>10.1f} {ok_sep:>6}")
+    print(f"{'0x00-0x03 block':<16} {rate_blk:>10.1f} {ok_blk:>6}")
+    if rate_sep:
+        print(f"gain: {rate_blk / rate_sep:.2f}x")
+    driver.disconnect()
+
+
+if __name__ == "__main__":
+    main()
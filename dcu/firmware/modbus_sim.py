@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Modbus RTU simulator for tuning poll rates without hardware.
+
+Runs a pymodbus RTU-over-TCP server that serves the torque sensor
+register layout (torque int32 at 0x00, RPM int32 at 0x02, values moving
+over time), behind a small fault-injecting proxy that can add line
+delay, drop replies or corrupt their CRC. Then polls it with
+AsyncModbusDriver and reports the achieved rate and link statistics.
+
+    python3 modbus_sim.py --rate 0 --duration 10 --drop 0.02 --corrupt 0.01
+    python3 modbus_sim.py --serve-only   # then point a driver at socket://127.0.0.1:5020
+
+--baud sets the simulated line delay (11 bits per byte for request and
+reply) so the numbers are comparable with the real serial link.
+"""
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+
+from pymodbus import FramerType
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+from pymodbus.server import StartAsyncTcpServer
+
+from firmware import TORQUE_REGISTERS
+from modbus_driver import AsyncModbusDriver
+
+
+def make_context(slave_id):
+    store = ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0] * 16))
+    return ModbusServerContext(slaves={slave_id: store}, single=False), store
+
+
+async def update_registers(store):
+    """Move torque and RPM so reads see changing data."""
+    start = time.monotonic()
+    while True:
+        t = time.monotonic() - start
+        torque = int(1000 * math.sin(t))
+        rpm = int(15000 + 500 * math.sin(t / 3))
+        store.setValues(3, 0, list(struct.unpack('>4H', struct.pack('>ii', torque, rpm))))
+        await asyncio.sleep(0.01)
+
+
+class FaultProxy:
+    """TCP proxy in front of the server: line delay, dropped and corrupted replies."""
+
+    def __init__(self, upstream_port, baud, drop, corrupt):
+        self.upstream_port = upstream_port
+        self.byte_time = 11.0 / baud if baud else 0.0
+        self.drop = drop
+        self.corrupt = corrupt
+        self.dropped = 0
+        self.corrupted = 0
+
+    async def handle(self, reader, writer):
+        up_reader, up_writer = await asyncio.open_connection("127.0.0.1", self.upstream_port)
+        try:
+            while True:
+                request = await reader.read(256)
+                if not request:
+                    break
+                up_writer.write(request)
+                await up_writer.drain()
+                reply = await up_reader.read(256)
+                if not reply:
+                    break
+                await asyncio.sleep((len(request) + len(reply)) * self.byte_time)
+                if random.random() < self.drop:
+                    self.dropped += 1
+                    continue
+                if random.random() < self.corrupt:
+                    self.corrupted += 1
+                    reply = reply[:-1] + bytes([reply[-1] ^ 0xFF])
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            up_writer.close()
+            writer.close()
+
+
+async def poll(args, proxy):
+    driver = AsyncModbusDriver(f"socket://127.0.0.1:{args.port}", timeout=args.timeout,
+                               slave_id=args.slave, retries=args.retries)
+    interval = 1.0 / args.rate if args.rate else 0.0
+    samples = 0
+    next_t = start = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        if await driver.read_map(TORQUE_REGISTERS) is not None:
+            samples += 1
+        if interval:
+            next_t += interval
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    elapsed = time.monotonic() - start
+    await driver.close()
+
+    print(f"polled {args.duration:g}s at {'max' if not args.rate else args.rate} Hz, "
+          f"{args.baud} baud line delay")
+    print(f"good samples/sec: {samples / elapsed:.1f}")
+    print(f"proxy: dropped {proxy.dropped}, corrupted {proxy.corrupted}")
+    for key, value in driver.stats().items():
+        print(f"  {key:<18} {value}")
+
+
+async def main(args):
+    context, store = make_context(args.slave)
+    asyncio.create_task(update_registers(store))
+    asyncio.create_task(StartAsyncTcpServer(context, address=("127.0.0.1", args.port + 1),
+                                            framer=FramerType.RTU))
+    proxy = FaultProxy(args.port + 1, args.baud, args.drop, args.corrupt)
+    server = await asyncio.start_server(proxy.handle, "127.0.0.1", args.port)
+    await asyncio.sleep(0.5)  # let the Modbus server bind
+
+    if args.serve_only:
+        print(f"serving on socket://127.0.0.1:{args.port}")
+        async with server:
+            await server.serve_forever()
+    else:
+        await poll(args, proxy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modbus RTU simulator and poll-rate test")
+    parser.add_argument("--port", type=int, default=5020, help="proxy port; the server uses port+1")
+    parser.add_argument("--slave", type=int, default=1)
+    parser.add_argument("--baud", type=int, default=19200, help="simulated line rate, 0 for none")
+    parser.add_argument("--drop", type=float, default=0.0, help="fraction of replies dropped")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="fraction of replies with a bad CRC")
+    parser.add_argument("--timeout", type=float, default=0.1)
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0, help="poll Hz, 0 = as fast as possible")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--serve-only", action="store_true")
+    asyncio.run(main(parser.parse_args()))
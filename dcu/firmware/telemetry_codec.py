@@ -0,0 +1,216 @@
+"""
+Telemetry payload codec shared by the LCU, DCU, SDU and MCU.
+
+Each unit is deployed on its own, so every firmware/ directory carries an
+identical copy of this file. Change them together and bump
+CODEC_VERSION whenever a schema changes.
+
+Binary payloads start with MAGIC, then the codec version and a schema id;
+JSON payloads start with '{', so decode() tells them apart from the first
+byte and the topic names stay the same.
+
+A binary payload only carries its schema's fields. encode() counts any
+other key in `unknown_keys` and prints it the first time it is seen, so
+a field added to a unit's telemetry can't silently vanish on the way to
+the MCU when the unit publishes binary; add it to the schema instead.
+"""
+import json
+import struct
+import sys
+from array import array
+
+MAGIC = 0xB7
+CODEC_VERSION = 4
+HEADER = struct.Struct('<BBB')  # magic, version, schema id
+
+ENCODINGS = ("json", "binary")
+
+# Field spec: (key, struct code, scale). Scaled fields travel as integers
+# (value * scale) and are divided back on decode, so they round-trip
+# exactly at the resolution the units already publish.
+SCHEMAS = {
+    "lcu_data": (1, (
+        ("pos_ticks", "i", None),
+        ("pos_mm", "i", 1000),
+        ("load", "d", None),  # int32 register * 10: float32 would round it past 2**24
+        ("current_speed", "i", 1000),
+        ("ts", "d", None),
+    )),
+    "dcu_data": (2, (
+        ("mode", "B", None),
+        ("direction", "B", None),
+        ("contactor_state", "B", None),
+        ("rpm", "i", 10),
+        ("torque", "i", 100),
+        ("ts", "d", None),
+    )),
+    "sdu_sample": (3, (
+        ("DRILL_CURRENT", "h", 100),
+        ("POWER_CURRENT", "h", 100),
+        ("LINEAR_CURRENT", "h", 100),
+        ("ts", "d", None),
+    )),
+    # sdu_window is variable length, see _encode_sdu_window()
+    "sdu_window": (4, ()),
+}
+
+SDU_CHANNELS = ("DRILL", "POWER", "LINEAR")
+SDU_AGGREGATES = ("min", "max", "mean", "rms")
+SDU_WINDOW_HEAD = struct.Struct('<hhhdddIIfBI')  # stride and block length: uint32
+
+_BIG_ENDIAN = sys.byteorder != 'little'
+
+# Keys a binary payload carries, per schema (sdu_window: top level, then "window")
+SDU_WINDOW_KEYS = {"DRILL_CURRENT", "POWER_CURRENT", "LINEAR_CURRENT", "ts", "window"}
+SDU_WINDOW_INNER_KEYS = {"t_start", "t_end", "count", "stride", "scale", "samples", "stats"}
+
+unknown_keys = {}  # (schema, key) -> times encode() left it out
+
+_structs = {}
+_by_id = {}
+_keys = {}
+for _name, (_schema_id, _fields) in SCHEMAS.items():
+    _structs[_name] = struct.Struct('<' + ''.join(code for _, code, _ in _fields))
+    _by_id[_schema_id] = _name
+    _keys[_name] = {key for key, _, _ in _fields}
+_keys["sdu_window"] = SDU_WINDOW_KEYS
+
+
+def _count_unknown(schema, data, known):
+    for key in data:
+        if key not in known:
+            name = (schema, key)
+            if name not in unknown_keys:
+                print(f"[Codec] {schema}: '{key}' is not in the binary schema and is not sent")
+            unknown_keys[name] = unknown_keys.get(name, 0) + 1
+
+
+def encode(schema, data):
+    """Encode a telemetry dict as a binary payload for the given schema."""
+    schema_id, fields = SCHEMAS[schema]
+    header = HEADER.pack(MAGIC, CODEC_VERSION, schema_id)
+    _count_unknown(schema, data, _keys[schema])
+    if schema == "sdu_window":
+        return header + _encode_sdu_window(data)
+    values = []
+    for key, code, scale in fields:
+        value = data.get(key, 0) or 0
+        if scale:
+            value = round(value * scale)
+        elif code != 'f' and code != 'd':
+            value = int(value)
+        values.append(value)
+    return header + _structs[schema].pack(*values)
+
+
+def decode(payload):
+    """Decode a */data payload, binary or JSON, into a dict."""
+    if not payload:
+        raise ValueError("Empty payload")
+    if payload[0] != MAGIC:
+        return json.loads(payload)
+    if len(payload) < HEADER.size:
+        raise ValueError("Truncated binary payload")
+    _, version, schema_id = HEADER.unpack_from(payload)
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported codec version {version}")
+    schema = _by_id.get(schema_id)
+    if schema is None:
+        raise ValueError(f"Unknown schema id {schema_id}")
+    if schema == "sdu_window":
+        return _decode_sdu_window(payload, HEADER.size)
+    values = _structs[schema].unpack_from(payload, HEADER.size)
+    data = {}
+    for (key, code, scale), value in zip(SCHEMAS[schema][1], values):
+        if scale:
+            value = value / scale
+        elif code == 'f':
+            value = round(value, 4)
+        data[key] = value
+    return data
+
+
+def dumps(schema, data, encoding="json"):
+    """Serialize a telemetry dict with the configured encoding."""
+    if encoding == "binary":
+        return encode(schema, data)
+    return json.dumps(data, separators=(",", ":"))
+
+
+def _encode_sdu_window(data):
+    window = data["window"]
+    _count_unknown("sdu_window.window", window, SDU_WINDOW_INNER_KEYS)
+    scale = window.get("scale", 100.0)
+    stats = window.get("stats", {})
+    samples = window.get("samples", {})
+    first = stats.get(SDU_CHANNELS[0], {})
+    aggregates = [agg for agg in SDU_AGGREGATES if agg in first]
+    mask = 0
+    for i, agg in enumerate(SDU_AGGREGATES):
+        if agg in first:
+            mask |= 1 << i
+    block_len = len(samples.get(SDU_CHANNELS[0], ()))
+
+    out = bytearray(SDU_WINDOW_HEAD.pack(
+        round(data.get("DRILL_CURRENT", 0.0) * 100),
+        round(data.get("POWER_CURRENT", 0.0) * 100),
+        round(data.get("LINEAR_CURRENT", 0.0) * 100),
+        data.get("ts", 0.0),
+        window.get("t_start", 0.0),
+        window.get("t_end", 0.0),
+        window.get("count", 0),
+        window.get("stride", 1),
+        scale,
+        mask,
+        block_len,
+    ))
+    out += struct.pack(
+        f'<{len(SDU_CHANNELS) * len(aggregates)}f',
+        *(stats.get(ch, {}).get(agg, 0.0) for ch in SDU_CHANNELS for agg in aggregates)
+    )
+    for ch in SDU_CHANNELS:
+        block = array('h', samples.get(ch, ()))
+        if _BIG_ENDIAN:
+            block.byteswap()
+        out += block.tobytes()
+    return bytes(out)
+
+
+def _decode_sdu_window(payload, offset):
+    (drill, power, linear, ts, t_start, t_end, count, stride,
+     scale, mask, block_len) = SDU_WINDOW_HEAD.unpack_from(payload, offset)
+    offset += SDU_WINDOW_HEAD.size
+    aggregates = [agg for i, agg in enumerate(SDU_AGGREGATES) if mask & (1 << i)]
+    n_stats = len(SDU_CHANNELS) * len(aggregates)
+    values = struct.unpack_from(f'<{n_stats}f', payload, offset)
+    offset += 4 * n_stats
+
+    stats = {}
+    for c, ch in enumerate(SDU_CHANNELS):
+        row = values[c * len(aggregates):(c + 1) * len(aggregates)]
+        stats[ch] = {agg: round(v, 4) for agg, v in zip(aggregates, row)}
+
+    samples = {}
+    for ch in SDU_CHANNELS:
+        block = array('h')
+        block.frombytes(payload[offset:offset + 2 * block_len])
+        if _BIG_ENDIAN:
+            block.byteswap()
+        samples[ch] = block.tolist()
+        offset += 2 * block_len
+
+    return {
+        "DRILL_CURRENT": drill / 100,
+        "POWER_CURRENT": power / 100,
+        "LINEAR_CURRENT": linear / 100,
+        "ts": ts,
+        "window": {
+            "t_start": t_start,
+            "t_end": t_end,
+            "count": count,
+            "stride": stride,
+            "scale": scale,
+            "samples": samples,
+            "stats": stats,
+        },
+    }
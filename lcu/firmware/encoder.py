@@ -0,0 +1,124 @@
+"""
+Quadrature encoder decoding from pigpio edge callbacks.
+
+The callback's own (gpio, level, tick) arguments are enough to decode
+direction: both channel levels are tracked locally, so no pi.read()
+round-trips to the pigpio daemon are made per edge. Each edge's tick and
+resulting count go into a fixed ring that the control loop reads
+without locking (single writer: pigpio's callback thread).
+
+Velocity uses the 1/T method (time across the last few edges) at low
+speed, where edges are sparse, and the M method (counts over a fixed
+window) at high speed, where it is less noisy.
+"""
+from collections import deque
+
+TICK_WRAP = 1 << 32          # pigpio ticks are uint32 microseconds
+EDGE_HISTORY = 64
+T_EDGES = 8                  # edges averaged by the 1/T estimate
+M_WINDOW_US = 50_000         # M-method window
+M_MIN_COUNTS = 32            # use M method once this many counts fall in the window
+STOP_TIMEOUT_US = 200_000    # no edge for this long -> speed 0
+
+
+def tick_diff(later, earlier):
+    return (later - earlier) % TICK_WRAP
+
+
+class QuadratureEncoder:
+    def __init__(self, gpio_a, gpio_b, level_a=0, level_b=0):
+        self.gpio_a = gpio_a
+        self.gpio_b = gpio_b
+        self.level_a = level_a
+        self.level_b = level_b
+        self.count = 0
+        self.errors = 0
+        self.edges = 0
+
+        self.edge_ticks = [0] * EDGE_HISTORY
+        self.edge_counts = [0] * EDGE_HISTORY
+        self.edge_index = 0  # next slot to write; bumped after the slot is filled
+
+        self.samples = deque()  # (tick, count) taken by velocity() for the M method
+
+    def callback(self, gpio, level, tick):
+        """pigpio callback: decode one edge from the reported level."""
+        if level > 1:
+            return  # watchdog timeout, not an edge
+        if gpio == self.gpio_a:
+            if level == self.level_a:
+                self.errors += 1  # repeated level: an edge was missed
+                return
+            self.level_a = level
+            delta = -1 if level == self.level_b else 1
+        elif gpio == self.gpio_b:
+            if level == self.level_b:
+                self.errors += 1
+                return
+            self.level_b = level
+            delta = -1 if self.level_a != level else 1
+        else:
+            return
+
+        count = self.count + delta
+        self.count = count
+        i = self.edge_index % EDGE_HISTORY
+        self.edge_ticks[i] = tick
+        self.edge_counts[i] = count
+        self.edge_index += 1
+        self.edges += 1
+
+    def last_edges(self, n):
+        """Up to n most recent (tick, count) edges, oldest first."""
+        end = self.edge_index
+        n = min(n, end, EDGE_HISTORY - 1)
+        out = []
+        for j in range(end - n, end):
+            i = j % EDGE_HISTORY
+            out.append((self.edge_ticks[i], self.edge_counts[i]))
+        return out
+
+    def velocity_t(self, now_tick):
+        """1/T estimate in counts/s from the most recent edge intervals."""
+        edges = self.last_edges(T_EDGES + 1)
+        if not edges:
+            return 0.0
+        last_tick, last_count = edges[-1]
+        since_last = tick_diff(now_tick, last_tick)
+        if since_last > STOP_TIMEOUT_US or len(edges) < 2:
+            return 0.0
+        first_tick, first_count = edges[0]
+        span = tick_diff(last_tick, first_tick)
+        if span == 0:
+            return 0.0
+        velocity = (last_count - first_count) * 1e6 / span
+        # Slowing down: the time since the last edge bounds the speed
+        per_edge = span / (len(edges) - 1)
+        if since_last > per_edge:
+            velocity *= per_edge / since_last
+        return velocity
+
+    def velocity_m(self, now_tick, count):
+        """M estimate in counts/s over the last M_WINDOW_US of samples."""
+        samples = self.samples
+        while len(samples) > 1 and tick_diff(now_tick, samples[1][0]) >= M_WINDOW_US:
+            samples.popleft()
+        if not samples:
+            return 0.0, 0
+        start_tick, start_count = samples[0]
+        span = tick_diff(now_tick, start_tick)
+        if span == 0:
+            return 0.0, 0
+        return (count - start_count) * 1e6 / span, count - start_count
+
+    def velocity(self, now_tick):
+        """Velocity in counts/s. Call periodically with pi.get_current_tick()."""
+        count = self.count
+        v_m, window_counts = self.velocity_m(now_tick, count)
+        self.samples.append((now_tick, count))
+        if abs(window_counts) >= M_MIN_COUNTS:
+            return v_m
+        return self.velocity_t(now_tick)
+
+    def stats(self):
+        return {"count": self.count, "edges": self.edges, "errors": self.errors}
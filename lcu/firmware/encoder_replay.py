@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Replay harness for the LCU encoder decoder.
+
+Generates synthetic quadrature edge streams (gpio, level, tick) and feeds
+them straight into QuadratureEncoder.callback, the way pigpio would.
+Reports per-edge callback cost and the implied maximum edge rate, checks
+the decoded count, and compares the velocity estimate against the true
+speed across a low/high speed profile.
+
+The old callback is replayed too, against a fake pi whose read() costs
+--read-latency microseconds per call to stand in for the pigpio socket
+round trip.
+
+    python3 encoder_replay.py [--edges N] [--read-latency 60]
+"""
+import argparse
+import time
+
+from encoder import QuadratureEncoder, TICK_WRAP
+
+ENC_A, ENC_B = 20, 21
+PULSES_PER_MM = 667
+
+# Gray-code sequence for forward motion, as (A, B) levels
+FORWARD = [(0, 0), (1, 0), (1, 1), (0, 1)]
+START_TICK = TICK_WRAP - 500_000  # just below the uint32 wrap
+
+
+def edge_stream(profile, start_tick=START_TICK):
+    """Yield (gpio, level, tick) for a list of (duration_s, speed_mmps) segments.
+
+    start_tick sits just below the uint32 wrap so tick wrap-around is exercised.
+    """
+    state = 0
+    tick = float(start_tick)
+    for duration, speed in profile:
+        segment_end = tick + duration * 1e6
+        if speed == 0:
+            tick = segment_end
+            continue
+        edge_us = 1e6 / (abs(speed) * PULSES_PER_MM)
+        step = 1 if speed > 0 else -1
+        for _ in range(int(duration * 1e6 / edge_us)):
+            prev = FORWARD[state]
+            state = (state + step) % 4
+            a, b = FORWARD[state]
+            tick += edge_us
+            if a != prev[0]:
+                yield ENC_A, a, int(tick) % TICK_WRAP
+            else:
+                yield ENC_B, b, int(tick) % TICK_WRAP
+        tick = segment_end
+
+
+def expected_count(profile):
+    return sum(int(d * abs(s) * PULSES_PER_MM) * (1 if s > 0 else -1) for d, s in profile if s)
+
+
+class FakePi:
+    """Stands in for pigpio.pi() in the legacy callback."""
+
+    def __init__(self, read_latency_us):
+        self.levels = {ENC_A: 0, ENC_B: 0}
+        self.read_latency = read_latency_us / 1e6
+
+    def read(self, gpio):
+        if self.read_latency:
+            end = time.perf_counter() + self.read_latency
+            while time.perf_counter() < end:
+                pass
+        return self.levels[gpio]
+
+
+class LegacyEncoder:
+    """The pre-QuadratureEncoder MotorSystem._encoder_callback."""
+
+    def __init__(self, pi):
+        self.pi = pi
+        self.encoder_pos = 0
+
+    def _encoder_callback(self, gpio, level, tick):
+        A = self.pi.read(ENC_A)
+        B = self.pi.read(ENC_B)
+        delta = 0
+        if gpio == ENC_A:
+            delta = -1 if A == B else 1
+        elif gpio == ENC_B:
+            delta = -1 if A != B else 1
+        self.encoder_pos += delta
+
+
+def bench_callback(edges, fn, fake_pi=None):
+    start = time.perf_counter()
+    for gpio, level, tick in edges:
+        if fake_pi is not None:
+            fake_pi.levels[gpio] = level
+        fn(gpio, level, tick)
+    return (time.perf_counter() - start) / max(len(edges), 1)
+
+
+def velocity_error(profile, sample_us=10_000):
+    """Run the profile edge by edge, sampling velocity like the 10 ms control loop."""
+    encoder = QuadratureEncoder(ENC_A, ENC_B)
+    rows = []
+    next_sample = (START_TICK + sample_us) % TICK_WRAP
+    seg_bounds = []
+    t = 0.0
+    for duration, speed in profile:
+        seg_bounds.append((t, t + duration, speed))
+        t += duration
+
+    for gpio, level, tick in edge_stream(profile):
+        while (tick - next_sample) % TICK_WRAP < TICK_WRAP // 2:
+            elapsed = ((next_sample - START_TICK) % TICK_WRAP) / 1e6
+            v = encoder.velocity(next_sample) / PULSES_PER_MM
+            true = next((s for a, b, s in seg_bounds if a <= elapsed < b), 0.0)
+            rows.append((elapsed, true, v))
+            next_sample = (next_sample + sample_us) % TICK_WRAP
+        encoder.callback(gpio, level, tick)
+
+    report = {}
+    for a, b, speed in seg_bounds:
+        # Skip the first 100 ms of each segment while the estimate settles
+        errs = [abs(v - true) for e, true, v in rows if a + 0.1 <= e < b]
+        if errs:
+            report[(a, b, speed)] = (sum(errs) / len(errs), max(errs))
+    return report, encoder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder decoder replay harness")
+    parser.add_argument("--edges", type=int, default=200_000, help="edges for the cost benchmark")
+    parser.add_argument("--read-latency", type=float, default=60.0,
+                        help="simulated pi.read() round trip for the legacy callback, us")
+    args = parser.parse_args()
+
+    speed = 5.0
+    duration = args.edges / (speed * PULSES_PER_MM)
+    edges = list(edge_stream([(duration, speed)]))
+
+    encoder = QuadratureEncoder(ENC_A, ENC_B)
+    new_cost = bench_callback(edges, encoder.callback)
+    fake_pi = FakePi(args.read_latency)
+    legacy = LegacyEncoder(fake_pi)
+    legacy_edges = edges[:max(len(edges) // 20, 1000)]
+    legacy_cost = bench_callback(legacy_edges, legacy._encoder_callback, fake_pi)
+
+    print(f"Replayed {len(edges)} edges")
+    print(f"{'callback':<22} {'us/edge':>10} {'max edges/s':>14} {'max mm/s':>10}")
+    for name, cost in (("QuadratureEncoder", new_cost),
+                       (f"legacy ({args.read_latency:g} us read)", legacy_cost)):
+        rate = 1.0 / cost if cost > 0 else float("inf")
+        print(f"{name:<22} {cost * 1e6:>10.2f} {rate:>14,.0f} {rate / PULSES_PER_MM:>10.1f}")
+    print(f"count: decoded {encoder.count}, expected {len(edges)}, errors {encoder.errors}")
+
+    profile = [(0.5, 0.05), (0.5, 0.5), (0.5, 2.0), (0.3, 0.0), (0.5, -1.0), (0.5, -0.02)]
+    report, enc = velocity_error(profile)
+    print("\nVelocity estimate vs true speed (10 ms sampling)")
+    print(f"{'segment':<16} {'true mm/s':>10} {'mean err':>10} {'max err':>10}")
+    for (a, b, speed), (mean_err, max_err) in report.items():
+        print(f"{a:>5.1f}-{b:<5.1f} s    {speed:>10.3f} {mean_err:>10.4f} {max_err:>10.4f}")
+    print(f"profile count: decoded {enc.count}, expected {expected_count(profile)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import time
 import json
+import os
 import threading
-import struct
 import csv
 from enum import Enum
 from queue import Queue
@@ -9,99 +9,26 @@ from queue import Queue
 import paho.mqtt.client as mqtt
 import pigpio
 
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
+import telemetry_codec
+from modbus_driver import ModbusDriver, Register, RegisterMap
+from encoder import QuadratureEncoder
+from loop_timing import PeriodicScheduler, LogWorker
+from load_sampler import LoadCellSampler
+from run_logger import RunLogger
+from clock_sync import ClockClient
 
-class LoadCellDriver:
+LOAD_REGISTERS = RegisterMap([
+    Register("load", 0x00, "int32", 10),
+])
+
+class LoadCellDriver(ModbusDriver):
     def __init__(self, port, baudrate, parity, stopbits, bytesize, timeout, slave_id, scale_factor=100):
-        self.client = ModbusSerialClient(
-            port=port,
-            baudrate=baudrate,
-            timeout=timeout,
-            parity=parity,
-            stopbits=stopbits,
-            bytesize=bytesize
-        )
-        self.slave_id = slave_id
-        self.connected = False
+        super().__init__(port, baudrate, parity, stopbits, bytesize, timeout, slave_id)
         self.scale_factor = scale_factor
 
-    def __del__(self):
-        try:
-            self.client.close()
-        except:
-            pass
-
-    def connect(self):
-        try:
-            self.connected = self.client.connect()
-            return self.connected
-        except Exception as e:
-            print(f"Failed to connect: {e}")
-            return False
-
-    def disconnect(self):
-        try:
-            self.client.close()
-            self.connected = False
-            print("Successfully disconnected")
-        except Exception as e:
-            print(f"Failed to disconnect: {e}")
-
-    def read_parameter(self, address, length=1, signed=False):
-        """
-        Reads `length` registers starting at `address`, unpacks as signed if requested,
-        then divides by scale_factor to apply the 1/100 scaling.
-        """
-        if not self.connected:
-            print("Not connected")
-            return None
-
-        try:
-            response = self.client.read_holding_registers(address=address, count=length, slave=self.slave_id)
-            if response.isError():
-                print(f"Failed to read parameter at address {hex(address)}")
-                return None
-            # unpack raw value
-            if length == 1:
-                raw = response.registers[0]
-                if signed:
-                    raw = struct.unpack('>h', struct.pack('>H', raw))[0]
-            else:  # length == 2
-                raw = (response.registers[0] << 16) | response.registers[1]
-                if signed:
-                    raw = struct.unpack('>i', struct.pack('>I', raw))[0]
-
-            scaled = raw * 10
-            return scaled
-
-        except ModbusException as e:
-            print(f"ModbusException at {hex(address)}: {e}")
-        except Exception as e:
-            print(f"Unexpected error at {hex(address)}: {e}")
-        return None
-
-    def write_parameter(self, address, value):
-        """
-        Writes a single register. `value` should be the unscaled integer.
-        """
-        if not self.connected:
-            print("Not connected")
-            return False
-
-        try:
-            response = self.client.write_register(address, int(value), slave=self.slave_id)
-            if response.isError():
-                print(f"Failed to write {value} to {hex(address)}")
-                return False
-            print(f"Wrote {value} to {hex(address)}")
-            return True
-
-        except ModbusException as e:
-            print(f"ModbusException at {hex(address)}: {e}")
-        except Exception as e:
-            print(f"Unexpected error at {hex(address)}: {e}")
-        return False
+    def read_load(self):
+        values = self.read_map(LOAD_REGISTERS)
+        return values["load"] if values is not None else None
 
 # ----------------------------------------------------
 # PIDController, Enums, Constants (unchanged)
@@ -161,7 +88,6 @@ PULSES_PER_MM       = 667
 PWM_FREQ           = 20000
 SPEED_SAMPLE_INTERVAL_MS = 50
 MAX_SPEED_MMPS     = 2
-SPEED_WINDOW       = 10
 INTEGRAL_MAX       = 5.0
 INTEGRAL_MIN       = -5.0
 DUTY_MIN           = 5.0
@@ -170,13 +96,24 @@ ERROR_TOLERANCE    = 0.002
 HOMING_SPEED       = 50
 HOMING_TIMEOUT     = 15.0
 MAX_HOMING_RETRIES = 3
-PID_UPDATE_INTERVAL = 0.001
+CONTROL_PERIOD     = 0.01    # fixed control loop period, seconds; the PID gains are tuned for 10 ms
+STATUS_LOG_INTERVAL = 5.0
+TIMING_PUBLISH_INTERVAL = 1.0
+PUBLISH_PERIOD     = 0.2     # lcu/data period, independent of Modbus latency
+LOAD_CELL_TIMEOUT  = 0.1     # a reply at 9600 baud takes ~20 ms
+TELEMETRY_ENCODING = "json"  # "json" or "binary", see telemetry_codec.py
+
+# Every control tick is logged locally while in RUN_CONTINUOUS
+RUN_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_logs")
+RUN_LOG_FIELDS = (("pos_ticks", "i"), ("speed_mmps", "f"), ("target", "f"),
+                  ("duty", "f"), ("direction", "B"), ("load", "f"))
 
 LOAD_X_OFFSET = 1.5195
 LOAD_Y_OFFSET = -0.5699
 
 class MotorSystem:
     def __init__(self):
+        self.clock = ClockClient()
         self.client = mqtt.Client()
         self.client.connect(BROKER_IP, 1883, 60)
         self.client.loop_start()
@@ -186,19 +123,15 @@ class MotorSystem:
         self.mode = Mode.IDLE
         self.direction = Direction.IDLE
         self.target = 0.0
-        self.encoder_pos = 0
         self.offset = 0
-        self.last_encoder_pos = 0
         self.current_speed = 0.0
         self.is_homed = False
         self.homing_in_progress = False
-        self.last_speed_time = time.monotonic()
-        self.last_pid_update = 0.0
         self.state_lock = threading.Lock()
-        self.tick_history = [0] * SPEED_WINDOW
-        self.tick_index = 0
 
         self.speed_pid = PIDController(8.0, 1.0, 0.3, 50.0, 0.2)
+        self.scheduler = PeriodicScheduler(CONTROL_PERIOD)
+        self.log = LogWorker()
 
         self.pi = pigpio.pi()
         for pin in MOTOR_PINS.values():
@@ -209,8 +142,9 @@ class MotorSystem:
         self.pi.set_mode(ENC_B, pigpio.INPUT)
         self.pi.set_pull_up_down(ENC_A, pigpio.PUD_UP)
         self.pi.set_pull_up_down(ENC_B, pigpio.PUD_UP)
-        self.pi.callback(ENC_A, pigpio.EITHER_EDGE, self._encoder_callback)
-        self.pi.callback(ENC_B, pigpio.EITHER_EDGE, self._encoder_callback)
+        self.encoder = QuadratureEncoder(ENC_A, ENC_B, self.pi.read(ENC_A), self.pi.read(ENC_B))
+        self.pi.callback(ENC_A, pigpio.EITHER_EDGE, self.encoder.callback)
+        self.pi.callback(ENC_B, pigpio.EITHER_EDGE, self.encoder.callback)
 
         self.load_cell = LoadCellDriver(
             port="/dev/ttyUSB0",
@@ -218,7 +152,7 @@ class MotorSystem:
             parity='N',
             stopbits=1,
             bytesize=8,
-            timeout=1,
+            timeout=LOAD_CELL_TIMEOUT,
             slave_id=1,
             scale_factor=100
         )
@@ -226,30 +160,25 @@ class MotorSystem:
             print("Load cell connected")
         else:
             print("Load cell connection failed")
+        self.load_sampler = LoadCellSampler(self.load_cell, clock=self.clock.now)
 
-        # self.logger = HighSpeedLogger()
+        self.run_logger = RunLogger(RUN_LOG_DIR, DEVICE_ID, RUN_LOG_FIELDS)
+        self.run_marked = False  # log started by an MCU run_marker: only its stop marker ends it
 
         self.running = True
+        self.load_sampler.start()
         threading.Thread(target=self.run_loop, daemon=True).start()
         threading.Thread(target=self.send_data_loop, daemon=True).start()
 
-    def _encoder_callback(self, gpio, level, tick):
-        A = self.pi.read(ENC_A)
-        B = self.pi.read(ENC_B)
-        delta = 0
-
-        if gpio == ENC_A:
-            delta = -1 if A == B else 1
-        elif gpio == ENC_B:
-            delta = -1 if A != B else 1
-
-        self.encoder_pos += delta
+    @property
+    def encoder_pos(self):
+        return self.encoder.count
 
     def get_position_ticks(self):
         return self.encoder_pos - self.offset
 
-    def get_speed_mmps(self, prev_ticks, new_ticks, dt_sec):
-        return (new_ticks - prev_ticks) / PULSES_PER_MM / dt_sec
+    def get_speed_mmps(self):
+        return self.encoder.velocity(self.pi.get_current_tick()) / PULSES_PER_MM
 
     def control_motor(self, duty_percent, direction):
         duty = int(1_000_000 * max(min(duty_percent, DUTY_MAX), DUTY_MIN) / 100)
@@ -274,6 +203,12 @@ class MotorSystem:
     def on_message(self, client, userdata, msg):
         try:
             data = json.loads(msg.payload.decode())
+            if 'clock_ping' in data:
+                self.client.publish(f"{DEVICE_ID}/clock", json.dumps(self.clock.on_ping(data)))
+                return
+            if 'run_marker' in data:
+                self.handle_run_marker(data)
+                return
             with self.state_lock:
                 if 'mode' in data:
                     new_mode = Mode(data['mode'])
@@ -287,10 +222,33 @@ class MotorSystem:
                     self.direction = Direction(data['direction'])
                 if 'target' in data:
                     self.target = float(data['target'])
+            if 'mode' in data and not self.run_marked:  # the MCU's run markers own a marked log
+                if self.mode == Mode.RUN_CONTINUOUS:
+                    run_id = data.get('run_id')
+                    if not self.run_logger.running or (run_id and run_id != self.run_logger.run_id):
+                        self.run_logger.start(run_id)
+                elif self.mode == Mode.IDLE:
+                    self.run_logger.stop()
             print(f"Cmd: mode={self.mode}, dir={self.direction}, tgt={self.target}")
         except Exception as e:
             print(f"MQTT parse error: {e}")
 
+    def handle_run_marker(self, data):
+        """MCU run start/stop marker: log under the shared run_id and report our clock offset."""
+        received = self.clock.now()
+        run_id = data.get("run_id")
+        if data["run_marker"] == "start":
+            self.run_logger.start(run_id)
+            self.run_marked = True
+        else:
+            self.run_logger.stop()
+            self.run_marked = False
+        self.client.publish(f"{DEVICE_ID}/run", json.dumps({
+            "run_id": run_id,
+            "event": data["run_marker"],
+            "offset": received - data.get("mcu_time", received),
+        }))
+
     def _do_homing(self):
         if self.homing_in_progress:
             return
@@ -309,7 +267,7 @@ class MotorSystem:
             curr_pos = self.encoder_pos
             delta = abs(curr_pos - last_pos)
 
-            print(f"  Homing... encoder: {curr_pos} | delta: {delta}")
+            self.log.log(f"  Homing... encoder: {curr_pos} | delta: {delta}")
             if delta == 0:
                 still_counter += 1
             else:
@@ -332,91 +290,103 @@ class MotorSystem:
         print("Homing complete. Encoder virtual zero set.")
         self.is_homed = True
         self.homing_in_progress = False
+        # Homing blocks the control thread for seconds; don't count it as an overrun
+        self.scheduler.reset()
 
     def run_loop(self):
+        last_status_log = 0.0
+        last_mode = None
         while self.running:
-            now = time.monotonic()
-            dt = now - self.last_speed_time
-            if dt > 0:
-                curr_ticks = self.get_position_ticks()
-                avg_speed = self.get_speed_mmps(self.tick_history[self.tick_index], curr_ticks, dt * SPEED_WINDOW)
-                self.tick_history[self.tick_index] = curr_ticks
-                self.tick_index = (self.tick_index + 1) % SPEED_WINDOW
-                self.current_speed = avg_speed
-                self.last_speed_time = now
+            now = self.scheduler.wait()
+            self.current_speed = self.get_speed_mmps()
+            duty = 0.0
 
             with self.state_lock:
                 mode, direction, tgt = self.mode, self.direction, self.target
 
-            if int(now) % 5 == 0:
-                print(f"Run loop: mode={mode}, dir={direction}, tgt={tgt}")
+            if now - last_status_log >= STATUS_LOG_INTERVAL:
+                self.log.log(f"Run loop: mode={mode}, dir={direction}, tgt={tgt}, "
+                             f"speed={self.current_speed:.3f}")
+                last_status_log = now
 
             if mode == Mode.HOMING:
                 self._do_homing()
             elif mode == Mode.RUN_CONTINUOUS:
                 if not self.is_homed:
                     self._do_homing()
-                elif now - self.last_pid_update >= PID_UPDATE_INTERVAL:
-                    # Check if direction is IDLE first - if so, stop immediately
-                    if direction == Direction.IDLE:
-                        self.control_motor(0, Direction.IDLE)
-                        self.speed_pid.reset()  # Reset PID to clear accumulated error
-                        self.last_pid_update = now
+                # Check if direction is IDLE first - if so, stop immediately
+                elif direction == Direction.IDLE:
+                    self.control_motor(0, Direction.IDLE)
+                    self.speed_pid.reset()  # Reset PID to clear accumulated error
+                else:
+                    # Use the direction directly from the command
+                    if direction == Direction.FW:
+                        ref = tgt
+                        dir_ = Direction.FW
                     else:
-                        # Use the direction directly from the command
-                        if direction == Direction.FW:
-                            ref = tgt
-                            dir_ = Direction.FW
-                        elif direction == Direction.BW:
-                            ref = -tgt
-                            dir_ = Direction.BW
-                        else:
-                            ref = 0
-                            dir_ = Direction.IDLE
-                            self.speed_pid.reset()
-                        
-                        out = self.speed_pid.compute(ref, self.current_speed)
-                        duty = abs(out)
-                        # Force duty to 0 when direction is IDLE
-                        if dir_ == Direction.IDLE:
-                            duty = 0
-                        self.control_motor(duty, dir_)
-                        self.last_pid_update = now
+                        ref = -tgt
+                        dir_ = Direction.BW
+
+                    out = self.speed_pid.compute(ref, self.current_speed)
+                    duty = abs(out)
+                    self.control_motor(duty, dir_)
             elif mode == Mode.IDLE:
                 self.control_motor(0, Direction.IDLE)
                 self.speed_pid.reset()  # Reset PID when in IDLE mode
-                print("IDLE mode - motor stopped")
+                if last_mode != Mode.IDLE:
+                    self.log.log("IDLE mode - motor stopped")
             else:
                 self.control_motor(0, Direction.IDLE)
-
-            time.sleep(0.01)
+            last_mode = mode
+
+            if self.run_logger.running:
+                latest = self.load_sampler.fresh()
+                self.run_logger.log(self.clock.now(), (
+                    self.encoder_pos, self.current_speed, tgt, duty,
+                    direction.value, latest[1] if latest else 0.0,
+                ))
+
+    def timing_stats(self):
+        stats = self.scheduler.stats()
+        stats["log_dropped"] = self.log.dropped
+        stats["encoder"] = self.encoder.stats()
+        stats["load_cell"] = self.load_sampler.stats()
+        stats["clock"] = self.clock.stats()
+        return stats
 
     def send_data_loop(self):
+        last_timing = 0.0
+        publish_schedule = PeriodicScheduler(PUBLISH_PERIOD)
         while self.running:
+            publish_schedule.wait()
             pos_ticks = self.encoder_pos
+            captured  = self.clock.now()
             pos_mm    = pos_ticks / PULSES_PER_MM
             # pos_in    = pos_mm / 25.4
-            load_val  = 0.0
-            try:
-                load_val = self.load_cell.read_parameter(0x00, length=2, signed=True) or 0.0
-                # load_val = ((float(load_val)-LOAD_Y_OFFSET)/LOAD_X_OFFSET)
-            except Exception:
-                pass
+            latest    = self.load_sampler.fresh()
+            load_val  = latest[1] if latest else 0.0
+            # load_val = ((float(load_val)-LOAD_Y_OFFSET)/LOAD_X_OFFSET)
 
             data = {
                 "pos_ticks": pos_ticks,
                 "pos_mm": round(pos_mm, 3),
                 "load": load_val,
                 "current_speed": round(self.current_speed, 3),
+                "ts": self.clock.stamp(captured),
             }
 
-            self.client.publish(f"{DEVICE_ID}/data", json.dumps(data))
-            time.sleep(0.2)
+            self.client.publish(f"{DEVICE_ID}/data", telemetry_codec.dumps("lcu_data", data, TELEMETRY_ENCODING))
+
+            now = time.monotonic()
+            if now - last_timing >= TIMING_PUBLISH_INTERVAL:
+                self.client.publish(f"{DEVICE_ID}/timing", json.dumps(self.timing_stats()))
+                last_timing = now
 
     def stop(self):
         self.running = False
+        self.load_sampler.stop()
         self.control_motor(0, Direction.IDLE)
-        # self.logger.stop()
+        self.run_logger.stop(wait=True)  # flush the run to disk before exiting
         self.client.loop_stop()
         self.pi.stop()
         self.load_cell.disconnect()
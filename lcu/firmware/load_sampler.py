@@ -0,0 +1,125 @@
+"""
+Load-cell sampler thread.
+
+Polls the load cell back to back, as fast as the Modbus link answers,
+and timestamps each reading. The publisher never touches the serial
+port: it reads `latest`, a (time, value) tuple that is swapped in with
+a single reference assignment (atomic under the GIL, so no lock),
+through fresh(), which returns None once the reading is older than
+STALE_AFTER: a dead or erroring load cell must not keep publishing its
+last good value. Every reading also goes into a fixed history ring;
+history(since) returns the ones newer than a time, and stats() uses it
+for the min/max/mean over the last RATE_WINDOW. Times come from `clock`
+(the unit's ClockClient.now in the firmware, see clock_sync.py).
+
+Reconnects and link counters are the driver's job (modbus_driver.py);
+a read during reconnect backoff just returns None.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+LOAD_HISTORY = 4096
+ERROR_BACKOFF = 0.05       # pause after a failed read so a dead link doesn't spin
+RATE_WINDOW = 1.0          # seconds over which samples/sec is computed
+STALE_AFTER = 0.25         # a reading older than this is no reading (a few failed polls)
+
+
+class LoadCellSampler:
+    def __init__(self, driver, capacity=LOAD_HISTORY, clock=time.time, stale_after=STALE_AFTER):
+        self.driver = driver
+        self.clock = clock
+        self.stale_after = stale_after
+
+        self.latest = None  # (clock(), value) of the last good reading
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.capacity = capacity
+        self.index = 0  # total samples written; slot is index % capacity
+
+        self.samples = 0
+        self.errors = 0
+        self.read_last = 0.0
+        self.read_max = 0.0
+        self.rate = 0.0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        window_start = time.monotonic()
+        window_samples = 0
+        while self.running:
+            start = time.monotonic()
+            try:
+                value = self.driver.read_load()
+            except Exception:
+                value = None
+            end = time.monotonic()
+            self.read_last = end - start
+            if self.read_last > self.read_max:
+                self.read_max = self.read_last
+
+            if value is None:
+                self.errors += 1
+                time.sleep(ERROR_BACKOFF)
+            else:
+                # Stamp at the midpoint of the transaction
+                t = self.clock() - (end - start) / 2
+                self._record(t, float(value))
+                window_samples += 1
+
+            if end - window_start >= RATE_WINDOW:
+                self.rate = window_samples / (end - window_start)
+                window_start = end
+                window_samples = 0
+
+    def _record(self, t, value):
+        i = self.index % self.capacity
+        self.times[i] = t
+        self.values[i] = value
+        self.index += 1
+        self.samples += 1
+        self.latest = (t, value)
+
+    def history(self, since=0.0):
+        """(times, values) lists of readings newer than `since`, oldest first."""
+        end = self.index
+        n = min(end, self.capacity)
+        start = end - n
+        times = [self.times[j % self.capacity] for j in range(start, end)]
+        values = [self.values[j % self.capacity] for j in range(start, end)]
+        k = bisect_right(times, since)
+        return times[k:], values[k:]
+
+    def fresh(self):
+        """(time, value) of the last reading if it is recent enough to publish, else None."""
+        latest = self.latest
+        if latest is None or self.clock() - latest[0] > self.stale_after:
+            return None
+        return latest
+
+    def stats(self):
+        latest = self.latest
+        _, recent = self.history(self.clock() - RATE_WINDOW)
+        return {
+            "samples": self.samples,
+            "samples_per_sec": round(self.rate, 1),
+            "errors": self.errors,
+            "read_last_ms": round(self.read_last * 1000, 2),
+            "read_max_ms": round(self.read_max * 1000, 2),
+            "age_ms": round((self.clock() - latest[0]) * 1000, 1) if latest else None,
+            "recent": {
+                "count": len(recent),
+                "min": min(recent),
+                "max": max(recent),
+                "mean": round(sum(recent) / len(recent), 3),
+            } if recent else None,
+            "link": self.driver.stats(),
+        }
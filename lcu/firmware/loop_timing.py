@@ -0,0 +1,109 @@
+"""
+Fixed-rate scheduling for the control loop.
+
+PeriodicScheduler wakes on absolute deadlines (start + k * period) rather
+than sleeping a fixed amount after each iteration, so work time and sleep
+overshoot don't accumulate into drift. On Linux, Python 3.11+ time.sleep
+is clock_nanosleep(CLOCK_MONOTONIC) underneath. A late wake-up that
+misses whole periods counts as an overrun and the schedule skips ahead
+to the next deadline instead of bursting to catch up.
+
+LogWorker moves print() off the control thread: log() only queues the
+message, a daemon thread does the (possibly blocking) terminal I/O.
+"""
+import threading
+import time
+from array import array
+from queue import Queue, Full
+
+JITTER_HISTORY = 2048
+
+
+class PeriodicScheduler:
+    def __init__(self, period, history=JITTER_HISTORY):
+        self.period = period
+        self.next_deadline = None
+        self.last_wake = None
+
+        self.iterations = 0
+        self.overruns = 0
+        self.missed_periods = 0
+        self.jitter = array('d', bytes(8 * history))  # wake - deadline, seconds
+        self.jitter_index = 0
+        self.jitter_max = 0.0
+        self.period_last = 0.0
+        self.work_last = 0.0
+        self.work_max = 0.0
+
+    def wait(self):
+        """Sleep until the next deadline; returns the wake time (time.monotonic())."""
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        else:
+            if self.last_wake is not None:
+                work = now - self.last_wake
+                self.work_last = work
+                if work > self.work_max:
+                    self.work_max = work
+            self.next_deadline += self.period
+            if now > self.next_deadline:
+                # Overran the deadline: skip the missed periods, stay on the grid
+                missed = int((now - self.next_deadline) / self.period) + 1
+                self.overruns += 1
+                self.missed_periods += missed
+                self.next_deadline += missed * self.period
+            time.sleep(self.next_deadline - now)
+
+        wake = time.monotonic()
+        late = wake - self.next_deadline
+        self.jitter[self.jitter_index % len(self.jitter)] = late
+        self.jitter_index += 1
+        if late > self.jitter_max:
+            self.jitter_max = late
+        if self.last_wake is not None:
+            self.period_last = wake - self.last_wake
+        self.last_wake = wake
+        self.iterations += 1
+        return wake
+
+    def reset(self):
+        self.next_deadline = None
+        self.last_wake = None
+
+    def stats(self):
+        n = min(self.jitter_index, len(self.jitter))
+        recent = sorted(self.jitter[:n])
+
+        def pct(p):
+            return round(recent[min(int(n * p), n - 1)] * 1e6, 1) if n else 0.0
+
+        return {
+            "period_us": round(self.period * 1e6, 1),
+            "period_last_us": round(self.period_last * 1e6, 1),
+            "iterations": self.iterations,
+            "overruns": self.overruns,
+            "missed_periods": self.missed_periods,
+            "jitter_p50_us": pct(0.50),
+            "jitter_p99_us": pct(0.99),
+            "jitter_max_us": round(self.jitter_max * 1e6, 1),
+            "work_last_us": round(self.work_last * 1e6, 1),
+            "work_max_us": round(self.work_max * 1e6, 1),
+        }
+
+
+class LogWorker:
+    def __init__(self, maxsize=1000):
+        self.queue = Queue(maxsize=maxsize)
+        self.dropped = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def log(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            print(self.queue.get())
@@ -0,0 +1,338 @@
+"""
+Shared Modbus RTU driver for the LCU load cell and DCU torque sensor.
+
+AsyncModbusDriver wraps pymodbus's AsyncModbusSerialClient with:
+- register maps: read_map() fetches a RegisterMap in as few
+  read_holding_registers transactions as possible, coalescing registers
+  that are contiguous (or within `max_gap`) into one block;
+- signed/unsigned int16/int32 decoding (decode_words);
+- reconnect with exponential backoff: a failed connect, or
+  RECONNECT_AFTER consecutive failed reads, closes the port and the next
+  attempt waits backoff_min, 2x, 4x ... up to backoff_max. Reads made
+  while waiting return None immediately instead of blocking;
+- per-device counters: latency, timeouts, CRC errors (checked on the raw
+  reply bytes), exception responses, retries and connects.
+
+ModbusDriver is the blocking facade for the threaded firmware: it runs
+the async driver on one shared event loop thread and waits for results.
+
+`port` is anything pyserial accepts, so "socket://host:port" talks to an
+RTU-over-TCP simulator (see dcu/firmware/modbus_sim.py) without hardware.
+
+Kept identical in lcu/firmware and dcu/firmware; each unit deploys its
+own firmware directory.
+"""
+import asyncio
+import logging
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from pymodbus import FramerType
+from pymodbus.client import AsyncModbusSerialClient
+from pymodbus.exceptions import ModbusException, ModbusIOException
+
+# name -> (register count, struct format of the big-endian word sequence)
+REGISTER_FORMATS = {
+    "int16": (1, '>h'),
+    "uint16": (1, '>H'),
+    "int32": (2, '>i'),
+    "uint32": (2, '>I'),
+}
+MAX_BLOCK = 125  # Modbus limit for one read_holding_registers request
+RECONNECT_AFTER = 5  # consecutive failed reads before the port is reopened
+
+# pymodbus logs every timeout; they are counted in stats() instead
+logging.getLogger("pymodbus").setLevel(logging.CRITICAL)
+
+Register = namedtuple("Register", "name address fmt scale")
+Register.__new__.__defaults__ = ("uint16", 1)
+
+
+def decode_words(words, fmt):
+    """Decode a big-endian sequence of 16-bit register values."""
+    count, code = REGISTER_FORMATS[fmt]
+    return struct.unpack(code, struct.pack(f'>{count}H', *words))[0]
+
+
+def crc16(frame):
+    crc = 0xFFFF
+    for byte in frame:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return struct.pack('<H', crc)
+
+
+class RegisterMap:
+    def __init__(self, registers, max_gap=0, max_block=MAX_BLOCK):
+        self.registers = sorted(registers, key=lambda r: r.address)
+        self.blocks = []  # (start, count, registers)
+        for reg in self.registers:
+            width = REGISTER_FORMATS[reg.fmt][0]
+            if self.blocks:
+                start, count, regs = self.blocks[-1]
+                end = reg.address + width
+                if reg.address <= start + count + max_gap and end - start <= max_block:
+                    self.blocks[-1] = (start, max(count, end - start), regs + [reg])
+                    continue
+            self.blocks.append((reg.address, width, [reg]))
+
+    def decode(self, start, words, registers):
+        values = {}
+        for reg in registers:
+            offset = reg.address - start
+            width = REGISTER_FORMATS[reg.fmt][0]
+            values[reg.name] = decode_words(words[offset:offset + width], reg.fmt) * reg.scale
+        return values
+
+
+class AsyncModbusDriver:
+    def __init__(self, port, baudrate=19200, parity="N", stopbits=1, bytesize=8, timeout=0.1,
+                 slave_id=1, retries=1, backoff_min=0.5, backoff_max=30.0):
+        self.port = port
+        self.serial_args = dict(baudrate=baudrate, parity=parity, stopbits=stopbits,
+                                bytesize=bytesize, timeout=timeout)
+        self.client = None  # created on first connect, on the driver's loop
+        self.slave_id = slave_id
+        self.retries = retries
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.backoff = backoff_min
+        self.next_connect = 0.0
+        self.connected = False
+        self.lock = None  # created on the driver's loop; one transaction at a time
+        self.rx = bytearray()
+
+        self.transactions = 0
+        self.ok = 0
+        self.timeouts = 0
+        self.crc_errors = 0
+        self.exceptions = 0
+        self.errors = 0
+        self.retried = 0
+        self.connects = 0
+        self.connect_failures = 0
+        self.consecutive_failures = 0
+        self.latency_last = 0.0
+        self.latency_avg = 0.0
+        self.latency_max = 0.0
+
+    def _trace_packet(self, sending, data):
+        """Sees every raw frame; used to count replies that fail the CRC."""
+        if sending:
+            self.rx.clear()
+            return data
+        rx = self.rx
+        rx += data
+        if len(rx) >= 3:
+            # Function 0x03 reply: unit, fn, byte count, data, crc. Exception reply: 5 bytes.
+            length = 5 if rx[1] & 0x80 else 5 + rx[2]
+            if len(rx) >= length:
+                if crc16(rx[:length - 2]) != bytes(rx[length - 2:length]):
+                    self.crc_errors += 1
+                rx.clear()
+        return data
+
+    async def connect(self):
+        if self.connected:
+            return True
+        now = time.monotonic()
+        if now < self.next_connect:
+            return False
+        if self.client is None:
+            self.client = AsyncModbusSerialClient(
+                self.port,
+                framer=FramerType.RTU,
+                retries=0,          # retries are counted here instead
+                reconnect_delay=0,  # and so is reconnecting
+                trace_packet=self._trace_packet,
+                **self.serial_args,
+            )
+        try:
+            ok = await self.client.connect()
+        except Exception as e:
+            print(f"[Modbus] {self.port} connect error: {e}")
+            ok = False
+        if ok:
+            if self.connects or self.connect_failures:
+                print(f"[Modbus] {self.port} connected")
+            self.connected = True
+            self.connects += 1
+            self.consecutive_failures = 0
+            return True
+        self.connect_failures += 1
+        self.next_connect = now + self.backoff
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+        return False
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.connected = False
+
+    async def _drop(self):
+        print(f"[Modbus] {self.port}: {self.consecutive_failures} failed reads, reconnecting "
+              f"in {self.backoff:.1f}s")
+        await self.close()
+        self.next_connect = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    async def read_registers(self, address, count):
+        """read_holding_registers with retries; returns the word list or None."""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            for attempt in range(self.retries + 1):
+                if not await self.connect():
+                    return None
+                if attempt:
+                    self.retried += 1
+                self.transactions += 1
+                start = time.monotonic()
+                try:
+                    response = await self.client.read_holding_registers(
+                        address=address, count=count, slave=self.slave_id)
+                except ModbusIOException:
+                    self.timeouts += 1  # includes replies discarded for a bad CRC
+                    continue
+                except ModbusException as e:
+                    self.errors += 1
+                    print(f"[Modbus] {self.port} error at {hex(address)}: {e}")
+                    break
+                if response.isError():
+                    # The device answered, so the link is fine; retrying won't change its mind
+                    self.exceptions += 1
+                    self.consecutive_failures = 0
+                    return None
+                latency = time.monotonic() - start
+                self.latency_last = latency
+                self.latency_avg += 0.05 * (latency - self.latency_avg)
+                if latency > self.latency_max:
+                    self.latency_max = latency
+                self.ok += 1
+                self.consecutive_failures = 0
+                self.backoff = self.backoff_min  # the link works, not just the port
+                return response.registers
+
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= RECONNECT_AFTER:
+                await self._drop()
+                self.consecutive_failures = 0
+            return None
+
+    async def read_map(self, register_map):
+        """Read every register in the map, one transaction per block. None if any block fails."""
+        values = {}
+        for start, count, registers in register_map.blocks:
+            words = await self.read_registers(start, count)
+            if words is None:
+                return None
+            values.update(register_map.decode(start, words, registers))
+        return values
+
+    async def read_parameter(self, address, length=1, signed=False):
+        """Single int16/int32 read, unscaled."""
+        words = await self.read_registers(address, length)
+        if words is None:
+            return None
+        fmt = ("int" if signed else "uint") + ("32" if length == 2 else "16")
+        return decode_words(words, fmt)
+
+    async def write_parameter(self, address, value):
+        """
+        Writes a single register. `value` should be the unscaled integer.
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:  # shares the RS-485 link with the block reads
+            if not await self.connect():
+                print("Not connected")
+                return False
+            try:
+                response = await self.client.write_register(address, int(value), slave=self.slave_id)
+                if response.isError():
+                    print(f"Failed to write {value} to {hex(address)}")
+                    return False
+                print(f"Wrote {value} to {hex(address)}")
+                return True
+            except ModbusException as e:
+                print(f"ModbusException at {hex(address)}: {e}")
+            except Exception as e:
+                print(f"Unexpected error at {hex(address)}: {e}")
+            return False
+
+    def stats(self):
+        return {
+            "port": self.port,
+            "connected": self.connected,
+            "transactions": self.transactions,
+            "ok": self.ok,
+            "timeouts": self.timeouts,
+            "crc_errors": self.crc_errors,
+            "exceptions": self.exceptions,
+            "errors": self.errors,
+            "retries": self.retried,
+            "connects": self.connects,
+            "connect_failures": self.connect_failures,
+            "latency_last_ms": round(self.latency_last * 1000, 2),
+            "latency_avg_ms": round(self.latency_avg * 1000, 2),
+            "latency_max_ms": round(self.latency_max * 1000, 2),
+        }
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def driver_loop():
+    """Event loop thread shared by every ModbusDriver in the process."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+class ModbusDriver:
+    """Blocking facade over AsyncModbusDriver for the threaded firmware."""
+
+    def __init__(self, port, baudrate, parity, stopbits, bytesize, timeout, slave_id, **kwargs):
+        self.loop = driver_loop()
+        self.driver = AsyncModbusDriver(port, baudrate, parity, stopbits, bytesize, timeout,
+                                        slave_id, **kwargs)
+        self.slave_id = slave_id
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    @property
+    def connected(self):
+        return self.driver.connected
+
+    def connect(self):
+        return self._call(self.driver.connect())
+
+    def disconnect(self):
+        try:
+            self._call(self.driver.close())
+            print("Successfully disconnected")
+        except Exception as e:
+            print(f"Failed to disconnect: {e}")
+
+    def read_registers(self, address, count):
+        return self._call(self.driver.read_registers(address, count))
+
+    def read_map(self, register_map):
+        return self._call(self.driver.read_map(register_map))
+
+    def read_parameter(self, address, length=1, signed=False):
+        return self._call(self.driver.read_parameter(address, length, signed))
+
+    def write_parameter(self, address, value):
+        return self._call(self.driver.write_parameter(address, value))
+
+    def stats(self):
+        return self.driver.stats()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Shared capture under load: recorder + live viewers + snapshots.
+
+Runs CameraService with the real camera (--camera 0) or, by default, a
+synthetic camera paced at --fps, then for --seconds:
+- records with VideoRecorder,
+- serves --viewers MJPEG viewers at 320 px (half of them reading at a
+  tenth of the speed, like a viewer on a bad Wi-Fi link),
+- takes a 640 px snapshot every second,
+and reports what each consumer got. The recorder should write every
+frame (dropped stays 0) however slow the viewers are, and the JPEG
+encode count should not grow with the number of viewers.
+
+    python3 camera_bench.py [--seconds 10] [--viewers 4] [--camera 0]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+
+import numpy as np
+
+import camera_service
+from camera_service import CameraService, mjpeg_stream
+from video_recorder import VideoRecorder
+
+
+class SyntheticCamera:
+    """Stands in for cv2.VideoCapture: a moving gradient at a fixed rate."""
+
+    def __init__(self, width, height, fps):
+        self.interval = 1.0 / fps
+        self.next_at = time.monotonic()
+        self.row = np.linspace(0, 255, width, dtype=np.float32)
+        self.height = height
+        self.count = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        self.next_at += self.interval
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.count += 1
+        gray = np.repeat(((self.row + self.count * 4) % 256).astype(np.uint8)[None, :], self.height, axis=0)
+        return True, np.dstack([gray, gray, 255 - gray])
+
+    def get(self, prop):
+        return 0.0
+
+    def release(self):
+        pass
+
+
+async def viewer(service, width, fps, slow, seconds, results):
+    frames = 0
+    received = 0
+    deadline = time.monotonic() + seconds
+    async for part in mjpeg_stream(service, width, fps):
+        frames += 1
+        received += len(part)
+        if slow:
+            await asyncio.sleep(10 * (1.0 / fps))  # reads far slower than the stream
+        if time.monotonic() > deadline:
+            break
+    results.append((slow, frames / seconds, received))
+
+
+async def snapshots(service, seconds, results):
+    for _ in range(int(seconds)):
+        start = time.perf_counter()
+        _, _, jpeg = await service.snapshot(640)
+        results.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(1.0)
+
+
+async def run(args, service, recorder):
+    viewers, shots = [], []
+    await asyncio.gather(
+        *(viewer(service, 320, args.viewer_fps, i % 2 == 1, args.seconds, viewers) for i in range(args.viewers)),
+        snapshots(service, args.seconds, shots),
+    )
+    return viewers, shots
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared camera capture benchmark")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--viewers", type=int, default=4)
+    parser.add_argument("--viewer-fps", type=float, default=15.0)
+    parser.add_argument("--fps", type=float, default=20.0)
+    parser.add_argument("--camera", type=int)
+    parser.add_argument("--dir", default="/tmp/camera_bench")
+    args = parser.parse_args()
+
+    service = CameraService(args.camera if args.camera is not None else 0, 640, 480, args.fps)
+    if args.camera is None:
+        service._open_camera = lambda: SyntheticCamera(640, 480, args.fps)
+    os.makedirs(args.dir, exist_ok=True)
+    recorder = VideoRecorder(service, "MJPG", segment_seconds=0)
+    try:
+        recorder.start(os.path.join(args.dir, "bench"))
+        viewers, shots = asyncio.run(run(args, service, recorder))
+        recorder.stop()
+        recorder.encoder_thread.join()
+        stats = recorder.stats()
+        camera = service.stats()
+        print(f"camera: {camera['captured']} frames at {camera['capture_fps']} fps")
+        print(f"recorder: captured {stats['captured']}, written {stats['written']}, "
+              f"dropped {stats['dropped']}, queue high water {stats['queue_high_water']}")
+        for slow, fps, received in viewers:
+            print(f"viewer ({'slow' if slow else 'fast'}): {fps:.1f} fps, {received / 1e6:.1f} MB")
+        print(f"snapshots: {len(shots)}, mean {sum(shots) / len(shots):.1f} ms, max {max(shots):.1f} ms")
+        for width, feed in service.feeds.items():
+            print(f"feed {width} px: {feed.encoded} JPEG encodes, {feed.encode_avg * 1000:.2f} ms avg")
+    finally:
+        shutil.rmtree(args.dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+One camera, many consumers.
+
+CameraService owns the cv2.VideoCapture: only its capture thread ever
+reads the camera, so the recorder, the live preview and snapshots no
+longer fight over device 0. The camera is opened when the first consumer
+arrives and released IDLE_SECONDS after the last one leaves.
+
+Each frame is stamped once, with the driver's buffer timestamp
+(CAP_PROP_POS_MSEC on V4L2) mapped onto time.monotonic(), or the
+monotonic time at grab when the backend doesn't report one, and then
+handed out two ways:
+
+- FrameSubscription: a bounded queue of (ts, grabbed, frame). Full means
+  the oldest frame is dropped and counted; capture never waits on a
+  consumer. The recorder's encoder reads one.
+- JpegFeed: the latest frame JPEG-encoded at one width, by one thread per
+  width, so any number of viewers at that size cost one encode per frame
+  (at most `max_fps`). Viewers wait for a sequence number newer than the
+  one they last sent and always get the newest JPEG, so a slow viewer
+  skips frames instead of queueing them, and nothing waits on it.
+
+Frames are shared between consumers, not copied: treat them as read-only.
+"""
+import asyncio
+import threading
+import time
+from queue import Queue, Empty, Full
+
+import cv2
+
+IDLE_SECONDS = 5.0        # keep the camera open this long after the last consumer leaves
+FEED_IDLE_SECONDS = 5.0   # a JpegFeed thread exits after this long without viewers
+FEED_WIDTHS = (160, 320, 640)
+FEED_MAX_FPS = 15.0
+JPEG_QUALITY = 75
+FRAME_WAIT = 2.0          # how long a viewer waits for a frame before giving up
+
+
+class CameraError(Exception):
+    pass
+
+
+class FrameSubscription:
+    """Bounded drop-oldest queue of frames for one consumer; None marks the end."""
+
+    def __init__(self, service, maxsize):
+        self.service = service
+        self.queue = Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.reason = None
+        self.delivered = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def put(self, item):
+        """Capture thread. Never blocks."""
+        with self.lock:
+            if self.closed:
+                return
+            self._put(item)
+            if item is not None:
+                self.delivered += 1
+            depth = self.queue.qsize()
+            if depth > self.high_water:
+                self.high_water = depth
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except Empty:
+                pass
+            self.queue.put_nowait(item)
+
+    def close(self, reason=None):
+        """Stop delivery; the consumer sees None after the frames already queued."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.reason = reason
+            self._put(None)
+        self.service._unsubscribe(self)
+
+
+class JpegFeed:
+    """Latest frame as JPEG at one width, encoded once for every viewer."""
+
+    def __init__(self, service, width, max_fps=FEED_MAX_FPS, quality=JPEG_QUALITY):
+        self.service = service
+        self.width = width
+        self.max_fps = max_fps
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.viewers = 0
+        self.idle_since = time.monotonic()
+        self.stopped = False
+        self.waiters = []  # (loop, future) of viewers waiting for the next JPEG
+        self.seq = 0
+        self.jpeg = None
+        self.ts = 0.0
+        self.error = None
+        self.encoded = 0
+        self.encode_avg = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def join(self):
+        """Add a viewer; False if the feed has already stopped."""
+        with self.lock:
+            if self.stopped:
+                return False
+            self.viewers += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.viewers -= 1
+            if not self.viewers:
+                self.idle_since = time.monotonic()
+
+    async def next(self, after=0, timeout=FRAME_WAIT):
+        """(seq, ts, jpeg) of the newest frame with seq > after; raises CameraError."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.seq > after and self.jpeg is not None:
+                return self.seq, self.ts, self.jpeg
+            if self.error is not None:
+                raise CameraError(self.error)
+            future = loop.create_future()
+            waiter = (loop, future)
+            self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise CameraError("No frame from the camera")
+        finally:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+    def _publish(self, result=None, error=None):
+        with self.lock:
+            if error is not None:
+                self.error = error
+            else:
+                self.seq, self.ts, self.jpeg = result
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._resolve, future, result, error)
+
+    @staticmethod
+    def _resolve(future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(CameraError(error))
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        service = self.service
+        service.acquire()
+        try:
+            last = 0
+            interval = 1.0 / self.max_fps
+            next_at = 0.0
+            while True:
+                with self.lock:
+                    if not self.viewers and time.monotonic() - self.idle_since > FEED_IDLE_SECONDS:
+                        self.stopped = True
+                        break
+                seq, ts, frame = service.wait_frame(last, timeout=1.0)
+                if frame is None:
+                    if service.error is not None:
+                        # Viewers get the error; the next one starts a new feed, which retries the camera
+                        with self.lock:
+                            self.stopped = True
+                        self._publish(error=service.error)
+                        break
+                    continue
+                last = seq
+                now = time.monotonic()
+                if now < next_at:
+                    continue  # faster than max_fps: skip this frame
+                next_at = max(next_at + interval, now)
+                start = time.perf_counter()
+                height, width = frame.shape[:2]
+                if self.width < width:
+                    frame = cv2.resize(frame, (self.width, round(height * self.width / width)),
+                                       interpolation=cv2.INTER_AREA)
+                ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if not ok:
+                    continue
+                jpeg = jpeg.tobytes()
+                self.encode_avg += 0.05 * (time.perf_counter() - start - self.encode_avg)
+                self.encoded += 1
+                self._publish((seq, ts, jpeg))
+        finally:
+            service.release()
+
+    def stats(self):
+        return {
+            "viewers": self.viewers,
+            "encoded": self.encoded,
+            "encode_avg_ms": round(self.encode_avg * 1000, 2),
+            "jpeg_bytes": len(self.jpeg) if self.jpeg else 0,
+        }
+
+
+class CameraService:
+    def __init__(self, camera=0, width=640, height=480, fps=20.0, idle_seconds=IDLE_SECONDS):
+        self.camera = camera
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.idle_seconds = idle_seconds
+
+        self.lock = threading.Lock()
+        self.frame_ready = threading.Condition(self.lock)
+        self.users = 0            # subscriptions + live feeds
+        self.subscriptions = []
+        self.feeds = {}           # width -> JpegFeed
+        self.thread = None
+        self.closing = False      # capture thread is on its way out after idling
+        self.seq = 0
+        self.latest = None        # (ts, frame) of frame `seq`
+        self.error = None
+
+        self.opens = 0
+        self.captured = 0
+        self.capture_rate = 0.0
+        self.camera_timestamps = False
+
+    # --- consumers ---
+
+    def subscribe(self, maxsize):
+        """Queue of every frame from now on, for a consumer that must see them all."""
+        subscription = FrameSubscription(self, maxsize)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        self.acquire()
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self.lock:
+            if subscription not in self.subscriptions:
+                return
+            self.subscriptions.remove(subscription)
+        self.release()
+
+    def feed(self, width):
+        """
+        Join the shared JpegFeed for the smallest FEED_WIDTHS size >= width,
+        starting it if needed. Call feed.leave() when done.
+        """
+        width = next((w for w in FEED_WIDTHS if w >= width), FEED_WIDTHS[-1])
+        with self.lock:
+            feed = self.feeds.get(width)
+            if feed is None or not feed.join():
+                feed = JpegFeed(self, width)
+                feed.join()
+                self.feeds[width] = feed
+                feed.thread.start()
+        return feed
+
+    async def snapshot(self, width):
+        """One fresh JPEG at `width`; raises CameraError."""
+        feed = self.feed(width)
+        try:
+            with feed.lock:
+                fresh = feed.jpeg is not None and time.monotonic() - feed.ts < 1.0 / self.fps
+                after = feed.seq - 1 if fresh else feed.seq
+            return await feed.next(after)
+        finally:
+            feed.leave()
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+            if self.thread is None or not self.thread.is_alive() or self.closing:
+                self.error = None
+                self.closing = False
+                self.thread = threading.Thread(target=self._capture, args=(self.thread,), daemon=True)
+                self.thread.start()
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+
+    def wait_frame(self, after, timeout):
+        """Feed threads: (seq, ts, frame) newer than `after`, or (after, 0, None) on timeout/error."""
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: (self.latest is not None and self.seq > after)
+                                      or self.error is not None, timeout)
+            if self.latest is not None and self.seq > after and self.error is None:
+                return (self.seq,) + self.latest
+            return after, 0.0, None
+
+    # --- capture thread ---
+
+    def _open_camera(self):
+        cap = cv2.VideoCapture(self.camera)
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        cap.set(cv2.CAP_PROP_FPS, self.fps)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)  # hand over fresh frames, not a backlog
+        return cap
+
+    def _capture(self, previous):
+        if previous is not None:
+            previous.join()  # let it release the device first
+        cap = self._open_camera()
+        if not cap.isOpened():
+            print("[Camera] Failed to open webcam.")
+            self._fail("camera_open_failed")
+            return
+        self.opens += 1
+        print(f"[Camera] Opened camera {self.camera}")
+
+        clock_offset = None  # monotonic - camera clock
+        last_camera = 0.0
+        window_start = time.monotonic()
+        window_frames = 0
+        idle_since = None
+        reason = "idle"
+        while True:
+            with self.lock:
+                if self.users > 0:
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > self.idle_seconds:
+                    self.closing = True  # a later acquire() starts a new capture thread
+                    self.latest = None   # nobody gets a frame from before the camera closed
+                    break
+
+            ret, frame = cap.read()
+            grabbed = time.monotonic()
+            if not ret:
+                print("[Camera] Frame grab failed.")
+                reason = "grab_failed"
+                break
+
+            camera_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+            if camera_ms > 0 and camera_ms / 1000 > last_camera:
+                # Driver timestamps are set when the frame is exposed, not when read() returns
+                last_camera = camera_ms / 1000
+                if clock_offset is None:
+                    clock_offset = grabbed - last_camera
+                ts = last_camera + clock_offset
+                self.camera_timestamps = True
+            else:
+                ts = grabbed
+                self.camera_timestamps = False
+
+            with self.frame_ready:
+                self.seq += 1
+                self.latest = (ts, frame)
+                subscriptions = list(self.subscriptions)
+                self.frame_ready.notify_all()
+            item = (ts, grabbed, frame)
+            for subscription in subscriptions:
+                subscription.put(item)
+            self.captured += 1
+
+            window_frames += 1
+            if grabbed - window_start >= 1.0:
+                self.capture_rate = window_frames / (grabbed - window_start)
+                window_start = grabbed
+                window_frames = 0
+
+        cap.release()
+        print(f"[Camera] Released camera {self.camera} ({reason})")
+        if reason != "idle":
+            self._fail(reason)
+
+    def _fail(self, reason):
+        with self.frame_ready:
+            self.error = reason
+            self.latest = None
+            subscriptions = list(self.subscriptions)
+            self.frame_ready.notify_all()
+        for subscription in subscriptions:
+            subscription.close(reason)
+
+    def stats(self):
+        return {
+            "open": self.thread is not None and self.thread.is_alive() and not self.closing,
+            "users": self.users,
+            "error": self.error,
+            "opens": self.opens,
+            "captured": self.captured,
+            "capture_fps": round(self.capture_rate, 2),
+            "camera_timestamps": self.camera_timestamps,
+            "subscriptions": len(self.subscriptions),
+            "feeds": {width: feed.stats() for width, feed in self.feeds.items() if not feed.stopped},
+        }
+
+
+MJPEG_BOUNDARY = "frame"
+
+
+async def mjpeg_stream(service, width, max_fps):
+    """
+    multipart/x-mixed-replace body for one viewer of service's feed for `width`.
+
+    The feed is joined when the body starts and left when it ends, so a
+    response that never starts (client gone first) never holds a viewer.
+
+    Each part is the newest JPEG once the previous one has been sent, so a
+    viewer on a slow link just sees a lower frame rate.
+    """
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / max_fps
+    seq = 0
+    feed = None
+    try:
+        feed = service.feed(width)
+        while True:
+            started = loop.time()
+            try:
+                seq, _, jpeg = await feed.next(seq)
+            except CameraError:
+                break
+            yield (f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                   f"Content-Length: {len(jpeg)}\r\n\r\n").encode() + jpeg + b"\r\n"
+            delay = interval - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        if feed is not None:
+            feed.leave()
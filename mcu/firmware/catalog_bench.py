@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+/videos/ listing cost: glob + stat per request vs VideoCatalog.
+
+Fills a directory with --count short recordings, then times
+- the old list_videos body (glob, os.stat each file),
+- the old info path (cv2.VideoCapture per file) against VideoCatalog.info,
+- VideoCatalog.list for the first page and for everything,
+- how long after a file appears or is deleted the catalog reflects it.
+
+Point --dir at the USB stick on the Pi to see the numbers that matter;
+the default /tmp directory is page-cached and flatters the old path.
+
+    python3 catalog_bench.py [--count 300] [--dir /tmp/catalog_bench]
+"""
+import argparse
+import glob
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from video_catalog import VideoCatalog, probe_video
+
+
+def make_recordings(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    template = os.path.join(directory, "video_template.avi")
+    out = cv2.VideoWriter(template, cv2.VideoWriter_fourcc(*"MJPG"), 20.0, (320, 240))
+    frame = np.zeros((240, 320, 3), np.uint8)
+    for i in range(40):
+        frame[:] = i * 6
+        out.write(frame)
+    out.release()
+    for i in range(count):
+        shutil.copyfile(template, os.path.join(directory, f"video_20250101_{i:06d}_000.avi"))
+    os.remove(template)
+
+
+def old_list(directory):
+    videos = []
+    for video_file in glob.glob(os.path.join(directory, "*.avi")):
+        stat = os.stat(video_file)
+        videos.append((os.path.basename(video_file), stat.st_size, stat.st_mtime))
+    return sorted(videos, key=lambda v: v[2], reverse=True)
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def wait_for(condition, timeout=5.0):
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            return None
+        time.sleep(0.005)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video catalog benchmark")
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--dir", default="/tmp/catalog_bench")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    make_recordings(args.dir, args.count)
+    paths = glob.glob(os.path.join(args.dir, "*.avi"))
+    catalog = VideoCatalog(args.dir)
+    try:
+        catalog.start()
+        catalog.ready.wait()
+        print(f"{len(paths)} files, catalog mode {catalog.mode}, startup scan {catalog.scan_seconds * 1000:.1f} ms")
+        print(f"{'list (glob + stat)':<28} {timed(lambda: old_list(args.dir), args.repeat):>9.2f} ms")
+        print(f"{'catalog list, all':<28} {timed(lambda: catalog.list(), args.repeat):>9.2f} ms")
+        print(f"{'catalog list, 50/page':<28} {timed(lambda: catalog.list(limit=50), args.repeat):>9.3f} ms")
+        print(f"{'info (cv2 probe each)':<28} {timed(lambda: [probe_video(p) for p in paths], 1):>9.2f} ms")
+        files = [catalog.get(os.path.basename(p)) for p in paths]
+        print(f"{'catalog info, first pass':<28} {timed(lambda: [catalog.info(f) for f in files], 1):>9.2f} ms")
+        print(f"{'catalog info, cached':<28} {timed(lambda: [catalog.info(f) for f in files], args.repeat):>9.3f} ms")
+
+        extra = os.path.join(args.dir, "video_new_000.avi")
+        shutil.copyfile(paths[0], extra)
+        added = wait_for(lambda: catalog.get("video_new_000.avi") is not None)
+        os.remove(extra)
+        removed = wait_for(lambda: catalog.get("video_new_000.avi") is None)
+        print(f"new file visible after {added:.0f} ms, deletion after {removed:.0f} ms"
+              if added is not None and removed is not None else "catalog did not pick up the change")
+        print(catalog.stats())
+    finally:
+        catalog.stop()
+        shutil.rmtree(args.dir)
+
+
+if __name__ == "__main__":
+    main()
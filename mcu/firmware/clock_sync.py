@@ -0,0 +1,255 @@
+"""
+MQTT clock synchronization between the MCU and the units.
+
+The MCU is the reference clock (its time.time(), which is what
+run_samples is stamped in). Every CLOCK_PING_INTERVAL it publishes a ping
+on each unit's */cmd topic:
+
+    {"clock_ping": 17, "t1": <MCU send time>, "estimate": {...}}
+
+and the unit answers on */clock with its own receive and send times:
+
+    {"seq": 17, "t1": ..., "t2": <unit receive>, "t3": <unit send>}
+
+With t4 the MCU receive time, NTP-style:
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2    unit clock - MCU clock
+    rtt    = (t4 - t1) - (t3 - t2)
+
+Broker queueing and paho thread delays only ever add to the RTT, and an
+asymmetric delay moves the offset by at most rtt / 2, so ClockEstimator
+keeps the minimum-RTT exchange of the last FILTER_WINDOW pings and fits
+drift (slope) through those filtered points. The current estimate rides
+back to the unit on the next ping; ClockClient.to_mcu() then turns any
+unit capture time into MCU time, which the units attach as "ts" to every
+*/data payload.
+
+Unit capture times come from ClockClient.now(): epoch-based, but advanced
+by time.monotonic(), so an NTP step on a unit can't move its timestamps.
+
+Kept identical in every firmware/ directory: units use ClockClient, the
+MCU uses ClockEstimator and LatencyHistogram.
+"""
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+CLOCK_PING_INTERVAL = 1.0
+FILTER_WINDOW = 8     # pings per min-RTT pick
+DRIFT_WINDOW = 300    # filtered points in the drift fit (5 min at 1 ping/s)
+STEP_THRESHOLD = 0.05  # residual (s) that means a clock stepped; restarts the fit
+
+# End-to-end latency buckets, ms (upper bounds; the last bucket is open)
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LATENCY_HISTORY = 1024
+
+
+class ClockClient:
+    """Unit side: answers pings and corrects capture times to the MCU clock."""
+
+    def __init__(self):
+        self.anchor = time.time() - time.monotonic()
+        self.offset = 0.0  # unit - MCU at MCU time `ref`
+        self.drift = 0.0   # d(offset)/dt
+        self.ref = 0.0
+        self.synced = False
+        self.pings = 0
+
+    def now(self):
+        return self.anchor + time.monotonic()
+
+    def on_ping(self, data):
+        """Returns the */clock reply for a clock_ping command."""
+        t2 = self.now()
+        self.pings += 1
+        estimate = data.get("estimate")
+        if estimate:
+            self.offset = estimate["offset"]
+            self.drift = estimate["drift"]
+            self.ref = estimate["ref"]
+            self.synced = True
+        return {"seq": data["clock_ping"], "t1": data["t1"], "t2": t2, "t3": self.now()}
+
+    def to_mcu(self, t):
+        """Unit clock time -> MCU clock time."""
+        # t = m + offset + drift * (m - ref), solved for m
+        return (t - self.offset + self.drift * self.ref) / (1.0 + self.drift)
+
+    def stamp(self, t=None):
+        """Corrected capture timestamp for a */data payload."""
+        return round(self.to_mcu(self.now() if t is None else t), 6)
+
+    def stats(self):
+        return {
+            "synced": self.synced,
+            "offset_ms": round(self.offset * 1000, 3),
+            "drift_ppm": round(self.drift * 1e6, 2),
+            "pings": self.pings,
+        }
+
+
+class DeviceClock:
+    """MCU side, one per unit: min-RTT filter and drift fit."""
+
+    def __init__(self, filter_window=FILTER_WINDOW, drift_window=DRIFT_WINDOW):
+        self.exchanges = deque(maxlen=filter_window)  # (rtt, mcu time, offset)
+        self.points = deque(maxlen=drift_window)      # filtered (mcu time, offset)
+        self.offset = None
+        self.drift = 0.0
+        self.ref = 0.0
+        self.rtt_last = 0.0
+        self.rtt_min = 0.0
+        self.error = 0.0
+        self.samples = 0
+        self.steps = 0
+
+    def add(self, t1, t2, t3, t4):
+        rtt = (t4 - t1) - (t3 - t2)
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        mid = (t1 + t4) / 2
+        self.samples += 1
+        self.rtt_last = rtt
+        if rtt < 0:
+            return  # a clock stepped mid-exchange
+        # The true offset is within rtt / 2 of this exchange's; further off than that, a
+        # clock stepped, so drop the history instead of bending the fit towards it
+        if self.offset is not None and abs(offset - self.predict(mid)) > STEP_THRESHOLD + rtt / 2:
+            self.steps += 1
+            self.exchanges.clear()
+            self.points.clear()
+        self.exchanges.append((rtt, mid, offset))
+        rtt_min, mid, offset = min(self.exchanges)
+        if not self.points or self.points[-1][0] != mid:
+            self.points.append((mid, offset))
+        self.rtt_min = rtt_min
+        self.error = rtt_min / 2
+        self._fit()
+
+    def _fit(self):
+        points = self.points
+        n = len(points)
+        t_mean = sum(t for t, _ in points) / n
+        o_mean = sum(o for _, o in points) / n
+        var = sum((t - t_mean) ** 2 for t, _ in points)
+        if n >= 3 and var > 0:
+            self.drift = sum((t - t_mean) * (o - o_mean) for t, o in points) / var
+        else:
+            self.drift = 0.0
+        self.ref = t_mean
+        self.offset = o_mean
+
+    def predict(self, t):
+        """Unit clock - MCU clock at MCU time t."""
+        if self.offset is None:
+            return 0.0
+        return self.offset + self.drift * (t - self.ref)
+
+    def estimate(self):
+        if self.offset is None:
+            return None
+        return {"offset": self.offset, "drift": self.drift, "ref": self.ref}
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS, history=LATENCY_HISTORY):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.recent = array('d', bytes(8 * history))
+        self.index = 0
+        self.count = 0
+        self.negative = 0  # ts later than receipt: clock error exceeds the latency
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        ms = latency * 1000
+        if ms < 0:
+            self.negative += 1
+            ms = 0.0
+        self.counts[bisect_left(self.buckets, ms)] += 1
+        self.recent[self.index % len(self.recent)] = ms
+        self.index += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def stats(self):
+        n = min(self.index, len(self.recent))
+        recent = sorted(self.recent[:n])
+
+        def pct(p):
+            return round(recent[min(int(n * p), n - 1)], 2) if n else 0.0
+
+        labels = [f"le_{b:g}" for b in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "negative": self.negative,
+            "mean_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max, 2),
+            "buckets_ms": dict(zip(labels, self.counts)),
+        }
+
+
+class ClockEstimator:
+    """MCU side: pings, per-device offset/drift and */data latency histograms."""
+
+    def __init__(self, devices):
+        self.devices = list(devices)
+        self.clocks = {d: DeviceClock() for d in self.devices}
+        self.transport = {d: LatencyHistogram() for d in self.devices}   # ts -> MQTT receipt
+        self.end_to_end = {d: LatencyHistogram() for d in self.devices}  # ts -> handled on the loop
+        self.seq = 0
+        self.sent = {}  # device -> (seq, t1) of the outstanding ping
+        self.late = 0
+
+    def ping(self, device):
+        """The */cmd payload for the next ping to `device`."""
+        self.seq += 1
+        t1 = time.time()
+        self.sent[device] = (self.seq, t1)
+        return {"clock_ping": self.seq, "t1": t1, "estimate": self.clocks[device].estimate()}
+
+    def on_reply(self, device, payload, received):
+        clock = self.clocks.get(device)
+        if clock is None:
+            return
+        sent = self.sent.get(device)
+        if sent is None or payload.get("seq") != sent[0] or payload.get("t1") != sent[1]:
+            self.late += 1  # answered after the next ping went out; its RTT is useless anyway
+            return
+        del self.sent[device]
+        clock.add(sent[1], payload["t2"], payload["t3"], received)
+
+    def offset(self, device, t=None):
+        clock = self.clocks.get(device)
+        if clock is None or clock.offset is None:
+            return None
+        return clock.predict(time.time() if t is None else t)
+
+    def record_latency(self, device, ts, received, handled):
+        if device not in self.transport:
+            return
+        self.transport[device].add(received - ts)
+        self.end_to_end[device].add(handled - ts)
+
+    def describe(self):
+        now = time.time()
+        devices = {}
+        for device, clock in self.clocks.items():
+            devices[device] = {
+                "synced": clock.offset is not None,
+                "offset_ms": round(clock.predict(now) * 1000, 3) if clock.offset is not None else None,
+                "error_ms": round(clock.error * 1000, 3),
+                "drift_ppm": round(clock.drift * 1e6, 2),
+                "rtt_last_ms": round(clock.rtt_last * 1000, 3),
+                "rtt_min_ms": round(clock.rtt_min * 1000, 3),
+                "exchanges": clock.samples,
+                "steps": clock.steps,
+                "latency_transport": self.transport[device].stats(),
+                "latency_end_to_end": self.end_to_end[device].stats(),
+            }
+        return {"devices": devices, "late_replies": self.late}
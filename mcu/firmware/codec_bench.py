@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Encode/decode micro-benchmark for telemetry_codec.
+
+Compares JSON and the binary schemas on representative LCU, DCU and SDU
+payloads: bytes on the wire and CPU microseconds per message. Run it on
+the Pi itself to get numbers for that core.
+
+    python3 codec_bench.py [--iterations N] [--window-samples N]
+"""
+import argparse
+import platform
+import random
+import time
+
+import telemetry_codec
+
+
+def sample_payloads(window_samples):
+    rng = random.Random(7)
+    block = {ch: [rng.randint(0, 3000) for _ in range(window_samples)]
+             for ch in telemetry_codec.SDU_CHANNELS}
+    stats = {ch: {"min": min(v) / 100, "max": max(v) / 100,
+                  "mean": round(sum(v) / len(v) / 100, 4), "rms": 12.3456}
+             for ch, v in block.items()}
+    return {
+        "lcu_data": {"pos_ticks": 123456, "pos_mm": 185.092, "load": 1520, "current_speed": 1.234,
+                     "ts": 1700000000.123456},
+        "dcu_data": {"mode": 2, "direction": 1, "contactor_state": 1, "rpm": 1480.5, "torque": 12.34,
+                     "ts": 1700000000.123456},
+        "sdu_sample": {"DRILL_CURRENT": 12.34, "POWER_CURRENT": 3.21, "LINEAR_CURRENT": 0.87,
+                       "ts": 1700000000.123456},
+        "sdu_window": {
+            "DRILL_CURRENT": 12.34, "POWER_CURRENT": 3.21, "LINEAR_CURRENT": 0.87,
+            "ts": 1700000000.1,
+            "window": {"t_start": 1700000000.0, "t_end": 1700000000.1,
+                       "count": window_samples, "stride": 1, "scale": 100.0,
+                       "samples": block, "stats": stats},
+        },
+    }
+
+
+def cpu_us_per_call(fn, arg, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Telemetry codec micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--window-samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{platform.machine()} / {platform.processor() or 'unknown cpu'} / "
+          f"Python {platform.python_version()}")
+    print(f"{'schema':<12} {'enc':<7} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+
+    for schema, data in sample_payloads(args.window_samples).items():
+        iterations = args.iterations if schema != "sdu_window" else max(args.iterations // 100, 10)
+        for encoding in telemetry_codec.ENCODINGS:
+            payload = telemetry_codec.dumps(schema, data, encoding)
+            if isinstance(payload, str):
+                payload = payload.encode()
+            encode_us = cpu_us_per_call(
+                lambda d: telemetry_codec.dumps(schema, d, encoding), data, iterations)
+            decode_us = cpu_us_per_call(telemetry_codec.decode, payload, iterations)
+            print(f"{schema:<12} {encoding:<7} {len(payload):>8} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+    # Round-trip sanity check so a schema drift shows up here first
+    for schema, data in sample_payloads(16).items():
+        decoded = telemetry_codec.decode(telemetry_codec.encode(schema, data))
+        if schema == "sdu_window":
+            ok = decoded["window"]["samples"] == data["window"]["samples"]
+        else:
+            ok = all(decoded[k] == data[k] for k in data)
+        if not ok:
+            print(f"warning: {schema} did not round-trip: {decoded}")
+
+
+if __name__ == "__main__":
+    main()
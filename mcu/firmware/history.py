@@ -0,0 +1,106 @@
+"""
+Fixed-memory telemetry history for the MCU gateway.
+
+Every tracked (device, field) pair gets a preallocated array('d') ring of
+timestamps and values, so memory is set once at startup and never grows
+however long the gateway runs. Queries return the series oldest-first
+with min/max decimation, which keeps spikes visible at any zoom level.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+
+class SeriesRing:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.head = 0
+        self.count = 0
+
+    def append(self, t, value):
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def snapshot(self, since=0.0):
+        """Oldest-first copies of (times, values) with t >= since."""
+        if self.count < self.capacity:
+            times = self.times[:self.count]
+            values = self.values[:self.count]
+        else:
+            times = self.times[self.head:] + self.times[:self.head]
+            values = self.values[self.head:] + self.values[:self.head]
+        start = bisect_left(times, since) if since else 0
+        return times[start:], values[start:]
+
+
+def decimate_minmax(times, values, max_points):
+    """Reduce a series to at most max_points, keeping each bucket's min and max."""
+    n = len(values)
+    if max_points <= 0 or n <= max_points:
+        return list(times), list(values)
+    buckets = max(max_points // 2, 1)
+    out_t, out_v = [], []
+    for b in range(buckets):
+        lo = b * n // buckets
+        hi = (b + 1) * n // buckets
+        if hi <= lo:
+            continue
+        chunk = values[lo:hi]
+        i_min = lo + chunk.index(min(chunk))
+        i_max = lo + chunk.index(max(chunk))
+        for i in sorted({i_min, i_max}):
+            out_t.append(times[i])
+            out_v.append(values[i])
+    return out_t, out_v
+
+
+class DeviceHistory:
+    def __init__(self, fields, capacity):
+        self.fields = tuple(fields)
+        self.series = {field: SeriesRing(capacity) for field in self.fields}
+        self.lock = threading.Lock()
+
+    def record(self, payload, ts=None):
+        ts = time.time() if ts is None else ts
+        window = payload.get("window")
+        with self.lock:
+            if isinstance(window, dict) and window.get("stats"):
+                self._record_window(window, ts)
+                return
+            for field in self.fields:
+                value = payload.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.series[field].append(ts, float(value))
+
+    def _record_window(self, window, ts):
+        # SDU window: keep the per-window envelope (min then max) rather
+        # than every raw sample, so minutes of history still fit the ring.
+        span = window.get("t_end", 0.0) - window.get("t_start", 0.0)
+        for name, stats in window["stats"].items():
+            field = f"{name}_CURRENT"
+            if field not in self.series or "min" not in stats or "max" not in stats:
+                continue
+            ring = self.series[field]
+            ring.append(ts - span * 0.75, stats["min"])
+            ring.append(ts - span * 0.25, stats["max"])
+
+    def query(self, since=0.0, fields=None, max_points=500):
+        result = {}
+        for field in fields or self.fields:
+            ring = self.series.get(field)
+            if ring is None:
+                continue
+            with self.lock:
+                times, values = ring.snapshot(since)
+            t, v = decimate_minmax(times, values, max_points)
+            result[field] = {"t": t, "v": v}
+        return result
+
+    def memory_bytes(self):
+        return sum(16 * ring.capacity for ring in self.series.values())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Regression test: the event loop stays responsive while the video
+endpoints are hammered.
+
+Serves firmware.app with uvicorn on a scratch "USB drive" holding
+--count synthetic recordings and, for --seconds, has --clients load
+processes (processes, so the load itself doesn't compete with the
+server for the GIL) loop over:
+- GET /videos/ and /videos/{f}/info,
+- ranged and full reads of /videos/{f} and /stream/{f},
+- thumbnails at random t and the preview clip,
+- an unknown file (404).
+It then reads /loop_stats/ and exits 1 if the loop's p99 wakeup lag
+exceeds --max-p99-ms or any wakeup was later than --max-lag-ms, i.e.
+if something on the request path is blocking the loop again.
+
+Needs the MQTT broker firmware.py connects to at startup (mosquitto on
+the Pi); nothing is published to the units.
+
+    python3 loop_lag_test.py [--seconds 20] [--clients 4] [--max-p99-ms 20] [--max-lag-ms 100]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+
+import cv2
+import httpx
+import numpy as np
+
+
+def make_video(path, seconds, fps, codec):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (640, 480))
+    x = np.linspace(0, 255, 640, dtype=np.float32)
+    for i in range(int(seconds * fps)):
+        gray = np.repeat(((x + i * 3) % 256).astype(np.uint8)[None, :], 480, axis=0)
+        out.write(cv2.merge([gray, gray, 255 - gray]))
+    out.release()
+
+
+def hammer(url, filenames, seconds, seed):
+    """One load process: request counts by status, and transport errors."""
+    rng = random.Random(seed)
+    statuses = {}
+    errors = 0
+    deadline = time.monotonic() + seconds
+    with httpx.Client(base_url=url, timeout=30.0) as client:
+        while time.monotonic() < deadline:
+            f = rng.choice(filenames)
+            requests = [
+                ("GET", "/videos/?sort=size&limit=10", {}),
+                ("GET", f"/videos/{f}/info", {}),
+                ("GET", f"/videos/{f}", {"Range": f"bytes={rng.randrange(100000)}-{rng.randrange(100000, 400000)}"}),
+                ("GET", f"/stream/{f}", {}),
+                ("GET", f"/videos/{f}/thumbnail?t={rng.uniform(0, 5):.2f}&width=160", {}),
+                ("GET", f"/videos/{f}/preview", {}),
+                ("GET", "/videos/missing.avi/info", {}),
+            ]
+            for method, path, headers in requests:
+                try:
+                    status = client.request(method, path, headers=headers).status_code
+                    statuses[status] = statuses.get(status, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+    return statuses, errors
+
+
+def serve(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def run(args, video_dir, filenames):
+    # Imported here, not at the top: the spawned load processes re-import
+    # this module and have no use for the whole firmware
+    import firmware
+    from sample_store import SampleStore
+    from video_catalog import VideoCatalog
+    from video_maintenance import VideoMaintenance
+    from video_preview import PreviewService
+
+    firmware.USB_MOUNT_PATH = video_dir
+    firmware.video_catalog = VideoCatalog(video_dir)
+    firmware.video_previews = PreviewService(os.path.join(video_dir, ".preview_cache"))
+    firmware.sample_store = SampleStore(sqlite_path=os.path.join(args.dir, "index.sqlite3"))
+    firmware.video_maintenance = VideoMaintenance(firmware.video_catalog, firmware.sample_store,
+                                                  firmware.is_recording, max_age_days=None,
+                                                  min_free_bytes=0, transcode=False)
+
+    url = f"http://127.0.0.1:{args.port}"
+    server, thread = serve(firmware.app, args.port)
+    try:
+        with httpx.Client(base_url=url) as client:
+            videos = client.get("/videos/").json()["videos"]
+            assert sorted(v["filename"] for v in videos) == filenames, videos
+            firmware.loop_monitor.reset()  # startup scan and pool forks are not under test
+
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(args.clients) as pool:
+                results = pool.starmap(hammer, [(url, filenames, args.seconds, i) for i in range(args.clients)])
+            stats = client.get("/loop_stats/").json()
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    statuses, errors = {}, 0
+    for s, e in results:
+        errors += e
+        for status, n in s.items():
+            statuses[status] = statuses.get(status, 0) + n
+    total = sum(statuses.values())
+    print(f"{total} requests in {args.seconds:.0f} s from {args.clients} clients "
+          f"({total / args.seconds:.0f}/s), by status {dict(sorted(statuses.items()))}, {errors} errors")
+    print(f"loop lag over {stats['count']} wakeups: mean {stats['mean_ms']} ms, p50 {stats['p50_ms']} ms, "
+          f"p99 {stats['p99_ms']} ms, max {stats['max_ms']} ms, {stats['stalls']} stalls")
+
+    failures = []
+    if not total:
+        failures.append("no requests served")
+    if errors or any(status >= 500 for status in statuses):
+        failures.append("requests failed")
+    if stats["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 lag {stats['p99_ms']} ms > {args.max_p99_ms} ms")
+    if stats["max_ms"] > args.max_lag_ms:
+        failures.append(f"max lag {stats['max_ms']} ms > {args.max_lag_ms} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event-loop lag under video endpoint load")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--count", type=int, default=6)
+    parser.add_argument("--video-seconds", type=float, default=5.0)
+    parser.add_argument("--codec", default="XVID")
+    parser.add_argument("--max-p99-ms", type=float, default=20.0)
+    parser.add_argument("--max-lag-ms", type=float, default=100.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dir", default="/tmp/loop_lag_test")
+    args = parser.parse_args()
+
+    video_dir = os.path.join(args.dir, "usb")
+    os.makedirs(video_dir, exist_ok=True)
+    filenames = [f"video_test_{i:03d}.avi" for i in range(args.count)]
+    try:
+        for filename in filenames:
+            make_video(os.path.join(video_dir, filename), args.video_seconds, 20.0, args.codec)
+        ok = run(args, video_dir, filenames)
+    finally:
+        shutil.rmtree(args.dir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
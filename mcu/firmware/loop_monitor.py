@@ -0,0 +1,58 @@
+"""
+Event-loop lag: how late the loop wakes a task that asked to sleep.
+
+LoopLagMonitor.run() sleeps LOOP_LAG_INTERVAL at a time and records the
+difference between the time it asked to be woken and the time it
+actually ran again. Anything that runs on the loop without awaiting (a
+stat on a slow USB stick, an OpenCV probe, a big CSV) shows up here as
+lag, and while it lasts no WebSocket frame, MQTT message or HTTP
+response makes progress for anyone.
+
+Lag goes into the same LatencyHistogram the clock sync uses for */data
+latency; a wakeup more than stall_ms late also counts as a stall.
+"""
+import asyncio
+import time
+
+from clock_sync import LatencyHistogram
+
+LOOP_LAG_INTERVAL = 0.1  # s between wakeups
+LOOP_STALL_MS = 100.0    # lag that counts as a stall
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=LOOP_LAG_INTERVAL, stall_ms=LOOP_STALL_MS):
+        self.interval = interval
+        self.stall_ms = stall_ms
+        self.reset()
+
+    def reset(self):
+        self.lag = LatencyHistogram()
+        self.last_ms = 0.0
+        self.stalls = 0
+        self.last_stall = None  # (wall time, ms) of the latest stall
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(loop.time() - scheduled)
+
+    def record(self, lag):
+        self.lag.add(lag)
+        ms = max(lag * 1000, 0.0)  # timers may fire up to the clock resolution early
+        self.last_ms = ms
+        if ms >= self.stall_ms:
+            self.stalls += 1
+            self.last_stall = (time.time(), round(ms, 2))
+
+    def stats(self):
+        return {
+            "interval_ms": self.interval * 1000,
+            "last_ms": round(self.last_ms, 2),
+            "stalls": self.stalls,
+            "stall_ms": self.stall_ms,
+            "last_stall": self.last_stall,
+            **self.lag.stats(),
+        }
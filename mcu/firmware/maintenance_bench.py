@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Retention and transcoding on a scratch directory.
+
+Writes --count one-minute-ish MJPG recordings (as the recorder does with
+VIDEO_CODEC = "MJPG"), ages half of them past --max-age-days, links a
+few to a run in a scratch SQLite index, then runs VideoMaintenance until
+it has nothing left to do and prints what it deleted, what each
+transcode saved and what it cost in worker CPU time. Run it on the Pi
+(pointing --dir at the USB stick) to size RETENTION_* and see whether
+VIDEO_TRANSCODE keeps up with recording.
+
+    python3 maintenance_bench.py [--count 6] [--seconds 20] [--dir /tmp/maintenance_bench]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+import video_maintenance
+from sample_store import SampleStore
+from video_catalog import VideoCatalog
+from video_maintenance import VideoMaintenance
+
+
+def make_recording(path, seconds, fps, rng):
+    base = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (31, 31), 0)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (640, 480))
+    for i in range(int(seconds * fps)):
+        frame = base.copy()
+        x = (i * 5) % 560
+        cv2.rectangle(frame, (x, 200), (x + 80, 280), (0, 0, 255), -1)
+        noise = rng.normal(0, 2, frame.shape)  # sensor noise, so MJPG can't cheat
+        out.write(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    out.release()
+
+
+async def bench(args):
+    store = SampleStore(sqlite_path=os.path.join(args.dir, "index.sqlite3"))
+    await store.open()
+    video_dir = os.path.join(args.dir, "usb")
+    catalog = VideoCatalog(video_dir)
+    catalog.start()
+    catalog.ready.wait()
+    time.sleep(1.0)  # let the catalog see the mtimes set above
+
+    linked = sorted(catalog.files.values(), key=lambda f: f.mtime)[:2]
+    for f in linked:
+        store.backend.conn.execute("INSERT INTO run_videos (run_id, video_path) VALUES (1, ?)", (f.path,))
+    store.backend.conn.commit()
+
+    maintenance = VideoMaintenance(catalog, store, lambda path: False, max_age_days=args.max_age_days,
+                                   min_free_bytes=0, interval=0.5)
+    maintenance.start()
+    task = asyncio.create_task(maintenance.run())
+    try:
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            pending = [f for f in catalog.files.values() if f.key not in maintenance.skip]
+            if maintenance.passes and maintenance.transcode_task is None and not pending:
+                break
+        stats = maintenance.stats()
+        transcode = stats["transcode"]
+        print(f"deleted {stats['deleted']} ({stats['deleted_linked']} linked), "
+              f"{stats['bytes_freed'] / 1e6:.1f} MB freed")
+        print(f"linked to run 1 and kept: {[os.path.basename(f.path) for f in linked]}")
+        print(f"transcode to {transcode['codec']}: {transcode['done']} files, results {transcode['results']}")
+        print(f"saved {transcode['bytes_saved'] / 1e6:.1f} MB, worker CPU {transcode['cpu_seconds']:.1f} s, "
+              f"wall {transcode['wall_seconds']:.1f} s")
+        if transcode["done"]:
+            recorded = transcode["done"] * args.seconds
+            print(f"CPU per minute of video: {transcode['cpu_seconds'] / recorded * 60:.1f} s")
+        print(f"remaining: {sorted(catalog.files)}")
+    finally:
+        task.cancel()
+        maintenance.stop()
+        catalog.stop()
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video retention/transcode benchmark")
+    parser.add_argument("--count", type=int, default=6)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--fps", type=float, default=20.0)
+    parser.add_argument("--max-age-days", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--dir", default="/tmp/maintenance_bench")
+    args = parser.parse_args()
+
+    video_maintenance.TRANSCODE_MIN_AGE = 0.0
+    video_dir = os.path.join(args.dir, "usb")
+    os.makedirs(video_dir, exist_ok=True)
+    rng = np.random.default_rng(3)
+    now = time.time()
+    try:
+        for i in range(args.count):
+            path = os.path.join(video_dir, f"video_bench_{i:03d}.avi")
+            make_recording(path, args.seconds, args.fps, rng)
+            if i < args.count // 2:
+                old = now - (args.max_age_days + 1 + i) * 86400
+                os.utime(path, (old, old))
+        asyncio.run(bench(args))
+    finally:
+        shutil.rmtree(args.dir)
+
+
+if __name__ == "__main__":
+    main()
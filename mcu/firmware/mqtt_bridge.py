@@ -0,0 +1,81 @@
+"""
+Hand-off from the paho network thread to the asyncio event loop.
+
+paho calls on_message on its own thread. submit() is the only thing that
+runs there: it schedules a put onto a bounded asyncio.Queue with
+loop.call_soon_threadsafe. A single consumer task on the loop then runs
+the handler, so device state, history and WebSocket broadcasts are only
+ever touched from the event loop thread.
+"""
+import asyncio
+import time
+
+
+class MqttBridge:
+    def __init__(self, handler, maxsize=10000):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.loop = None
+        self.queue = None
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+        self.latency_last = 0.0
+        self.latency_max = 0.0
+
+    def attach(self, loop=None):
+        """Bind to the running loop; call from the loop before run()."""
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+
+    def submit(self, topic, payload):
+        """Called on the paho thread. Never blocks."""
+        loop = self.loop
+        self.received += 1
+        if loop is None or loop.is_closed():
+            self.dropped += 1
+            return
+        try:
+            loop.call_soon_threadsafe(self._put, (topic, payload, time.time(), time.monotonic()))
+        except RuntimeError:  # loop closed during shutdown
+            self.dropped += 1
+
+    def _put(self, item):
+        queue = self.queue
+        if queue.full():
+            queue.get_nowait()  # drop the oldest, keep the newest
+            self.dropped += 1
+        queue.put_nowait(item)
+        depth = queue.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+
+    async def run(self):
+        queue = self.queue
+        while True:
+            topic, payload, received, queued_at = await queue.get()
+            try:
+                self.handler(topic, payload, received)
+            except Exception as e:
+                self.errors += 1
+                print(f"[MQTT] Message error: {e}")
+            self.processed += 1
+            latency = time.monotonic() - queued_at
+            self.latency_last = latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_high_water": self.high_water,
+            "latency_last_ms": round(self.latency_last * 1000, 3),
+            "latency_max_ms": round(self.latency_max * 1000, 3),
+        }
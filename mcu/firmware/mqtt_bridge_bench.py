@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark for the MQTT -> event loop bridge.
+
+One or more threads stand in for the paho network thread and call
+MqttBridge.submit() with real encoded */data payloads as fast as they
+can (or at --rate). The handler on the loop decodes each payload and
+updates a device_data dict like the MCU does. Reports messages/sec
+processed on the loop, drops and hand-off latency.
+
+    python3 mqtt_bridge_bench.py [--messages N] [--threads N] [--encoding binary]
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import telemetry_codec
+from mqtt_bridge import MqttBridge
+
+PAYLOADS = {
+    "lcu/data": ("lcu_data", {"pos_ticks": 123456, "pos_mm": 185.092, "load": 1520, "current_speed": 1.234}),
+    "dcu/data": ("dcu_data", {"mode": 2, "direction": 1, "contactor_state": 1, "rpm": 1480.5, "torque": 12.34}),
+    "sdu/data": ("sdu_sample", {"DRILL_CURRENT": 12.34, "POWER_CURRENT": 3.21, "LINEAR_CURRENT": 0.87}),
+}
+
+
+def producer(bridge, messages, encoded, rate):
+    topics = list(encoded)
+    interval = 1.0 / rate if rate else 0.0
+    next_t = time.monotonic()
+    for i in range(messages):
+        topic = topics[i % len(topics)]
+        bridge.submit(topic, encoded[topic])
+        if interval:
+            next_t += interval
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+async def bench(args):
+    device_data = {}
+
+    def handler(topic, raw, received):
+        device_data[topic.split("/")[0]] = telemetry_codec.decode(raw)
+
+    encoded = {}
+    for topic, (schema, data) in PAYLOADS.items():
+        payload = telemetry_codec.dumps(schema, data, args.encoding)
+        encoded[topic] = payload.encode() if isinstance(payload, str) else payload
+
+    bridge = MqttBridge(handler, maxsize=args.queue)
+    bridge.attach()
+    consumer = asyncio.create_task(bridge.run())
+
+    total = args.messages * args.threads
+    threads = [
+        threading.Thread(target=producer, args=(bridge, args.messages, encoded, args.rate))
+        for _ in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    while bridge.processed + bridge.dropped < total:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    for t in threads:
+        t.join()
+    consumer.cancel()
+    try:
+        await consumer
+    except asyncio.CancelledError:
+        pass
+
+    stats = bridge.stats()
+    print(f"encoding:           {args.encoding}")
+    print(f"submitted:          {stats['received']:,} from {args.threads} thread(s)")
+    print(f"processed msgs/sec: {stats['processed'] / elapsed:,.0f}")
+    print(f"dropped:            {stats['dropped']:,}")
+    print(f"queue high-water:   {stats['queue_high_water']}")
+    print(f"hand-off latency:   last {stats['latency_last_ms']} ms, max {stats['latency_max_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT bridge throughput benchmark")
+    parser.add_argument("--messages", type=int, default=200000, help="messages per producer thread")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0, help="msgs/sec per thread, 0 = unthrottled")
+    parser.add_argument("--queue", type=int, default=10000)
+    parser.add_argument("--encoding", choices=telemetry_codec.ENCODINGS, default="json")
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Thumbnail / preview cost: cold render in the pool vs cache hit.
+
+Records a synthetic --seconds long clip with the recorder's codec, then
+times through PreviewService:
+- thumbnails at several t (cold: seek + decode + encode in a worker),
+- the same thumbnails again (cache hits, no decoding),
+- the preview clip cold and warm,
+- a naive thumbnail that reads every frame up to t, for comparison.
+
+    python3 preview_bench.py [--seconds 60] [--codec XVID] [--dir /tmp/preview_bench]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from video_catalog import VideoFile
+from video_preview import PreviewService
+
+
+def make_video(path, seconds, fps, codec):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (640, 480))
+    x = np.linspace(0, 255, 640, dtype=np.float32)
+    for i in range(int(seconds * fps)):
+        gray = np.repeat(((x + i * 3) % 256).astype(np.uint8)[None, :], 480, axis=0)
+        out.write(cv2.merge([gray, gray, 255 - gray]))
+    out.release()
+
+
+def naive_thumbnail(path, t):
+    cap = cv2.VideoCapture(path)
+    target = int(t * cap.get(cv2.CAP_PROP_FPS))
+    for _ in range(target + 1):
+        ok, frame = cap.read()
+    cap.release()
+    return frame
+
+
+async def bench(path, cache_dir, times):
+    service = PreviewService(cache_dir)
+    service.start()
+    video = VideoFile(os.path.basename(path), path, os.stat(path))
+    try:
+        for label in ("cold", "cached"):
+            start = time.perf_counter()
+            for t in times:
+                assert await service.thumbnail(video, t) is not None
+            elapsed = (time.perf_counter() - start) / len(times) * 1000
+            print(f"{'thumbnail ' + label:<22} {elapsed:>9.2f} ms each")
+        for label in ("cold", "cached"):
+            start = time.perf_counter()
+            assert await service.preview(video) is not None
+            print(f"{'preview ' + label:<22} {(time.perf_counter() - start) * 1000:>9.2f} ms")
+        start = time.perf_counter()
+        await asyncio.gather(*(service.thumbnail(video, 1.234) for _ in range(8)))
+        print(f"{'8 identical requests':<22} {(time.perf_counter() - start) * 1000:>9.2f} ms, "
+              f"{service.renders} renders total")
+        print(service.stats())
+    finally:
+        service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thumbnail/preview benchmark")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--fps", type=float, default=20.0)
+    parser.add_argument("--codec", default="XVID")
+    parser.add_argument("--dir", default="/tmp/preview_bench")
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    path = os.path.join(args.dir, "video_bench_000.avi")
+    try:
+        make_video(path, args.seconds, args.fps, args.codec)
+        times = [args.seconds * f for f in (0.1, 0.3, 0.5, 0.7, 0.9)]
+        start = time.perf_counter()
+        naive_thumbnail(path, times[-1])
+        print(f"{args.seconds:.0f} s {args.codec} clip, {os.path.getsize(path) / 1e6:.1f} MB")
+        print(f"{'decode-to-t at 90%':<22} {(time.perf_counter() - start) * 1000:>9.2f} ms")
+        asyncio.run(bench(path, os.path.join(args.dir, ".preview_cache"), times))
+    finally:
+        shutil.rmtree(args.dir)
+
+
+if __name__ == "__main__":
+    main()
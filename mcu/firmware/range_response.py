@@ -0,0 +1,259 @@
+"""
+Ranged file responses for the video endpoints.
+
+RangeFileResponse serves a file with:
+- single ranges (206 + Content-Range) and multiple ranges (206
+  multipart/byteranges), including suffix ranges ("bytes=-500");
+  unsatisfiable ranges get 416, malformed ones are ignored (full 200);
+- ETag (inode, size, mtime) and Last-Modified, If-None-Match -> 304 and
+  If-Range, so a player resuming a download after the file changed gets
+  the whole new file instead of a spliced one;
+- files still being recorded: `growing()` returns True while the
+  recorder is writing the file. Ranges are then served against the size
+  at request time under a weak ETag (which never satisfies If-Range),
+  and a plain GET follows the file as it grows, chunked, until the
+  recorder closes it.
+
+The body is sent zero-copy when the server offers the ASGI
+"http.response.zerocopysend" extension (the server sendfile()s from our
+descriptor). uvicorn does not, so otherwise each CHUNK_SIZE block is
+os.pread() in a worker thread: no per-8 KiB Python iteration and no file
+I/O on the event loop (the open and fstat run in the same thread pool).
+"""
+import asyncio
+import os
+import re
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+CHUNK_SIZE = 1024 * 1024
+MAX_RANGES = 16        # more than this and the whole file is cheaper for both sides
+FOLLOW_POLL = 0.25     # growth check while following a file being recorded
+
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def parse_ranges(header, size):
+    """
+    'bytes=0-99,200-' -> sorted, merged [(start, end)] with inclusive ends.
+    None if the header is malformed (serve the whole file), [] if nothing
+    in it overlaps the file (416).
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        match = _RANGE_SPEC.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start, end = max(size - suffix, 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last), size - 1) if last else size - 1
+        if start < size:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _open_stat(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return fd, os.fstat(fd)
+    except OSError:
+        os.close(fd)
+        raise
+
+
+def make_etag(stat, weak=False):
+    tag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return "W/" + tag if weak else tag
+
+
+class RangeFileResponse(Response):
+    def __init__(self, path, media_type="application/octet-stream", filename=None,
+                 growing=None, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.media_type = media_type
+        self.filename = filename
+        self.growing = growing or (lambda: False)
+        self.chunk_size = chunk_size
+        self.background = None
+        self.status_code = 200
+        self.raw_headers = []
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        request_headers = Headers(scope=scope)
+        try:
+            fd, stat = await loop.run_in_executor(None, _open_stat, self.path)
+        except OSError:
+            await Response("Not found", status_code=404)(scope, receive, send)
+            return
+        try:
+            await self._respond(scope, receive, send, fd, stat, request_headers)
+        finally:
+            os.close(fd)
+
+    async def _respond(self, scope, receive, send, fd, stat, request_headers):
+        size = stat.st_size
+        growing = self.growing()
+        etag = make_etag(stat, weak=growing)
+        headers = [
+            (b"accept-ranges", b"bytes"),
+            (b"etag", etag.encode()),
+            (b"last-modified", formatdate(stat.st_mtime, usegmt=True).encode()),
+        ]
+        if self.filename:
+            headers.append((b"content-disposition", f'attachment; filename="{self.filename}"'.encode()))
+        send_body = scope["method"] != "HEAD"
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and not growing and etag in [t.strip() for t in if_none_match.split(",")]:
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_ok(request_headers.get("if-range"), etag, stat, growing):
+            ranges = parse_ranges(range_header, size)
+
+        if ranges == []:
+            headers.append((b"content-range", f"bytes */{size}".encode()))
+            headers.append((b"content-length", b"0"))
+            await send({"type": "http.response.start", "status": 416, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        media = self.media_type.encode()
+        if not ranges:
+            if growing and send_body:
+                headers.append((b"content-type", media))
+                await send({"type": "http.response.start", "status": 200, "headers": headers})
+                await self._follow(scope, receive, send, fd)
+                return
+            headers += [(b"content-type", media), (b"content-length", str(size).encode())]
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            if send_body:
+                await self._send_span(scope, send, fd, 0, size, more_body=False)
+            else:
+                await send({"type": "http.response.body", "body": b""})
+            return
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers += [
+                (b"content-type", media),
+                (b"content-range", f"bytes {start}-{end}/{size}".encode()),
+                (b"content-length", str(end - start + 1).encode()),
+            ]
+            await send({"type": "http.response.start", "status": 206, "headers": headers})
+            if send_body:
+                await self._send_span(scope, send, fd, start, end - start + 1, more_body=False)
+            else:
+                await send({"type": "http.response.body", "body": b""})
+            return
+
+        boundary = secrets.token_hex(12)
+        parts = [
+            (f"--{boundary}\r\nContent-Type: {self.media_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode()
+        length = sum(len(p) + (end - start + 1) + 2 for p, (start, end) in zip(parts, ranges)) + len(closing)
+        headers += [
+            (b"content-type", f"multipart/byteranges; boundary={boundary}".encode()),
+            (b"content-length", str(length).encode()),
+        ]
+        await send({"type": "http.response.start", "status": 206, "headers": headers})
+        if not send_body:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        for part, (start, end) in zip(parts, ranges):
+            await send({"type": "http.response.body", "body": part, "more_body": True})
+            await self._send_span(scope, send, fd, start, end - start + 1, more_body=True)
+            await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": closing})
+
+    @staticmethod
+    def _if_range_ok(if_range, etag, stat, growing):
+        """True if the Range header should be honoured."""
+        if not if_range:
+            return True
+        if growing:
+            return False  # weak validator: If-Range needs a strong match
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag
+        try:
+            return int(stat.st_mtime) == int(parsedate_to_datetime(if_range).timestamp())
+        except (TypeError, ValueError):
+            return False
+
+    async def _send_span(self, scope, send, fd, offset, count, more_body):
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            await send({"type": "http.response.zerocopysend", "file": fd,
+                        "offset": offset, "count": count, "more_body": more_body})
+            return
+        loop = asyncio.get_running_loop()
+        end = offset + count
+        finished = False
+        while offset < end:
+            chunk = await loop.run_in_executor(None, os.pread, fd, min(self.chunk_size, end - offset), offset)
+            if not chunk:
+                break  # truncated under us; the client sees a short body
+            offset += len(chunk)
+            finished = not more_body and offset >= end
+            await send({"type": "http.response.body", "body": chunk, "more_body": not finished})
+        if not more_body and not finished:
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _follow(self, scope, receive, send, fd):
+        """Chunked body that keeps up with a file being written until growing() turns False."""
+        loop = asyncio.get_running_loop()
+        disconnected = asyncio.Event()
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            offset = 0
+            while not disconnected.is_set():
+                growing = self.growing()
+                chunk = await loop.run_in_executor(None, os.pread, fd, self.chunk_size, offset)
+                if chunk:
+                    offset += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                elif growing:
+                    await asyncio.sleep(FOLLOW_POLL)
+                else:
+                    break  # closed and fully sent
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
@@ -0,0 +1,121 @@
+"""
+Run orchestration: one run_id shared by the MCU and every unit.
+
+start() creates the `runs` row, points the sample store at the new
+run_id and publishes a run marker on every unit's */cmd topic:
+
+    {"run_marker": "start", "run_id": 12, "mcu_time": 1718000000.123}
+
+Each unit starts its local run log under that run_id and answers on
+*/run with its clock offset (device time.time() at receipt - mcu_time),
+which the MCU uses to move device-stamped samples (SDU windows) onto its
+own clock. The offset includes one MQTT hop, typically a few ms; the
+clock_sync.py pings replace it with a filtered estimate within a second.
+
+align() turns a run's run_samples rows into one time-indexed table: a
+fixed grid from the first to the last sample, one column per
+device.channel, each holding the latest value at or before the grid time.
+"""
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+
+class RunOrchestrator:
+    def __init__(self, sample_store, publish, devices):
+        self.sample_store = sample_store
+        self.publish = publish  # publish(topic, dict)
+        self.devices = list(devices)
+        self.run_id = None
+        self.run_name = None
+        self.started_at = None
+        self.offsets = {}
+        self.acks = {}
+
+    async def start(self, project_id, experiment_id, run_name, run_description=None, run_params=None):
+        if self.run_id is not None:
+            await self.stop()
+        if self.sample_store.backend is None:
+            await self.sample_store.open()
+        start_time = datetime.now()
+        run_id = await self.sample_store.backend.create_run(
+            project_id, experiment_id, run_name, run_description, run_params or {}, start_time)
+
+        self.run_id = run_id
+        self.run_name = run_name
+        self.started_at = time.time()
+        self.offsets = {}
+        self.acks = {}
+        self.sample_store.start_run(run_id)
+        self._marker("start")
+        print(f"[Run] Started run {run_id} ({run_name})")
+        return run_id
+
+    async def stop(self, status="completed"):
+        run_id = self.run_id
+        if run_id is None:
+            return None
+        self._marker("stop")
+        self.sample_store.stop_run()
+        await self.sample_store.flush()
+        await self.sample_store.backend.finish_run(
+            run_id, status, datetime.now(), {"clock_offsets": self.offsets})
+        self.run_id = None
+        print(f"[Run] Stopped run {run_id} ({status})")
+        return run_id
+
+    def _marker(self, event):
+        for device in self.devices:
+            self.publish(f"{device}/cmd", {
+                "run_marker": event,
+                "run_id": self.run_id,
+                "mcu_time": time.time(),
+            })
+
+    def on_ack(self, device, payload, received):
+        """*/run reply from a unit; runs on the event loop."""
+        if payload.get("run_id") != self.run_id or payload.get("event") != "start":
+            return
+        offset = payload.get("offset")
+        if offset is None:
+            return
+        self.offsets[device] = offset
+        self.acks[device] = received
+        self.sample_store.clock_offsets[device] = offset
+
+    def describe(self):
+        return {
+            "run_id": self.run_id,
+            "run_name": self.run_name,
+            "started_at": self.started_at,
+            "clock_offsets": self.offsets,
+            "acknowledged": sorted(self.acks),
+            "missing": [d for d in self.devices if d not in self.acks] if self.run_id else [],
+        }
+
+
+def align(rows, interval):
+    """rows: (device, ts, channel, value) sorted by ts. Returns (columns, table)."""
+    series = {}
+    for device, ts, channel, value in rows:
+        times, values = series.setdefault(f"{device}.{channel}", ([], []))
+        times.append(ts)
+        values.append(value)
+    if not series:
+        return ["t"], []
+
+    t_start = rows[0][1]
+    t_end = rows[-1][1]
+    names = sorted(series)
+    steps = int(round((t_end - t_start) / interval, 9)) + 1
+    grid = [t_start + i * interval for i in range(steps)]
+    columns = []
+    for name in names:
+        times, values = series[name]
+        column = []
+        for t in grid:
+            i = bisect_right(times, t)
+            column.append(values[i - 1] if i else None)
+        columns.append(column)
+    table = [[round(t, 6)] + [col[i] for col in columns] for i, t in enumerate(grid)]
+    return ["t"] + names, table
@@ -0,0 +1,498 @@
+"""
+Batched time-series storage for device telemetry.
+
+The MQTT thread only appends to a bounded deque (never blocks, never
+touches the database). An asyncio writer task on the uvicorn loop drains
+it every FLUSH_INTERVAL, expands payloads into (run_id, device, ts,
+channel, value) rows and bulk-loads them: COPY through asyncpg when
+PostgreSQL is reachable, otherwise executemany into a local SQLite file.
+Payload expansion runs in the default executor; every SQLite call runs
+on the backend's own single thread, so transactions on its one
+connection never interleave.
+
+It also owns the `runs` rows for orchestrated runs (see run_orchestrator.py)
+and the video index written by video_recorder.py (video_segments, one
+row per file; video_frames, frame number -> capture time), so a run, its
+samples and its video always land in the same database.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import asyncpg
+except ImportError:  # SQLite fallback only
+    asyncpg = None
+
+COLUMNS = ("run_id", "device", "ts", "channel", "value")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_samples (
+    run_id INTEGER NOT NULL,
+    device TEXT NOT NULL,
+    ts REAL NOT NULL,
+    channel TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS idx_run_samples_run_device_ts ON run_samples(run_id, device, ts);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id INTEGER,
+    experiment_id INTEGER,
+    run_name TEXT NOT NULL,
+    run_description TEXT,
+    run_params TEXT,
+    run_status TEXT NOT NULL,
+    start_time TEXT,
+    stop_time TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS run_videos (
+    video_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL,
+    video_path TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS video_segments (
+    segment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER,
+    video_path TEXT NOT NULL UNIQUE,
+    segment INTEGER NOT NULL,
+    start_ts REAL,
+    end_ts REAL,
+    frame_count INTEGER NOT NULL,
+    fps REAL,
+    width INTEGER,
+    height INTEGER,
+    codec TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_video_segments_start ON video_segments(start_ts);
+CREATE INDEX IF NOT EXISTS idx_video_segments_run ON video_segments(run_id, start_ts);
+CREATE TABLE IF NOT EXISTS video_frames (
+    segment_id INTEGER NOT NULL,
+    frame INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (segment_id, frame)
+);
+"""
+
+SEGMENT_FIELDS = ("video_path", "segment", "run_id", "start_ts", "end_ts",
+                  "frame_count", "fps", "width", "height", "codec")
+
+
+def payload_rows(run_id, device, ts, payload, offset=0.0):
+    """Expand one */data payload into run_samples rows.
+
+    Payloads carrying "ts" (the unit's capture time, already on the MCU
+    clock, see clock_sync.py) are stamped with it; older ones fall back to
+    `ts`, the MCU receive time. SDU window messages carry their own sample
+    block; each sample gets a timestamp spread evenly across the window,
+    moved from the device clock to the MCU clock with the offset the unit
+    applied to "ts", or by subtracting `offset` when there is none.
+    """
+    window = payload.get("window")
+    captured = payload.get("ts")
+    if isinstance(window, dict) and "samples" in window:
+        count = window.get("count") or 0
+        if not count:
+            return []
+        stride = window.get("stride", 1)
+        scale = window.get("scale") or 1.0
+        if captured and "t_end" in window:
+            offset = window["t_end"] - captured
+        t_start = window.get("t_start", ts + offset) - offset
+        step = (window.get("t_end", ts + offset) - offset - t_start) / count * stride
+        rows = []
+        for name, block in window["samples"].items():
+            channel = f"{name}_CURRENT"
+            rows.extend(
+                (run_id, device, t_start + i * step, channel, raw / scale)
+                for i, raw in enumerate(block)
+            )
+        return rows
+
+    if captured:
+        ts = captured
+    return [
+        (run_id, device, ts, key, float(value))
+        for key, value in payload.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "ts"
+    ]
+
+
+def batch_rows(items):
+    """run_samples rows for queued (run_id, device, ts, payload, offset) items, grouped by run_id."""
+    rows = []
+    for item in items:
+        rows.extend(payload_rows(*item))
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def frame_match(video_path, run_id, fps, frame, ts):
+    """A find_frame() result: where in which file a capture time is."""
+    return {
+        "video_path": video_path,
+        "filename": os.path.basename(video_path),
+        "run_id": run_id,
+        "frame": frame,
+        "frame_ts": ts,
+        "position_seconds": round(frame / fps, 3) if fps else None,
+    }
+
+
+class PostgresBackend:
+    name = "postgres"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def connect(cls, dsn):
+        pool = await asyncpg.create_pool(dsn, min_size=1, max_size=2)
+        return cls(pool)
+
+    async def write(self, rows):
+        async with self.pool.acquire() as conn:
+            await conn.copy_records_to_table("run_samples", records=rows, columns=COLUMNS)
+
+    async def create_run(self, project_id, experiment_id, run_name, run_description, run_params, start_time):
+        return await self.pool.fetchval(
+            """INSERT INTO runs (project_id, experiment_id, run_name, run_description,
+                                 run_params, run_status, start_time)
+               VALUES ($1, $2, $3, $4, $5::jsonb, 'running', $6) RETURNING run_id""",
+            project_id, experiment_id, run_name, run_description, json.dumps(run_params), start_time,
+        )
+
+    async def finish_run(self, run_id, status, stop_time, params):
+        await self.pool.execute(
+            """UPDATE runs SET run_status = $2, stop_time = $3,
+                              run_params = COALESCE(run_params, '{}'::jsonb) || $4::jsonb
+               WHERE run_id = $1""",
+            run_id, status, stop_time, json.dumps(params),
+        )
+
+    async def fetch_samples(self, run_id):
+        records = await self.pool.fetch(
+            "SELECT device, ts, channel, value FROM run_samples WHERE run_id = $1 ORDER BY ts", run_id)
+        return [tuple(r) for r in records]
+
+    async def write_video_segment(self, segment, frame_ts):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                segment_id = await conn.fetchval(
+                    """INSERT INTO video_segments (video_path, segment, run_id, start_ts, end_ts,
+                                                   frame_count, fps, width, height, codec)
+                       VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                       ON CONFLICT (video_path) DO UPDATE SET
+                           segment = EXCLUDED.segment, run_id = EXCLUDED.run_id,
+                           start_ts = EXCLUDED.start_ts, end_ts = EXCLUDED.end_ts,
+                           frame_count = EXCLUDED.frame_count, fps = EXCLUDED.fps,
+                           width = EXCLUDED.width, height = EXCLUDED.height, codec = EXCLUDED.codec
+                       RETURNING segment_id""",
+                    *(segment[f] for f in SEGMENT_FIELDS),
+                )
+                await conn.execute("DELETE FROM video_frames WHERE segment_id = $1", segment_id)
+                await conn.copy_records_to_table(
+                    "video_frames", records=[(segment_id, i, t) for i, t in enumerate(frame_ts)],
+                    columns=("segment_id", "frame", "ts"))
+                if segment["run_id"] is not None:
+                    await conn.execute("INSERT INTO run_videos (run_id, video_path) VALUES ($1, $2)",
+                                       segment["run_id"], segment["video_path"])
+
+    async def fetch_video_segment(self, video_path):
+        record = await self.pool.fetchrow(
+            f"SELECT {', '.join(SEGMENT_FIELDS)} FROM video_segments WHERE video_path = $1", video_path)
+        return dict(record) if record else None
+
+    async def fetch_run_videos(self, run_id):
+        records = await self.pool.fetch(
+            f"SELECT {', '.join(SEGMENT_FIELDS)} FROM video_segments WHERE run_id = $1 ORDER BY start_ts",
+            run_id)
+        return [dict(r) for r in records]
+
+    async def fetch_linked_videos(self):
+        records = await self.pool.fetch("SELECT DISTINCT video_path FROM run_videos")
+        return {r["video_path"] for r in records}
+
+    async def delete_video_index(self, video_path):
+        # video_frames rows go with it (ON DELETE CASCADE)
+        await self.pool.execute("DELETE FROM video_segments WHERE video_path = $1", video_path)
+
+    async def update_video_codec(self, video_path, codec):
+        await self.pool.execute("UPDATE video_segments SET codec = $2 WHERE video_path = $1", video_path, codec)
+
+    async def find_frame(self, ts, run_id=None):
+        async with self.pool.acquire() as conn:
+            segment = await conn.fetchrow(
+                """SELECT segment_id, video_path, run_id, fps FROM video_segments
+                   WHERE start_ts <= $1 AND end_ts + 1.0 / fps >= $1
+                     AND ($2::integer IS NULL OR run_id = $2)
+                   ORDER BY start_ts DESC LIMIT 1""",
+                ts, run_id)
+            if segment is None:
+                return None
+            frame = await conn.fetchrow(
+                """SELECT frame, ts FROM video_frames WHERE segment_id = $1 AND ts <= $2
+                   ORDER BY frame DESC LIMIT 1""",
+                segment["segment_id"], ts)
+        return frame_match(segment["video_path"], segment["run_id"], segment["fps"], *frame)
+
+    async def close(self):
+        await self.pool.close()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _write(self, rows):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO run_samples (run_id, device, ts, channel, value) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    async def write(self, rows):
+        await self._run(self._write, rows)
+
+    def _create_run(self, project_id, experiment_id, run_name, run_description, run_params, start_time):
+        with self.conn:
+            cursor = self.conn.execute(
+                """INSERT INTO runs (project_id, experiment_id, run_name, run_description,
+                                     run_params, run_status, start_time)
+                   VALUES (?, ?, ?, ?, ?, 'running', ?)""",
+                (project_id, experiment_id, run_name, run_description, json.dumps(run_params),
+                 start_time.isoformat()),
+            )
+        return cursor.lastrowid
+
+    async def create_run(self, *args):
+        return await self._run(self._create_run, *args)
+
+    def _finish_run(self, run_id, status, stop_time, params):
+        with self.conn:
+            row = self.conn.execute("SELECT run_params FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            merged = json.loads(row[0] or "{}") if row else {}
+            merged.update(params)
+            self.conn.execute(
+                "UPDATE runs SET run_status = ?, stop_time = ?, run_params = ? WHERE run_id = ?",
+                (status, stop_time.isoformat(), json.dumps(merged), run_id),
+            )
+
+    async def finish_run(self, *args):
+        await self._run(self._finish_run, *args)
+
+    def _fetch_samples(self, run_id):
+        return self.conn.execute(
+            "SELECT device, ts, channel, value FROM run_samples WHERE run_id = ? ORDER BY ts",
+            (run_id,),
+        ).fetchall()
+
+    async def fetch_samples(self, run_id):
+        return await self._run(self._fetch_samples, run_id)
+
+    def _write_video_segment(self, segment, frame_ts):
+        with self.conn:
+            self.conn.execute("DELETE FROM video_frames WHERE segment_id IN "
+                              "(SELECT segment_id FROM video_segments WHERE video_path = ?)",
+                              (segment["video_path"],))
+            self.conn.execute("DELETE FROM video_segments WHERE video_path = ?", (segment["video_path"],))
+            cursor = self.conn.execute(
+                f"INSERT INTO video_segments ({', '.join(SEGMENT_FIELDS)}) VALUES ({', '.join('?' * len(SEGMENT_FIELDS))})",
+                tuple(segment[f] for f in SEGMENT_FIELDS),
+            )
+            segment_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO video_frames (segment_id, frame, ts) VALUES (?, ?, ?)",
+                ((segment_id, i, t) for i, t in enumerate(frame_ts)),
+            )
+            if segment["run_id"] is not None:
+                self.conn.execute("INSERT INTO run_videos (run_id, video_path) VALUES (?, ?)",
+                                  (segment["run_id"], segment["video_path"]))
+
+    async def write_video_segment(self, *args):
+        await self._run(self._write_video_segment, *args)
+
+    def _fetch_segments(self, where, params):
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(SEGMENT_FIELDS)} FROM video_segments WHERE {where} ORDER BY start_ts", params)
+        return [dict(zip(SEGMENT_FIELDS, row)) for row in cursor.fetchall()]
+
+    async def fetch_video_segment(self, video_path):
+        rows = await self._run(self._fetch_segments, "video_path = ?", (video_path,))
+        return rows[0] if rows else None
+
+    async def fetch_run_videos(self, run_id):
+        return await self._run(self._fetch_segments, "run_id = ?", (run_id,))
+
+    def _fetch_linked_videos(self):
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT video_path FROM run_videos")}
+
+    async def fetch_linked_videos(self):
+        return await self._run(self._fetch_linked_videos)
+
+    def _delete_video_index(self, video_path):
+        with self.conn:
+            self.conn.execute("DELETE FROM video_frames WHERE segment_id IN "
+                              "(SELECT segment_id FROM video_segments WHERE video_path = ?)", (video_path,))
+            self.conn.execute("DELETE FROM video_segments WHERE video_path = ?", (video_path,))
+
+    async def delete_video_index(self, video_path):
+        await self._run(self._delete_video_index, video_path)
+
+    def _update_video_codec(self, video_path, codec):
+        with self.conn:
+            self.conn.execute("UPDATE video_segments SET codec = ? WHERE video_path = ?", (codec, video_path))
+
+    async def update_video_codec(self, *args):
+        await self._run(self._update_video_codec, *args)
+
+    def _find_frame(self, ts, run_id):
+        segment = self.conn.execute(
+            """SELECT segment_id, video_path, run_id, fps FROM video_segments
+               WHERE start_ts <= ? AND end_ts + 1.0 / fps >= ? AND (? IS NULL OR run_id = ?)
+               ORDER BY start_ts DESC LIMIT 1""",
+            (ts, ts, run_id, run_id),
+        ).fetchone()
+        if segment is None:
+            return None
+        frame = self.conn.execute(
+            "SELECT frame, ts FROM video_frames WHERE segment_id = ? AND ts <= ? ORDER BY frame DESC LIMIT 1",
+            (segment[0], ts),
+        ).fetchone()
+        return frame_match(segment[1], segment[2], segment[3], *frame)
+
+    async def find_frame(self, ts, run_id=None):
+        return await self._run(self._find_frame, ts, run_id)
+
+    async def close(self):
+        await self._run(self.conn.close)
+        self.executor.shutdown()
+
+
+class SampleStore:
+    def __init__(self, dsn=None, sqlite_path="run_samples.sqlite3",
+                 flush_interval=0.5, max_pending=100000):
+        self.dsn = dsn
+        self.sqlite_path = sqlite_path
+        self.flush_interval = flush_interval
+        self.pending = deque(maxlen=max_pending)
+        self.backend = None
+        self.run_id = None
+        self.running = False
+        self.clock_offsets = {}  # device clock - MCU clock, seconds; see clock_sync.py
+        self.pending_segments = deque()  # (segment dict, frame times) from the recorder
+
+        self.messages = 0
+        self.dropped = 0
+        self.rows_written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.last_flush_ms = 0.0
+        self.video_segments = 0
+
+    def start_run(self, run_id):
+        self.run_id = run_id
+
+    def stop_run(self):
+        self.run_id = None
+
+    def submit(self, device, ts, payload):
+        """Queue a payload for the active run. Safe from any thread."""
+        run_id = self.run_id
+        if run_id is None:
+            return
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append((run_id, device, ts, payload, self.clock_offsets.get(device, 0.0)))
+        self.messages += 1
+
+    def submit_video_segment(self, segment):
+        """Queue a closed VideoSegment's index. Safe from any thread (the recorder's encoder)."""
+        self.pending_segments.append((segment.describe(), segment.frame_ts.tolist()))
+
+    async def open(self):
+        if self.dsn and asyncpg is not None:
+            try:
+                self.backend = await PostgresBackend.connect(self.dsn)
+            except Exception as e:
+                print(f"[SampleStore] PostgreSQL unavailable ({e}), using SQLite")
+        if self.backend is None:
+            self.backend = SQLiteBackend(self.sqlite_path)
+        print(f"[SampleStore] Writing run_samples to {self.backend.name}")
+
+    async def flush(self):
+        await self.flush_video_segments()
+        pending = self.pending
+        items = [pending.popleft() for _ in range(len(pending))]
+        if not items:
+            return 0
+        rows = await asyncio.get_running_loop().run_in_executor(None, batch_rows, items)
+        if not rows:
+            return 0
+        start = time.perf_counter()
+        try:
+            await self.backend.write(rows)
+        except Exception as e:
+            self.write_errors += 1
+            print(f"[SampleStore] Write failed, {len(rows)} rows lost: {e}")
+            return 0
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        self.rows_written += len(rows)
+        self.batches += 1
+        return len(rows)
+
+    async def flush_video_segments(self):
+        while self.pending_segments:
+            segment, frame_ts = self.pending_segments.popleft()
+            try:
+                await self.backend.write_video_segment(segment, frame_ts)
+            except Exception as e:
+                self.write_errors += 1
+                print(f"[SampleStore] Video index for {segment['video_path']} lost: {e}")
+                continue
+            self.video_segments += 1
+
+    async def run(self):
+        if self.backend is None:
+            await self.open()
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        self.running = False
+        if self.backend is not None:
+            await self.flush()
+            await self.backend.close()
+
+    def stats(self):
+        return {
+            "backend": self.backend.name if self.backend else None,
+            "run_id": self.run_id,
+            "pending": len(self.pending),
+            "messages": self.messages,
+            "dropped": self.dropped,
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "video_segments": self.video_segments,
+        }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Video streaming benchmark: the old 8 KiB generator vs RangeFileResponse.
+
+Starts uvicorn in a child process serving one test file two ways:
+
+    /legacy   StreamingResponse over f.read(8192), as /stream/ used to
+    /ranged   range_response.RangeFileResponse
+
+then downloads it (whole file and 1 MiB ranges) with plain sockets and
+reports MB/s and the server's CPU seconds per GB sent, read from
+/proc/<pid>/stat. Run it on the Pi against the USB stick to see the real
+numbers; pass --file to use an existing recording.
+
+    python3 stream_bench.py [--size-mb 200] [--runs 3] [--file /media/pi/.../video.avi]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+PORT = 8765
+
+
+def make_app(path):
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from range_response import RangeFileResponse
+
+    app = FastAPI()
+    size = os.path.getsize(path)
+
+    @app.get("/legacy")
+    async def legacy():
+        def video_stream():
+            with open(path, "rb") as f:
+                while chunk := f.read(8192):
+                    yield chunk
+        return StreamingResponse(video_stream(), media_type="video/x-msvideo",
+                                 headers={"Accept-Ranges": "bytes", "Content-Length": str(size)})
+
+    @app.get("/ranged")
+    async def ranged():
+        return RangeFileResponse(path, "video/x-msvideo")
+
+    return app
+
+
+def serve(path):
+    import uvicorn
+    uvicorn.run(make_app(path), host="127.0.0.1", port=PORT, log_level="warning")
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def get(path, headers=""):
+    """Plain HTTP/1.1 GET; returns body bytes received (headers excluded)."""
+    sock = socket.create_connection(("127.0.0.1", PORT))
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n{headers}\r\n".encode())
+    received = 0
+    header_done = False
+    buf = b""
+    while True:
+        data = sock.recv(1 << 20)
+        if not data:
+            break
+        if header_done:
+            received += len(data)
+        else:
+            buf += data
+            if b"\r\n\r\n" in buf:
+                header_done = True
+                received += len(buf.split(b"\r\n\r\n", 1)[1])
+                buf = b""
+    sock.close()
+    return received
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranged video streaming benchmark")
+    parser.add_argument("--file")
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+
+    path = args.file
+    if path is None:
+        path = "/tmp/stream_bench.bin"
+        with open(path, "wb") as f:
+            block = os.urandom(1 << 20)
+            for _ in range(args.size_mb):
+                f.write(block)
+    size = os.path.getsize(path)
+
+    server = subprocess.Popen([sys.executable, __file__, "--serve", path])
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", PORT)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        print(f"file {path}: {size / 1e6:.0f} MB, {args.runs} runs each")
+        print(f"{'endpoint':<8} {'request':<14} {'MB/s':>8} {'CPU s/GB':>9}")
+        for endpoint in ("legacy", "ranged"):
+            for label, headers, expected in (
+                ("whole file", "", size),
+                ("1 MiB ranges", None, None),
+            ):
+                cpu0 = cpu_seconds(server.pid)
+                start = time.perf_counter()
+                sent = 0
+                for _ in range(args.runs):
+                    if headers is None:
+                        # legacy ignores Range, so only time what ranged serves
+                        if endpoint == "legacy":
+                            sent = 0
+                            break
+                        for offset in range(0, size, 1 << 20):
+                            sent += get(f"/{endpoint}", f"Range: bytes={offset}-{offset + (1 << 20) - 1}\r\n")
+                    else:
+                        got = get(f"/{endpoint}", headers)
+                        if got != expected:
+                            print(f"  short read: {got} of {expected}")
+                        sent += got
+                if not sent:
+                    continue
+                elapsed = time.perf_counter() - start
+                cpu = cpu_seconds(server.pid) - cpu0
+                print(f"{endpoint:<8} {label:<14} {sent / elapsed / 1e6:>8.1f} {cpu / (sent / 1e9):>9.2f}")
+    finally:
+        server.terminate()
+        server.wait()
+        if args.file is None:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
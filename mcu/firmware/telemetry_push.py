@@ -0,0 +1,100 @@
+"""
+Per-client WebSocket telemetry subscriptions.
+
+A client sends
+
+    {"type": "subscribe", "devices": ["lcu", "sdu"],
+     "fields": {"lcu": ["load", "pos_mm"]}, "max_rate": 10}
+
+and then receives "telemetry" frames carrying only the fields that changed
+since its previous frame, at most max_rate frames per second. The first
+frame after (re)subscribing is a full snapshot ("full": true).
+
+"fields" may be a per-device dict or a flat list applied to every device;
+when a device has no field list, all of its scalar fields are sent.
+"""
+
+DEFAULT_MAX_RATE = 10.0
+MAX_RATE_LIMIT = 50.0
+
+
+class TelemetrySubscription:
+    def __init__(self, known_devices):
+        self.known_devices = tuple(known_devices)
+        self.devices = ()
+        self.fields = {}
+        self.min_interval = 1.0 / DEFAULT_MAX_RATE
+        self.last_sent = {}
+        self.last_push = 0.0
+        self.needs_full = True
+
+    @property
+    def active(self):
+        return bool(self.devices)
+
+    def update(self, request):
+        """Apply a subscribe message; raises ValueError on bad input."""
+        devices = request.get("devices") or list(self.known_devices)
+        unknown = [d for d in devices if d not in self.known_devices]
+        if unknown:
+            raise ValueError(f"Unknown devices {unknown}")
+
+        fields = request.get("fields") or {}
+        if isinstance(fields, list):
+            fields = {device: fields for device in devices}
+        elif not isinstance(fields, dict):
+            raise ValueError("fields must be a list or a dict of lists")
+
+        max_rate = float(request.get("max_rate", DEFAULT_MAX_RATE))
+        if max_rate <= 0:
+            raise ValueError("max_rate must be > 0")
+
+        self.devices = tuple(devices)
+        self.fields = {d: tuple(fields[d]) for d in devices if fields.get(d)}
+        self.min_interval = 1.0 / min(max_rate, MAX_RATE_LIMIT)
+        self.last_sent = {}
+        self.needs_full = True
+
+    def clear(self):
+        self.devices = ()
+        self.fields = {}
+        self.last_sent = {}
+
+    def describe(self):
+        return {
+            "devices": list(self.devices),
+            "fields": {d: list(f) for d, f in self.fields.items()},
+            "max_rate": round(1.0 / self.min_interval, 3),
+        }
+
+    def delta(self, device_data, now):
+        """Changed fields since the last frame, or None if nothing is due."""
+        if not self.devices or now - self.last_push < self.min_interval:
+            return None
+
+        changes = {}
+        for device in self.devices:
+            data = device_data.get(device)
+            if not data:
+                continue
+            wanted = self.fields.get(device)
+            sent = self.last_sent.setdefault(device, {})
+            device_changes = {}
+            for key in wanted or data:
+                if key not in data:
+                    continue
+                value = data[key]
+                if wanted is None and isinstance(value, (dict, list)):
+                    continue  # bulky blocks (e.g. SDU window) only on request
+                if key not in sent or sent[key] != value:
+                    device_changes[key] = value
+                    sent[key] = value
+            if device_changes:
+                changes[device] = device_changes
+
+        if not changes and not self.needs_full:
+            return None
+        full = self.needs_full
+        self.needs_full = False
+        self.last_push = now
+        return {"full": full, "data": changes}
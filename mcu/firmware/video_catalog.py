@@ -0,0 +1,363 @@
+"""
+In-memory catalog of the recordings on the USB drive.
+
+/videos/ used to glob and stat the whole mount on every request, and
+/videos/{filename}/info opened the file with cv2.VideoCapture; on a slow
+stick with hundreds of recordings that took seconds. VideoCatalog scans
+the directory once, on its own thread, and then keeps up incrementally:
+
+- inotify (via libc, no extra package) reports files created, written,
+  closed, renamed and deleted; events are read in batches every
+  BATCH_DELAY so a file being recorded costs one stat per batch, not one
+  per frame. A queue overflow triggers a rescan. When the drive is
+  unmounted the catalog empties and waits for it to come back.
+- without inotify (not Linux) it rescans every POLL_INTERVAL instead.
+- the recorder reports each closed segment (add_segment), which fills
+  in fps / frame count / duration from its index without opening the
+  file.
+
+Video metadata is cached keyed by (inode, mtime), so a file that is
+rewritten or replaced under the same name is probed again, and a probe
+(cv2) happens at most once per file version. The cache is in memory
+only: the drive is vfat, whose inode numbers are not stable across
+mounts.
+"""
+import ctypes
+import os
+import select
+import struct
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+VIDEO_EXTENSION = ".avi"
+BATCH_DELAY = 0.5       # s between inotify reads; events for one file coalesce meanwhile
+POLL_INTERVAL = 10.0    # rescan period when inotify is unavailable
+MOUNT_POLL = 5.0        # how often to look for the drive while it's missing
+SORT_KEYS = ("modified", "created", "size", "filename", "duration")
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+GONE_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED
+_EVENT = struct.Struct("iIII")
+
+
+def _load_inotify():
+    if not hasattr(select, "poll"):
+        return None
+    try:
+        # The process's own symbols, not find_library(): that runs ldconfig through
+        # a pipe, and a pool forked meanwhile inherits the pipe and hangs the read
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def probe_video(path):
+    """fps / frame count / size / fourcc from the file itself. Slow: call off the event loop."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, "little")
+        return {
+            "fps": fps,
+            "frame_count": frame_count,
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "duration_seconds": frame_count / fps if fps > 0 else 0,
+            "codec": fourcc.decode("ascii", "replace").strip("\0 "),
+        }
+    finally:
+        cap.release()
+
+
+class VideoFile:
+    __slots__ = ("filename", "path", "inode", "size", "ctime", "mtime", "mtime_ns", "created", "modified")
+
+    def __init__(self, filename, path, stat):
+        self.filename = filename
+        self.path = path
+        self.inode = stat.st_ino
+        self.size = stat.st_size
+        self.ctime = stat.st_ctime
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.created = datetime.fromtimestamp(stat.st_ctime).isoformat()
+        self.modified = datetime.fromtimestamp(stat.st_mtime).isoformat()
+
+    @property
+    def key(self):
+        return (self.inode, self.mtime_ns)
+
+    def describe(self):
+        return {
+            "filename": self.filename,
+            "size": self.size,
+            "created": self.created,
+            "modified": self.modified,
+        }
+
+
+class VideoCatalog:
+    def __init__(self, directory, extension=VIDEO_EXTENSION, probe=probe_video):
+        self.directory = directory
+        self.extension = extension
+        self.probe = probe
+        self.files = {}     # filename -> VideoFile
+        self.metadata = {}  # (inode, mtime_ns) -> video info dict
+        self.lock = threading.Lock()
+        self.ready = threading.Event()  # first scan finished (drive present or not)
+        self.available = False
+        self.stopping = threading.Event()
+        self.thread = None
+        self.mode = None
+
+        self.scans = 0
+        self.scan_seconds = 0.0
+        self.events = 0
+        self.overflows = 0
+        self.probes = 0
+        self.metadata_hits = 0
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    # --- queries (any thread) ---
+
+    def get(self, filename):
+        return self.files.get(filename)
+
+    def list(self, sort="modified", descending=True, offset=0, limit=None):
+        """(page of described files, total count)."""
+        with self.lock:
+            files = list(self.files.values())
+            metadata = self.metadata
+            if sort == "duration":
+                def key(f):
+                    info = metadata.get(f.key)
+                    return info["duration_seconds"] if info else -1
+            elif sort == "filename":
+                key = lambda f: f.filename
+            elif sort == "size":
+                key = lambda f: f.size
+            elif sort == "created":
+                key = lambda f: f.ctime
+            else:
+                key = lambda f: f.mtime_ns
+            files.sort(key=key, reverse=descending)
+            page = files[offset:offset + limit if limit is not None else None]
+            described = []
+            for f in page:
+                item = f.describe()
+                info = metadata.get(f.key)
+                if info is not None:
+                    item["video_info"] = info
+                described.append(item)
+        return described, len(files)
+
+    def cached_info(self, video_file):
+        info = self.metadata.get(video_file.key)
+        if info is not None:
+            self.metadata_hits += 1
+        return info
+
+    def remember(self, video_file, info):
+        if info is not None:
+            with self.lock:
+                self.metadata[video_file.key] = info
+
+    def info(self, video_file):
+        """Cached metadata, probing the file on a miss. Blocking on a miss."""
+        info = self.cached_info(video_file)
+        if info is None:
+            self.probes += 1
+            info = self.probe(video_file.path)
+            self.remember(video_file, info)
+        return info
+
+    # --- updates ---
+
+    def add_segment(self, segment):
+        """Recorder on_segment hook: the closed file's metadata comes from its index."""
+        filename = os.path.basename(segment.path)
+        if os.path.dirname(os.path.abspath(segment.path)) != os.path.abspath(self.directory):
+            return
+        video_file = self._refresh(filename)
+        if video_file is None:
+            return
+        frames = segment.frame_count
+        self.remember(video_file, {
+            "fps": segment.fps,
+            "frame_count": frames,
+            "width": segment.width,
+            "height": segment.height,
+            "duration_seconds": frames / segment.fps if segment.fps else 0,
+            "codec": segment.codec,
+        })
+
+    def discard(self, filename):
+        """Drop a file removed through the API without waiting for its event."""
+        with self.lock:
+            video_file = self.files.pop(filename, None)
+            if video_file is not None:
+                self.metadata.pop(video_file.key, None)
+
+    def _refresh(self, filename):
+        if not filename.endswith(self.extension):
+            return None
+        path = os.path.join(self.directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.discard(filename)
+            return None
+        video_file = VideoFile(filename, path, stat)
+        with self.lock:
+            old = self.files.get(filename)
+            if old is not None and old.key != video_file.key:
+                self.metadata.pop(old.key, None)
+            self.files[filename] = video_file
+        return video_file
+
+    def _scan(self):
+        start = time.perf_counter()
+        files = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self.extension) and entry.is_file():
+                        try:
+                            files[entry.name] = VideoFile(entry.name, entry.path, entry.stat())
+                        except OSError:
+                            pass
+        except OSError:
+            self._unavailable()
+            return False
+        with self.lock:
+            keys = {f.key for f in files.values()}
+            self.files = files
+            self.metadata = {k: v for k, v in self.metadata.items() if k in keys}
+            self.available = True
+        self.scans += 1
+        self.scan_seconds = time.perf_counter() - start
+        self.ready.set()
+        return True
+
+    def _unavailable(self):
+        with self.lock:
+            if self.available:
+                print(f"[Catalog] {self.directory} unavailable")
+            self.files = {}
+            self.available = False
+        self.ready.set()
+
+    # --- watcher thread ---
+
+    def _run(self):
+        libc = _load_inotify()
+        self.mode = "inotify" if libc is not None else "poll"
+        while not self.stopping.is_set():
+            if not os.path.isdir(self.directory):
+                self._unavailable()
+                self.stopping.wait(MOUNT_POLL)
+                continue
+            if libc is None:
+                self._scan()
+                self.stopping.wait(POLL_INTERVAL)
+                continue
+            try:
+                self._watch(libc)
+            except Exception as e:
+                print(f"[Catalog] Watch failed ({e}), rescanning")
+                self.stopping.wait(MOUNT_POLL)
+
+    def _watch(self, libc):
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        try:
+            # Watch before the scan so nothing created in between is missed
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch")
+            if not self._scan():
+                return
+            print(f"[Catalog] {len(self.files)} videos in {self.directory} ({self.scan_seconds * 1000:.0f} ms)")
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            while not self.stopping.is_set():
+                if not poller.poll(1000):
+                    continue
+                self.stopping.wait(BATCH_DELAY)
+                changed, gone, overflow = self._read_events(fd)
+                if gone:
+                    self._unavailable()
+                    return
+                if overflow:
+                    self.overflows += 1
+                    self._scan()
+                    continue
+                for filename in changed:
+                    self._refresh(filename)
+        finally:
+            os.close(fd)
+
+    def _read_events(self, fd):
+        changed = set()
+        gone = overflow = False
+        data = os.read(fd, 64 * 1024)
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            self.events += 1
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif mask & GONE_MASK:
+                gone = True
+            elif name:
+                changed.add(os.fsdecode(name))
+        return changed, gone, overflow
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "available": self.available,
+            "mode": self.mode,
+            "files": len(self.files),
+            "metadata_cached": len(self.metadata),
+            "scans": self.scans,
+            "last_scan_ms": round(self.scan_seconds * 1000, 2),
+            "events": self.events,
+            "overflows": self.overflows,
+            "probes": self.probes,
+            "metadata_hits": self.metadata_hits,
+        }
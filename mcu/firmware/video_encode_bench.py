@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Per-frame encode cost of the recorder codecs.
+
+Writes synthetic 640x480 frames (a moving gradient plus sensor-like
+noise) through cv2.VideoWriter for each codec in video_recorder.CODECS
+and reports ms per frame, the frame rate one encoder thread could
+sustain, and bytes per second of video. Run it on the Pi to choose
+VIDEO_CODEC.
+
+    python3 video_encode_bench.py [--frames 200] [--fps 20] [--dir /tmp]
+"""
+import argparse
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+from video_recorder import CODECS
+
+
+def make_frames(count, width, height):
+    rng = np.random.default_rng(7)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    frames = []
+    for i in range(min(count, 50)):
+        row = (x + i * 5) % 256
+        base = np.repeat(row[None, :], height, axis=0)
+        noise = rng.normal(0, 6, (height, width)).astype(np.float32)
+        gray = np.clip(base + noise, 0, 255).astype(np.uint8)
+        frames.append(cv2.merge([gray, np.roll(gray, i, axis=0), 255 - gray]))
+    return frames
+
+
+def bench(codec, frames, count, fps, path):
+    height, width = frames[0].shape[:2]
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+    if not out.isOpened():
+        return None
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        out.write(frames[i % len(frames)])
+        times.append(time.perf_counter() - start)
+    out.release()
+    size = os.path.getsize(path)
+    os.remove(path)
+    times.sort()
+    mean = sum(times) / len(times)
+    return {
+        "mean_ms": mean * 1000,
+        "p99_ms": times[min(int(len(times) * 0.99), len(times) - 1)] * 1000,
+        "max_fps": 1 / mean,
+        "kbytes_per_s": size / (count / fps) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recorder codec encode benchmark")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--fps", type=float, default=20.0)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--dir", default="/tmp")
+    args = parser.parse_args()
+
+    print(f"{platform.machine()} / Python {platform.python_version()} / OpenCV {cv2.__version__}")
+    frames = make_frames(args.frames, args.width, args.height)
+    print(f"{'codec':<6} {'ms/frame':>9} {'p99 ms':>8} {'max fps':>8} {'KiB/s':>8}")
+    for codec in CODECS:
+        result = bench(codec, frames, args.frames, args.fps,
+                       os.path.join(args.dir, f"encode_bench_{codec}.avi"))
+        if result is None:
+            print(f"{codec:<6} writer unavailable in this OpenCV build")
+            continue
+        print(f"{codec:<6} {result['mean_ms']:>9.2f} {result['p99_ms']:>8.2f} "
+              f"{result['max_fps']:>8.1f} {result['kbytes_per_s']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
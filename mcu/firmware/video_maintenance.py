@@ -0,0 +1,411 @@
+"""
+Background upkeep of the recordings on the USB drive: retention and
+transcoding.
+
+Retention runs every `interval`, and at once when the recorder reports
+low space (VideoRecorder on_low_space). It works from the VideoCatalog,
+so a pass doesn't rescan the drive. Files go in this order, oldest
+first:
+
+    age         older than max_age_days
+    size        recordings total more than max_bytes
+    low_space   free space under min_free_bytes
+
+With keep_run_videos, files linked to a run in run_videos are exempt from
+the age and size rules. They are only deleted for low_space, after every
+unlinked file, because a recording cut short by a full disk is worse
+than losing the oldest run's video. While the run links can't be read
+(no database), every file counts as linked. The file being recorded and
+the one being transcoded are never touched. A deleted file's video index
+rows go too.
+
+min_free_bytes is meant to be far above the recorder's own stop
+threshold (MIN_FREE_BYTES): maintenance frees space long before the
+recorder would have to stop.
+
+Transcoding re-encodes finished recordings into the most compact codec
+the OpenCV build can write, tried in order from TRANSCODE_CODECS (H.264
+where ffmpeg has libx264 or the Pi's v4l2m2m encoder; otherwise MPEG-4,
+which is ~6x smaller than the recorder's MJPG). A file is only
+transcoded to a codec ranked above its own, and the result is kept only
+if it has the same frame count (so the frame index stays valid) and is
+at least TRANSCODE_MIN_SAVING smaller. It replaces the original under the
+same name with os.replace, so open streams keep reading the old file.
+One file at a time, in a single-worker process pool at nice 19 (which
+also lowers its I/O priority), started from the same forkserver as
+video_preview.py's pool (video_preview.worker_context).
+"""
+import asyncio
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from video_preview import worker_context
+
+MAINTENANCE_INTERVAL = 60.0
+MAX_AGE_DAYS = 30
+MIN_FREE_BYTES = 2 * 1024 ** 3
+TRANSCODE_CODECS = ("avc1", "H264", "XVID")  # first one the build can write wins
+TRANSCODE_MIN_AGE = 120.0     # s since last write before a file counts as finished
+TRANSCODE_MIN_SAVING = 0.10
+TRANSCODE_DIR = ".transcode"  # temp output, on the same filesystem so os.replace works
+WORKER_NICE = 19
+
+# Codec families by compactness; fourccs as written or as OpenCV reads them back
+CODEC_RANK = {
+    "MJPG": 0,
+    "XVID": 1, "FMP4": 1, "DIVX": 1, "DX50": 1, "MP4V": 1, "mp4v": 1,
+    "avc1": 2, "AVC1": 2, "H264": 2, "h264": 2, "X264": 2, "x264": 2,
+}
+
+
+def _init_worker():
+    try:
+        os.nice(WORKER_NICE)
+    except OSError:
+        pass
+    cv2.setNumThreads(1)
+
+
+def pick_codec(codecs, directory):
+    """First codec in `codecs` this OpenCV build can write to an .avi, or None."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "codec_probe.avi")
+    try:
+        for codec in codecs:
+            out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), 20.0, (64, 48))
+            opened = out.isOpened()
+            out.release()
+            if opened:
+                return codec
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def transcode_video(path, codec, tmp_dir, min_saving):
+    """Re-encode `path` to `codec` in place if that makes it smaller. Runs in the pool."""
+    cpu_start = time.process_time()
+    result = {"path": path, "codec": codec}
+    before = os.stat(path)
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+    cap = cv2.VideoCapture(path)
+    out = None
+    try:
+        if not cap.isOpened():
+            result["status"] = "unreadable"
+            return result
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frames = 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if out is None:
+                height, width = frame.shape[:2]
+                out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+                if not out.isOpened():
+                    result["status"] = "writer_failed"
+                    return result
+            out.write(frame)
+            frames += 1
+        cap.release()
+        if out is None:
+            result["status"] = "empty"
+            return result
+        out.release()
+        out = None
+
+        new_size = os.path.getsize(tmp_path)
+        result.update(frames=frames, old_size=before.st_size, new_size=new_size)
+        if frames != count:
+            result["status"] = "frame_mismatch"
+        elif new_size > before.st_size * (1 - min_saving):
+            result["status"] = "not_smaller"
+        else:
+            after = os.stat(path)
+            if (after.st_ino, after.st_mtime_ns) != (before.st_ino, before.st_mtime_ns):
+                result["status"] = "changed"  # rewritten or replaced meanwhile
+            else:
+                # Keep the recording's time: retention ages and /videos/ sorting go by it
+                os.utime(tmp_path, ns=(before.st_atime_ns, before.st_mtime_ns))
+                os.replace(tmp_path, path)
+                result["status"] = "done"
+        return result
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        result["cpu_seconds"] = time.process_time() - cpu_start
+
+
+class VideoMaintenance:
+    def __init__(self, catalog, store, is_recording, max_age_days=MAX_AGE_DAYS, max_bytes=None,
+                 min_free_bytes=MIN_FREE_BYTES, keep_run_videos=True, transcode=True,
+                 interval=MAINTENANCE_INTERVAL):
+        self.catalog = catalog
+        self.store = store              # SampleStore: run links and the video index
+        self.is_recording = is_recording
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.keep_run_videos = keep_run_videos
+        self.transcode = transcode
+        self.interval = interval
+
+        self.loop = None
+        self.wakeup = None
+        self.pool = None
+        self.codec = None               # transcode target, once the pool has probed it
+        self.transcoding = None         # path being transcoded
+        self.transcode_task = None
+        self.skip = {}                  # (inode, mtime_ns) -> reason it is not transcoded
+
+        self.passes = 0
+        self.low_space_requests = 0
+        self.last_pass_ms = 0.0
+        self.last_pass_at = None
+        self.free_bytes = None
+        self.recordings_bytes = 0
+        self.deleted = {"age": 0, "size": 0, "low_space": 0}
+        self.deleted_linked = 0
+        self.bytes_freed = 0
+        self.transcoded = 0
+        self.transcode_results = {}
+        self.transcode_saved = 0
+        self.transcode_cpu_seconds = 0.0
+        self.transcode_wall_seconds = 0.0
+        self.errors = 0
+        self.last_error = None
+
+    def start(self):
+        """Fork the transcode worker now, while the process is quiet."""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        if self.transcode:
+            self.pool = self._new_pool()
+            self.pool.submit(os.getpid)
+
+    def stop(self):
+        if self.transcode_task is not None:
+            self.transcode_task.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(1, mp_context=worker_context(), initializer=_init_worker)
+
+    def request(self, reason=None):
+        """Run a pass now. Safe from any thread (the recorder calls it on low space)."""
+        if self.loop is None:
+            return
+        if reason == "low_space":
+            self.low_space_requests += 1
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                print(f"[Maintenance] Pass failed: {e}")
+
+    async def run_once(self):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        if not self.catalog.available:
+            return
+        linked = await self._linked_videos()
+        with self.catalog.lock:
+            files = sorted(self.catalog.files.values(), key=lambda f: f.mtime)
+        files = [f for f in files if not self.is_recording(f.path) and f.path != self.transcoding]
+        self.free_bytes = (await loop.run_in_executor(None, shutil.disk_usage, self.catalog.directory)).free
+        self.recordings_bytes = sum(f.size for f in self.catalog.files.values())
+
+        def protected(f):
+            return self.keep_run_videos and (linked is None or f.path in linked)
+
+        now = time.time()
+        doomed = []  # (file, reason)
+        if self.max_age_days is not None:
+            cutoff = now - self.max_age_days * 86400
+            doomed += [(f, "age") for f in files if f.mtime < cutoff and not protected(f)]
+        gone = {f.path for f, _ in doomed}
+        remaining = self.recordings_bytes - sum(f.size for f, _ in doomed)
+        if self.max_bytes is not None:
+            for f in files:
+                if remaining <= self.max_bytes:
+                    break
+                if f.path not in gone and not protected(f):
+                    doomed.append((f, "size"))
+                    gone.add(f.path)
+                    remaining -= f.size
+        free = self.free_bytes + sum(f.size for f, _ in doomed)
+        for f in sorted(files, key=protected):  # unlinked first, each oldest first
+            if free >= self.min_free_bytes:
+                break
+            if f.path not in gone:
+                doomed.append((f, "low_space"))
+                gone.add(f.path)
+                free += f.size
+
+        for f, reason in doomed:
+            await self._delete(f, reason, linked is None or f.path in linked)
+
+        self.passes += 1
+        self.last_pass_at = now
+        self.last_pass_ms = (time.perf_counter() - started) * 1000
+        if self.transcode and self.transcode_task is None and free >= self.min_free_bytes:
+            candidate = await self._next_transcode(files, free)
+            if candidate is not None:
+                self.transcoding = candidate.path
+                self.transcode_task = asyncio.create_task(self._transcode(candidate))
+
+    async def _linked_videos(self):
+        backend = self.store.backend
+        if backend is None:
+            return None
+        try:
+            return await backend.fetch_linked_videos()
+        except Exception as e:
+            print(f"[Maintenance] Could not read run links: {e}")
+            return None
+
+    async def _delete(self, video_file, reason, linked):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, os.remove, video_file.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.errors += 1
+            self.last_error = f"delete {video_file.filename}: {e}"
+            print(f"[Maintenance] Could not delete {video_file.filename}: {e}")
+            return
+        self.catalog.discard(video_file.filename)
+        self.deleted[reason] += 1
+        self.bytes_freed += video_file.size
+        if linked:
+            self.deleted_linked += 1
+        print(f"[Maintenance] Deleted {video_file.filename} ({reason}, {video_file.size / 1e6:.1f} MB"
+              f"{', linked to a run' if linked else ''})")
+        if self.store.backend is not None:
+            try:
+                await self.store.backend.delete_video_index(video_file.path)
+            except Exception as e:
+                print(f"[Maintenance] Video index for {video_file.filename} not removed: {e}")
+
+    async def _next_transcode(self, files, free):
+        loop = asyncio.get_running_loop()
+        tmp_dir = os.path.join(self.catalog.directory, TRANSCODE_DIR)
+        if self.codec is None:
+            self.codec = await asyncio.wrap_future(self.pool.submit(pick_codec, TRANSCODE_CODECS, tmp_dir))
+            if self.codec is None:
+                print("[Maintenance] No transcode codec available; transcoding disabled")
+                self.transcode = False
+                return None
+            print(f"[Maintenance] Transcoding finished recordings to {self.codec}")
+        target = CODEC_RANK[self.codec]
+        cutoff = time.time() - TRANSCODE_MIN_AGE
+        for f in reversed(files):  # newest finished first: it is the one most likely to be kept
+            if f.mtime > cutoff or f.key in self.skip or self.catalog.get(f.filename) is not f:
+                continue
+            if free - f.size < self.min_free_bytes:
+                continue  # the new copy must fit next to the old one
+            info = await loop.run_in_executor(None, self.catalog.info, f)
+            codec = info.get("codec") if info else None
+            if codec is None:
+                self.skip[f.key] = "unknown_codec"
+            elif CODEC_RANK.get(codec, target) < target:
+                return f
+            else:
+                self.skip[f.key] = "already_compact"
+        return None
+
+    async def _transcode(self, video_file):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tmp_dir = os.path.join(self.catalog.directory, TRANSCODE_DIR)
+        try:
+            result = await asyncio.wrap_future(self.pool.submit(
+                transcode_video, video_file.path, self.codec, tmp_dir, TRANSCODE_MIN_SAVING))
+        except BrokenProcessPool:
+            print(f"[Maintenance] Transcode worker died on {video_file.filename}, restarting it")
+            self.pool = self._new_pool()
+            result = {"status": "worker_died"}
+        except Exception as e:
+            result = {"status": "failed"}
+            self.errors += 1
+            self.last_error = f"transcode {video_file.filename}: {e}"
+        finally:
+            self.transcoding = None
+            self.transcode_task = None
+
+        status = result["status"]
+        self.transcode_results[status] = self.transcode_results.get(status, 0) + 1
+        self.transcode_cpu_seconds += result.get("cpu_seconds", 0.0)
+        self.transcode_wall_seconds += loop.time() - started
+        # Either way this version of the file is finished with; a transcoded one comes
+        # back from the catalog under a new inode and probes as already compact
+        self.skip[video_file.key] = status
+        if status != "done":
+            return
+        self.transcoded += 1
+        self.transcode_saved += result["old_size"] - result["new_size"]
+        print(f"[Maintenance] Transcoded {video_file.filename} to {self.codec}: "
+              f"{result['old_size'] / 1e6:.1f} -> {result['new_size'] / 1e6:.1f} MB, "
+              f"{result['cpu_seconds']:.1f} s CPU")
+        if self.store.backend is not None:
+            try:
+                await self.store.backend.update_video_codec(video_file.path, self.codec)
+            except Exception as e:
+                print(f"[Maintenance] Codec for {video_file.filename} not updated in the index: {e}")
+        self.wakeup.set()  # next candidate without waiting a whole interval
+
+    def stats(self):
+        return {
+            "passes": self.passes,
+            "last_pass_ms": round(self.last_pass_ms, 2),
+            "last_pass_at": self.last_pass_at,
+            "low_space_requests": self.low_space_requests,
+            "free_bytes": self.free_bytes,
+            "min_free_bytes": self.min_free_bytes,
+            "recordings_bytes": self.recordings_bytes,
+            "policy": {
+                "max_age_days": self.max_age_days,
+                "max_bytes": self.max_bytes,
+                "keep_run_videos": self.keep_run_videos,
+            },
+            "deleted": dict(self.deleted),
+            "deleted_linked": self.deleted_linked,
+            "bytes_freed": self.bytes_freed,
+            "transcode": {
+                "enabled": self.transcode,
+                "codec": self.codec,
+                "current": os.path.basename(self.transcoding) if self.transcoding else None,
+                "done": self.transcoded,
+                "results": dict(self.transcode_results),
+                "bytes_saved": self.transcode_saved,
+                "cpu_seconds": round(self.transcode_cpu_seconds, 2),
+                "wall_seconds": round(self.transcode_wall_seconds, 2),
+            },
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,319 @@
+"""
+Thumbnails and preview clips for recordings, decoded on demand.
+
+    thumbnail   one JPEG, the frame at t seconds (the middle if t is None)
+    preview     a short MJPG .avi flipbook of PREVIEW_FRAMES frames sampled
+                evenly across the recording, PREVIEW_WIDTH wide
+
+Only the frames needed are decoded: each is reached by seeking
+(CAP_PROP_POS_FRAMES), or by grabbing forward when the next frame wanted
+is close enough that decoding the gap is cheaper than a seek.
+
+Rendering runs in a process pool so decoding uses other cores and never
+holds the GIL the event loop needs. Workers write their result straight
+into the cache directory, so only a size crosses the process boundary.
+Workers come from a forkserver (worker_context()), never forked from
+the firmware process itself: by the time a pool is replaced after a
+crash, the camera, encoder and catalog threads are using OpenCV, and a
+fork taken then can inherit a lock one of them held. The forkserver is
+a clean process that imports __main__ and OpenCV once and forks each
+worker from there; firmware.py keeps its MQTT connection out of module
+level so that import has no side effects.
+
+Results are kept in an LRU disk cache (PreviewCache) bounded to
+max_bytes, on the USB drive next to the recordings. Cache names carry
+the source's inode and mtime, so a replaced recording never serves a
+stale preview; old entries just age out. Identical requests in flight
+share one render. Repeated browsing costs a dictionary lookup and a file
+send, and the ETag on the response lets the browser skip even that.
+"""
+import asyncio
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+THUMBNAIL_WIDTH = 320
+PREVIEW_WIDTH = 320
+PREVIEW_FRAMES = 24
+PREVIEW_FPS = 8.0            # 24 frames -> a 3 s flipbook
+JPEG_QUALITY = 80
+SEEK_MIN_GAP = 30            # frames; nearer than this, grab forward instead of seeking
+WORKER_PRELOAD = ["__main__", "cv2"]  # imported once by the forkserver, shared by every worker
+PREVIEW_WORKERS = 2
+WORKER_NICE = 10             # renders yield to the recorder and the control loop
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+TMP_SUFFIX = ".tmp"
+
+
+def worker_context():
+    """multiprocessing context for the OpenCV worker pools (this one and video_maintenance's)."""
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(WORKER_PRELOAD)  # only takes effect before the server first starts
+    return ctx
+
+
+# --- worker side (runs in the pool) ---
+
+def _init_worker():
+    try:
+        os.nice(WORKER_NICE)
+    except OSError:
+        pass
+    cv2.setNumThreads(1)
+
+
+def _resize(image, width):
+    height, original = image.shape[:2]
+    if width >= original:
+        return image
+    return cv2.resize(image, (width, max(1, round(height * width / original))), interpolation=cv2.INTER_AREA)
+
+
+def _frame_range(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return (fps if fps > 0 else 0.0), max(count, 0)
+
+
+def render_thumbnail(path, t, width, out_path):
+    """Writes a JPEG of the frame at t seconds; returns its size, or None."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    try:
+        fps, count = _frame_range(cap)
+        if t is None:
+            frame = count // 2
+        else:
+            frame = int(t * fps)
+        frame = min(max(frame, 0), max(count - 1, 0))
+        if frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        ok, image = cap.read()
+        if not ok:
+            return None
+        ok, jpeg = cv2.imencode(".jpg", _resize(image, width), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            return None
+        tmp_path = out_path + TMP_SUFFIX
+        with open(tmp_path, "wb") as f:
+            f.write(jpeg.tobytes())
+        os.replace(tmp_path, out_path)
+        return len(jpeg)
+    finally:
+        cap.release()
+
+
+def render_preview(path, frames, width, fps, out_path):
+    """Writes an MJPG clip of `frames` evenly spaced frames; returns its size, or None."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    tmp_path = out_path + TMP_SUFFIX + ".avi"  # VideoWriter picks the container by extension
+    out = None
+    try:
+        _, count = _frame_range(cap)
+        if count <= 0:
+            return None
+        wanted = sorted({int(i * count / frames) for i in range(frames)})
+        position = 0
+        for target in wanted:
+            if target - position >= SEEK_MIN_GAP or target < position:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            while position < target:
+                if not cap.grab():
+                    break
+                position += 1
+            ok, image = cap.read()
+            if not ok:
+                break
+            position += 1
+            image = _resize(image, width)
+            if out is None:
+                height, w = image.shape[:2]
+                out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (w, height))
+                if not out.isOpened():
+                    return None
+                out.set(cv2.VIDEOWRITER_PROP_QUALITY, JPEG_QUALITY)
+            out.write(image)
+        if out is None:
+            return None
+        out.release()
+        out = None
+        os.replace(tmp_path, out_path)
+        return os.path.getsize(out_path)
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# --- MCU side ---
+
+class PreviewCache:
+    """Size-bounded LRU of rendered files in one directory. Event loop thread only."""
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # name -> size, least recently used first
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def load(self):
+        """Index what is already on disk, oldest first. Blocking."""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if TMP_SUFFIX in entry.name:
+                    os.remove(entry.path)  # a render that never finished
+                    continue
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self.total = sum(self.entries.values())
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def lookup(self, name):
+        if name in self.entries:
+            self.entries.move_to_end(name)
+            self.hits += 1
+            return self.path(name)
+        self.misses += 1
+        return None
+
+    def add(self, name, size):
+        """Record a new file; returns the paths evicted to stay under max_bytes (delete them)."""
+        self.total += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+        evict = []
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            old, old_size = self.entries.popitem(last=False)
+            self.total -= old_size
+            self.evicted += 1
+            evict.append(self.path(old))
+        return evict
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "entries": len(self.entries),
+            "bytes": self.total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+
+class PreviewService:
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES, workers=PREVIEW_WORKERS):
+        self.cache = PreviewCache(cache_dir, max_bytes)
+        self.workers = workers
+        self.pool = None
+        self.loaded = False
+        self.inflight = {}  # cache name -> Future of the render
+        self.renders = 0
+        self.failures = 0
+        self.render_seconds = 0.0
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(self.workers, mp_context=worker_context(),
+                                   initializer=_init_worker)
+
+    def start(self):
+        """Start the workers now rather than on the first request."""
+        self.pool = self._new_pool()
+        for _ in range(self.workers):
+            self.pool.submit(os.getpid)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def thumbnail(self, video_file, t=None, width=THUMBNAIL_WIDTH):
+        """Cache path of the thumbnail, rendering it on a miss; None if the file can't be decoded."""
+        at = "mid" if t is None else f"{int(round(t * 1000))}ms"
+        name = f"{self._stem(video_file)}-thumb-{at}-{width}.jpg"
+        return await self._get(name, render_thumbnail, video_file.path, t, width)
+
+    async def preview(self, video_file, width=PREVIEW_WIDTH, frames=PREVIEW_FRAMES):
+        name = f"{self._stem(video_file)}-preview-{frames}-{width}.avi"
+        return await self._get(name, render_preview, video_file.path, frames, width, PREVIEW_FPS)
+
+    @staticmethod
+    def _stem(video_file):
+        stem = os.path.splitext(video_file.filename)[0]
+        return f"{stem}-{video_file.inode:x}-{video_file.mtime_ns:x}"
+
+    async def _get(self, name, render, *args):
+        loop = asyncio.get_running_loop()
+        if not self.loaded:
+            await loop.run_in_executor(None, self.cache.load)
+            self.loaded = True
+        path = self.cache.lookup(name)
+        if path is not None:
+            return path
+        future = self.inflight.get(name)
+        if future is None:
+            future = loop.create_task(self._render(name, render, *args))
+            self.inflight[name] = future
+            future.add_done_callback(lambda _: self.inflight.pop(name, None))
+        return await asyncio.shield(future)
+
+    async def _render(self, name, render, *args):
+        loop = asyncio.get_running_loop()
+        if self.pool is None:
+            self.start()
+        path = self.cache.path(name)
+        start = loop.time()
+        try:
+            size = await asyncio.wrap_future(self.pool.submit(render, *args, path))
+        except BrokenProcessPool:
+            # A worker died (OOM on a corrupt file, say); replace the pool, fail this one
+            print(f"[Preview] Worker pool broke rendering {name}, restarting it")
+            self.pool = self._new_pool()
+            size = None
+        except Exception as e:
+            print(f"[Preview] Rendering {name} failed: {e}")
+            size = None
+        if size is None:
+            self.failures += 1
+            return None
+        self.renders += 1
+        self.render_seconds += loop.time() - start
+        evict = self.cache.add(name, size)
+        if evict:
+            await loop.run_in_executor(None, _remove_all, evict)
+        return path
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "renders": self.renders,
+            "failures": self.failures,
+            "in_flight": len(self.inflight),
+            "mean_render_ms": round(self.render_seconds / self.renders * 1000, 1) if self.renders else 0.0,
+            "cache": self.cache.stats(),
+        }
+
+
+def _remove_all(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
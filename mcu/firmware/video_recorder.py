@@ -0,0 +1,337 @@
+"""
+Camera recorder: an encoder thread fed by the shared camera capture.
+
+Frames come from camera_service.CameraService, whose capture thread
+stamps each one (driver buffer timestamp mapped onto time.monotonic())
+and puts it on this recorder's bounded FrameSubscription. When the
+encoder falls behind, the oldest queued frame is dropped and counted;
+capture never waits on the encoder, and the live preview keeps running
+whether or not anything is being recorded.
+
+The encoder thread owns the VideoWriter. The output file has a fixed
+frame rate, so each frame goes on that grid by its timestamp: frames
+arriving faster than `fps` are skipped, and a late camera frame is
+repeated to cover the gap, so the file plays back in real time. Free
+space on the target is checked every DISK_CHECK_INTERVAL rather than per
+frame; below `low_space_bytes` the recorder calls `on_low_space` (so
+video_maintenance.py can free space) and only stops itself below
+`min_free_bytes`.
+
+Output is split into SEGMENT_SECONDS files (<base>_000.avi, _001, ...).
+Each VideoSegment keeps its frame index, frame number -> capture time on
+the MCU wall clock (the clock run_samples is stamped in), and is handed
+to `on_segment` when it closes so the index can be stored (see
+sample_store.py, video_segments/video_frames). Seeking to a sensor event
+is then an index lookup rather than a decode. set_run() re-tags a running
+recording: the encoder closes the current segment at the next frame, so
+no file spans two runs.
+
+codec "XVID" is the original MPEG-4 output. "MJPG" uses OpenCV's
+built-in intra-only JPEG encoder: cheaper and far steadier per frame (no
+keyframe spikes), and every frame is a seek point; file size depends on
+the scene. video_encode_bench.py measures both on the target.
+The camera itself is asked for MJPG so 640x480 at 20 fps fits USB 2.0
+bandwidth without the driver dropping frames (see CameraService).
+"""
+import os
+import shutil
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+import cv2
+
+CODECS = ("XVID", "MJPG")
+FRAME_QUEUE_SIZE = 32           # ~1.5 s at 20 fps
+DISK_CHECK_INTERVAL = 5.0
+MIN_FREE_BYTES = 50 * 1024 * 1024
+MAX_FILL_SECONDS = 5.0          # longest camera stall covered by repeated frames
+SEGMENT_SECONDS = 60.0          # new file every minute of video
+JPEG_QUALITY = 80               # MJPG only
+
+
+class VideoSegment:
+    """One output file and its frame index: frame number -> capture time (epoch s)."""
+
+    def __init__(self, writer, path, index, run_id, fps, width, height, codec):
+        self.writer = writer
+        self.path = path
+        self.index = index
+        self.run_id = run_id
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.frame_ts = array('d')
+        self.closed = False
+
+    @property
+    def frame_count(self):
+        return len(self.frame_ts)
+
+    @property
+    def start_ts(self):
+        return self.frame_ts[0] if self.frame_ts else None
+
+    @property
+    def end_ts(self):
+        return self.frame_ts[-1] if self.frame_ts else None
+
+    def write(self, frame, ts, copies=1):
+        for _ in range(copies):
+            self.writer.write(frame)
+            self.frame_ts.append(ts)  # repeats keep the time of the frame they show
+
+    def close(self):
+        self.writer.release()
+        self.closed = True
+
+    def frame_at(self, ts):
+        """Last frame captured at or before ts, or None."""
+        i = bisect_right(self.frame_ts, ts)
+        return i - 1 if i else None
+
+    def describe(self):
+        return {
+            "video_path": self.path,
+            "segment": self.index,
+            "run_id": self.run_id,
+            "start_ts": self.start_ts,
+            "end_ts": self.end_ts,
+            "frame_count": self.frame_count,
+            "fps": self.fps,
+            "width": self.width,
+            "height": self.height,
+            "codec": self.codec,
+        }
+
+
+class VideoRecorder:
+    def __init__(self, camera, codec="XVID", queue_size=FRAME_QUEUE_SIZE, min_free_bytes=MIN_FREE_BYTES,
+                 segment_seconds=SEGMENT_SECONDS, on_segment=None, low_space_bytes=0, on_low_space=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}, expected one of {CODECS}")
+        self.camera = camera  # CameraService
+        self.fps = camera.fps
+        self.codec = codec
+        self.queue_size = queue_size
+        self.min_free_bytes = min_free_bytes
+        self.segment_frames = int(segment_seconds * self.fps)  # 0 = one file per recording
+        self.on_segment = on_segment  # called on the encoder thread with each closed VideoSegment
+        self.low_space_bytes = low_space_bytes
+        self.on_low_space = on_low_space  # called on the encoder thread with the free bytes
+
+        self.base_path = None
+        self.run_id = None
+        self.new_run = False  # set_run() was called; the encoder starts a new segment
+        self.epoch_offset = 0.0
+        self.segment = None  # the one being written
+        self.recording = threading.Event()
+        self.frames = None  # FrameSubscription
+        self.encoder_thread = None
+        self.stop_reason = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.started_at = None
+        self.segment_index = 0
+        self.segments_closed = 0
+        self.written = 0
+        self.skipped = 0      # arrived faster than fps
+        self.repeated = 0     # written again to cover a late frame
+        self.encode_last = 0.0
+        self.encode_avg = 0.0
+        self.encode_max = 0.0
+        self.queue_latency_last = 0.0
+        self.queue_latency_max = 0.0
+        self.disk_free = None
+
+    @property
+    def active(self):
+        return self.encoder_thread is not None and self.encoder_thread.is_alive()
+
+    def start(self, base_path, run_id=None):
+        """Record to base_path_000.avi, _001 ...; returns False if a recording is still running."""
+        if self.active:
+            return False
+        self._reset_stats()
+        self.base_path = base_path
+        self.run_id = run_id
+        self.new_run = False
+        self.segment = None
+        # Frame times are monotonic; the index stores them on the wall clock
+        # run_samples uses, fixed once per recording so it can't step
+        self.epoch_offset = time.time() - time.monotonic()
+        self.stop_reason = None
+        self.recording.set()
+        self.started_at = time.time()
+        self.frames = self.camera.subscribe(self.queue_size)
+        self.encoder_thread = threading.Thread(target=self._encode, daemon=True)
+        self.encoder_thread.start()
+        return True
+
+    def set_run(self, run_id):
+        """Tag the rest of the running recording with run_id, from a new segment."""
+        self.run_id = run_id
+        self.new_run = True
+
+    def stop(self, reason="stopped"):
+        """Unsubscribe; the encoder drains the queue and closes the file on its own."""
+        if self.recording.is_set():
+            self.stop_reason = reason
+            self.recording.clear()
+            self.frames.close(reason)
+
+    # --- encoder thread ---
+
+    def _encode(self):
+        frames = self.frames.queue
+        segment = None
+        t0 = None
+        discard = False  # after a failure: drain the queue up to the sentinel without writing
+        next_disk_check = 0.0
+        max_fill = int(MAX_FILL_SECONDS * self.fps)
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            ts, grabbed, frame = item
+            if discard:
+                continue
+
+            now = time.monotonic()
+            if now >= next_disk_check:
+                next_disk_check = now + DISK_CHECK_INTERVAL
+                if not self._disk_ok():
+                    print("[Recorder] USB full. Stopping.")
+                    self.stop("disk_full")
+                    discard = True
+                    continue
+
+            if t0 is None:
+                t0 = ts
+            slot = int((ts - t0) * self.fps + 0.5)
+            if slot < self.written:
+                self.skipped += 1
+                continue
+            copies = slot - self.written + 1
+            if copies > max_fill + 1:
+                # Long stall: don't write seconds of a frozen frame, move the grid instead
+                t0 += (copies - 1 - max_fill) / self.fps
+                copies = max_fill + 1
+
+            start = time.perf_counter()
+            remaining = copies
+            if self.new_run:
+                self.new_run = False
+                if segment is not None:
+                    self._close_segment(segment)
+                    segment = None
+            while remaining:
+                if segment is not None and self.segment_frames and segment.frame_count >= self.segment_frames:
+                    self._close_segment(segment)
+                    segment = None
+                if segment is None:
+                    segment = self._open_segment(frame)
+                    if segment is None:
+                        self.stop("writer_open_failed")
+                        discard = True
+                        break
+                n = remaining
+                if self.segment_frames:
+                    n = min(n, self.segment_frames - segment.frame_count)
+                segment.write(frame, ts + self.epoch_offset, n)
+                remaining -= n
+            if discard:
+                continue
+            encode = (time.perf_counter() - start) / copies
+            self.written += copies
+            self.repeated += copies - 1
+
+            self.encode_last = encode
+            self.encode_avg += 0.05 * (encode - self.encode_avg)
+            if encode > self.encode_max:
+                self.encode_max = encode
+            latency = time.monotonic() - grabbed
+            self.queue_latency_last = latency
+            if latency > self.queue_latency_max:
+                self.queue_latency_max = latency
+
+        if self.recording.is_set():
+            self.stop(self.frames.reason or "camera_stopped")  # the camera went away under us
+        if segment is not None:
+            self._close_segment(segment)
+        if self.segment_index:
+            print(f"[Recorder] Recording stopped ({self.stop_reason}): {self.written} frames in "
+                  f"{self.segment_index} segment(s), {self.frames.dropped} dropped, {self.skipped} skipped, "
+                  f"{self.repeated} repeated")
+
+    def _open_segment(self, frame):
+        path = f"{self.base_path}_{self.segment_index:03d}.avi"
+        # Size the file from the frames the camera actually delivers; a writer
+        # opened at a size the camera ignored would silently write nothing
+        height, width = frame.shape[:2]
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps, (width, height))
+        if not out.isOpened():
+            print(f"[Recorder] Could not open {path} for writing")
+            return None
+        if self.codec == "MJPG":
+            out.set(cv2.VIDEOWRITER_PROP_QUALITY, JPEG_QUALITY)
+        segment = VideoSegment(out, path, self.segment_index, self.run_id, self.fps, width, height, self.codec)
+        self.segment_index += 1
+        self.segment = segment
+        print(f"[Recorder] Recording segment: {path}")
+        return segment
+
+    def _close_segment(self, segment):
+        segment.close()
+        self.segments_closed += 1
+        if self.on_segment is not None:
+            try:
+                self.on_segment(segment)
+            except Exception as e:
+                print(f"[Recorder] Segment callback failed for {segment.path}: {e}")
+
+    def _disk_ok(self):
+        try:
+            self.disk_free = shutil.disk_usage(os.path.dirname(self.base_path) or ".").free
+        except OSError as e:
+            print(f"[Recorder] Disk check failed: {e}")
+            return False
+        if self.disk_free < self.low_space_bytes and self.on_low_space is not None:
+            try:
+                self.on_low_space(self.disk_free)
+            except Exception as e:
+                print(f"[Recorder] Low space callback failed: {e}")
+        return self.disk_free >= self.min_free_bytes
+
+    def stats(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        frames = self.frames
+        return {
+            "recording": self.recording.is_set(),
+            "active": self.active,
+            "run_id": self.run_id,
+            "segment": self.segment.path if self.segment else None,
+            "segments_closed": self.segments_closed,
+            "codec": self.codec,
+            "target_fps": self.fps,
+            "stop_reason": self.stop_reason,
+            "captured": frames.delivered if frames else 0,
+            "written": self.written,
+            "dropped": frames.dropped if frames else 0,
+            "skipped": self.skipped,
+            "repeated": self.repeated,
+            "capture_fps": round(self.camera.capture_rate, 2),
+            "written_fps": round(self.written / elapsed, 2) if elapsed else 0.0,
+            "camera_timestamps": self.camera.camera_timestamps,
+            "encode_last_ms": round(self.encode_last * 1000, 2),
+            "encode_avg_ms": round(self.encode_avg * 1000, 2),
+            "encode_max_ms": round(self.encode_max * 1000, 2),
+            "queue_depth": frames.queue.qsize() if frames else 0,
+            "queue_high_water": frames.high_water if frames else 0,
+            "queue_latency_last_ms": round(self.queue_latency_last * 1000, 2),
+            "queue_latency_max_ms": round(self.queue_latency_max * 1000, 2),
+            "disk_free_mb": round(self.disk_free / 1e6, 1) if self.disk_free is not None else None,
+        }
@@ -0,0 +1,180 @@
+"""
+Non-blocking WebSocket fan-out.
+
+Every connected client gets a ClientSession: a bounded outbound queue
+plus its own writer task, so broadcasting is a non-blocking enqueue and
+one slow browser only ever delays itself.
+
+Queue policies when a client falls behind:
+  drop_oldest      - the oldest queued message is discarded
+  coalesce_latest  - a keyed message replaces the queued one with the
+                     same key (e.g. device_status_update); unkeyed
+                     messages fall back to drop_oldest
+"""
+import asyncio
+import time
+from collections import deque
+
+POLICIES = ("drop_oldest", "coalesce_latest")
+
+
+class ClientSession:
+    def __init__(self, websocket, policy="coalesce_latest", max_queue=64, send_timeout=5.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}")
+        self.websocket = websocket
+        self.policy = policy
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.queue = deque()
+        self.keyed = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = None
+        self.subscription = None
+        self.dropped_keys = set()
+
+        self.connected_at = time.monotonic()
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    def has_pending(self, key):
+        return key in self.keyed
+
+    def take_dropped(self, key):
+        """True once if a message with this key was dropped since the last call."""
+        if key in self.dropped_keys:
+            self.dropped_keys.discard(key)
+            return True
+        return False
+
+    def enqueue(self, text, key=None):
+        """Queue a message without waiting. Safe to call for any number of clients."""
+        if self.closed:
+            return
+        now = time.monotonic()
+        self.enqueued += 1
+        if key is not None and self.policy == "coalesce_latest" and key in self.keyed:
+            entry = self.keyed[key]
+            entry[1] = text
+            entry[2] = now
+            self.coalesced += 1
+            return
+        if len(self.queue) >= self.max_queue:
+            old = self.queue.popleft()
+            old_key = old[0]
+            if old_key is not None:
+                if self.keyed.get(old_key) is old:
+                    del self.keyed[old_key]
+                self.dropped_keys.add(old_key)
+            self.dropped += 1
+        entry = [key, text, now]
+        self.queue.append(entry)
+        if key is not None:
+            self.keyed[key] = entry
+        self.ready.set()
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                entry = self.queue.popleft()
+                key, text, queued_at = entry
+                if key is not None and self.keyed.get(key) is entry:
+                    del self.keyed[key]
+                await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+                lag = time.monotonic() - queued_at
+                self.sent += 1
+                self.lag_last = lag
+                self.lag_total += lag
+                if lag > self.lag_max:
+                    self.lag_max = lag
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[ws] Client writer stopped: {type(e).__name__}: {e}")
+            self.closed = True
+            await self._close_socket()
+        finally:
+            self.closed = True
+
+    async def _close_socket(self):
+        """Close a client we can no longer write to, so its receive loop ends and the HMI reconnects."""
+        try:
+            await asyncio.wait_for(self.websocket.close(code=1011), self.send_timeout)
+        except Exception:
+            pass  # already gone or too slow for the close frame too
+
+    async def close(self):
+        self.closed = True
+        self.ready.set()
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        client = getattr(self.websocket, "client", None)
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "policy": self.policy,
+            "connected_seconds": round(time.monotonic() - self.connected_at, 1),
+            "queue_depth": len(self.queue),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "lag_last_ms": round(self.lag_last * 1000, 2),
+            "lag_avg_ms": round(self.lag_total / self.sent * 1000, 2) if self.sent else 0.0,
+            "lag_max_ms": round(self.lag_max * 1000, 2),
+        }
+
+
+class Broadcaster:
+    def __init__(self, policy="coalesce_latest", max_queue=64, send_timeout=5.0):
+        self.policy = policy
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, websocket):
+        session = ClientSession(websocket, self.policy, self.max_queue, self.send_timeout)
+        self.sessions[websocket] = session
+        session.start()
+        return session
+
+    async def remove(self, websocket):
+        session = self.sessions.pop(websocket, None)
+        if session:
+            await session.close()
+
+    def broadcast(self, text, key=None):
+        """Enqueue for every live client; never awaits a socket."""
+        for websocket, session in list(self.sessions.items()):
+            if session.closed:
+                self.sessions.pop(websocket, None)
+                continue
+            session.enqueue(text, key)
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "max_queue": self.max_queue,
+            "clients": [session.stats() for session in self.sessions.values()],
+        }
@@ -3,7 +3,7 @@
 import { useEffect, useState } from "react"
 import { Badge } from "@/components/ui/badge"
 import { Activity, Zap, Settings, Power } from "lucide-react"
-import { websocket } from "@/lib/polling-manager"
+import { websocket } from "@/lib/telemetry-stream"
 
 interface DeviceStatus {
   device: string
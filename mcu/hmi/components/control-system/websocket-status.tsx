@@ -3,10 +3,10 @@
 import { useEffect, useState } from "react"
 import { Badge } from "@/components/ui/badge"
 import { Wifi, WifiOff } from "lucide-react"
-import { websocket, type PollingStatus } from "@/lib/polling-manager"
+import { websocket, type TelemetryStreamStatus } from "@/lib/telemetry-stream"
 
 export function WebSocketStatusIndicator() {
-  const [status, setStatus] = useState<PollingStatus>("disconnected")
+  const [status, setStatus] = useState<TelemetryStreamStatus>("disconnected")
 
   useEffect(() => {
     // Register for status updates
@@ -31,7 +31,7 @@ export function WebSocketStatusIndicator() {
       {status === "connected" ? (
         <>
           <Wifi className="w-4 h-4" />
-          Polling
+          Live
         </>
       ) : status === "connecting" ? (
         <>
@@ -41,7 +41,7 @@ export function WebSocketStatusIndicator() {
       ) : status === "error" ? (
         <>
           <WifiOff className="w-4 h-4" />
-          Polling Error
+          Stream Error
         </>
       ) : (
         <>
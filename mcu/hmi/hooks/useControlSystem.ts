@@ -1,5 +1,5 @@
 import { useState, useEffect } from "react"
-import { websocket } from "@/lib/polling-manager"
+import { websocket } from "@/lib/telemetry-stream"
 import { SystemMode, SystemStatus, LcuDirection, DcuDirection, LcuCommand, DcuCommand } from "@/lib/constants"
 import apiClient from "@/lib/api-client"
 
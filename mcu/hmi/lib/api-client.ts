@@ -74,9 +74,42 @@ export const sendCommand = async (data: {
   }
 };
 
+export interface HistorySeries {
+  t: number[];
+  v: number[];
+}
+
+export interface DeviceHistoryResponse {
+  device: string;
+  since: number;
+  series: Record<string, HistorySeries>;
+  timestamp: string;
+}
+
+// Server-side ring buffer history, min/max decimated to maxPoints per field
+export const getDeviceHistory = async (
+  device: "lcu" | "dcu" | "sdu",
+  options: { since?: number, fields?: string[], maxPoints?: number } = {}
+): Promise<DeviceHistoryResponse | null> => {
+  try {
+    const response = await axiosInstance.get(`/device_history/${device}`, {
+      params: {
+        since: options.since,
+        fields: options.fields?.join(','),
+        max_points: options.maxPoints
+      }
+    });
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching device history:', error);
+    return null;
+  }
+};
+
 // Create API client object
 const apiClient = {
-  sendCommand
+  sendCommand,
+  getDeviceHistory
 };
 
 // Default export
@@ -0,0 +1,211 @@
+// WebSocket telemetry stream for the control system
+// Subscribes once over /ws and receives only changed fields, replacing the
+// REST polling of /device_status/ and /device_data/ with a single socket.
+
+import type { PollingStatus } from "./polling-manager"
+
+export type TelemetryStreamStatus = PollingStatus
+
+type StatusChangeCallback = (status: TelemetryStreamStatus) => void
+type MessageCallback = (data: Record<string, unknown>) => void
+
+interface TelemetryStreamOptions {
+  url: string
+  devices?: string[]
+  fields?: Record<string, string[]>
+  maxRate?: number
+  reconnectInterval?: number
+  maxReconnectAttempts?: number
+}
+
+class TelemetryStreamManager {
+  private socket: WebSocket | null = null
+  private status: TelemetryStreamStatus = "disconnected"
+  private url: string
+  private devices: string[]
+  private fields?: Record<string, string[]>
+  private maxRate: number
+  private reconnectInterval: number
+  private maxReconnectAttempts: number
+  private reconnectAttempts = 0
+  private closedByUser = false
+  private messageHandlers: Map<string, MessageCallback[]> = new Map()
+  private statusChangeCallbacks: StatusChangeCallback[] = []
+  private deviceData: Record<string, Record<string, unknown>> = {}
+
+  constructor(options: TelemetryStreamOptions) {
+    this.url = options.url
+    this.devices = options.devices || ["lcu", "dcu", "sdu"]
+    this.fields = options.fields
+    this.maxRate = options.maxRate || 10
+    this.reconnectInterval = options.reconnectInterval || 3000
+    this.maxReconnectAttempts = options.maxReconnectAttempts || 10
+  }
+
+  // Open the socket and subscribe
+  connect(): void {
+    if (this.socket && (this.socket.readyState === WebSocket.OPEN || this.socket.readyState === WebSocket.CONNECTING)) {
+      return
+    }
+
+    this.closedByUser = false
+    this.setStatus("connecting")
+
+    try {
+      this.socket = new WebSocket(this.url)
+      this.socket.onopen = this.handleOpen.bind(this)
+      this.socket.onmessage = this.handleMessage.bind(this)
+      this.socket.onclose = this.handleClose.bind(this)
+      this.socket.onerror = () => this.setStatus("error")
+    } catch (error) {
+      console.error("Failed to open telemetry stream:", error)
+      this.setStatus("error")
+      this.attemptReconnect()
+    }
+  }
+
+  // Close the socket
+  disconnect(): void {
+    this.closedByUser = true
+    if (this.socket) {
+      this.socket.close(1000)
+      this.socket = null
+    }
+    this.setStatus("disconnected")
+  }
+
+  // Change the subscription on a live connection
+  subscribe(options: { devices?: string[], fields?: Record<string, string[]>, maxRate?: number }): void {
+    if (options.devices) this.devices = options.devices
+    if (options.fields) this.fields = options.fields
+    if (options.maxRate) this.maxRate = options.maxRate
+    this.sendSubscribe()
+  }
+
+  // Register a handler for a specific message type
+  on(messageType: string, handler: MessageCallback): void {
+    if (!this.messageHandlers.has(messageType)) {
+      this.messageHandlers.set(messageType, [])
+    }
+    this.messageHandlers.get(messageType)?.push(handler)
+  }
+
+  // Remove a handler for a specific message type
+  off(messageType: string, handler: MessageCallback): void {
+    const handlers = this.messageHandlers.get(messageType)
+    if (handlers) {
+      const index = handlers.indexOf(handler)
+      if (index !== -1) {
+        handlers.splice(index, 1)
+      }
+    }
+  }
+
+  // Register a callback for connection status changes
+  onStatusChange(callback: StatusChangeCallback): void {
+    this.statusChangeCallbacks.push(callback)
+    callback(this.status)
+  }
+
+  getStatus(): TelemetryStreamStatus {
+    return this.status
+  }
+
+  // Send a message to the server
+  send(message: string | object): void {
+    if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      this.socket.send(typeof message === 'string' ? message : JSON.stringify(message))
+    }
+  }
+
+  // Private methods
+  private setStatus(status: TelemetryStreamStatus): void {
+    if (this.status !== status) {
+      this.status = status
+      this.statusChangeCallbacks.forEach((callback) => callback(status))
+    }
+  }
+
+  private sendSubscribe(): void {
+    this.send({
+      type: "subscribe",
+      devices: this.devices,
+      fields: this.fields,
+      max_rate: this.maxRate
+    })
+  }
+
+  private handleOpen(): void {
+    this.reconnectAttempts = 0
+    this.setStatus("connected")
+    this.sendSubscribe()
+  }
+
+  private handleClose(event: CloseEvent): void {
+    this.socket = null
+    this.setStatus("disconnected")
+    if (!this.closedByUser && event.code !== 1000) {
+      this.attemptReconnect()
+    }
+  }
+
+  private handleMessage(event: MessageEvent): void {
+    let message: { type?: string, full?: boolean, data?: unknown, timestamp?: string }
+    try {
+      message = JSON.parse(event.data)
+    } catch {
+      return
+    }
+
+    if (message.type === "device_status_update") {
+      // Same shape the polling manager emits
+      this.notifyMessageHandlers("device_status_update", { type: message.type, data: message.data })
+    } else if (message.type === "telemetry" && message.data) {
+      const changes = message.data as Record<string, Record<string, unknown>>
+      if (message.full) {
+        this.deviceData = {}
+      }
+      Object.entries(changes).forEach(([device, fields]) => {
+        this.deviceData[device] = { ...this.deviceData[device], ...fields }
+        this.notifyMessageHandlers(`${device}_data`, {
+          device,
+          data: this.deviceData[device],
+          timestamp: message.timestamp
+        })
+      })
+    } else if (message.type === "error") {
+      console.error("Telemetry stream error:", message.data)
+    }
+  }
+
+  private notifyMessageHandlers(type: string, data: Record<string, unknown>): void {
+    const handlers = this.messageHandlers.get(type)
+    if (handlers) {
+      handlers.forEach(handler => {
+        try {
+          handler(data)
+        } catch (error) {
+          console.error(`Error in message handler for type '${type}':`, error)
+        }
+      })
+    }
+  }
+
+  private attemptReconnect(): void {
+    if (this.reconnectAttempts >= this.maxReconnectAttempts) {
+      this.setStatus("error")
+      return
+    }
+    this.reconnectAttempts++
+    setTimeout(() => this.connect(), this.reconnectInterval)
+  }
+}
+
+// Create and export a singleton instance
+export const telemetryStream = new TelemetryStreamManager({
+  url: 'ws://192.168.2.1:8000/ws',
+  maxRate: 10,
+})
+
+// Export for compatibility with the polling manager interface
+export const websocket = telemetryStream
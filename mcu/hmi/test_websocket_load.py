@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+WebSocket fan-out load test.
+
+Opens a few hundred simulated HMI clients against /ws, subscribes each to
+telemetry, and makes a fraction of them deliberately slow (they stop
+reading for long stretches). Fast clients should keep receiving frames
+at their requested rate regardless; the server's per-client queue
+metrics are sampled from /ws_clients/ near the end of the run.
+
+    python3 test_websocket_load.py --clients 300 --slow 0.1 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+import requests
+import websockets
+
+
+async def run_client(uri, index, slow, duration, max_rate, results):
+    frames = 0
+    latencies = []
+    deadline = time.monotonic() + duration
+    try:
+        async with websockets.connect(uri, max_queue=1 if slow else 32) as websocket:
+            await websocket.send(json.dumps({"type": "subscribe", "max_rate": max_rate}))
+            while time.monotonic() < deadline:
+                if slow:
+                    # Stop reading for a while; with max_queue=1 the TCP window
+                    # fills and the server-side queue backs up
+                    await asyncio.sleep(2.0)
+                try:
+                    raw = await asyncio.wait_for(websocket.recv(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                try:
+                    message = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                if message.get("type") == "telemetry":
+                    frames += 1
+                    sent = message.get("timestamp")
+                    if sent:
+                        latencies.append((datetime.now() - datetime.fromisoformat(sent)).total_seconds())
+    except Exception as e:
+        results.append({"index": index, "slow": slow, "error": f"{type(e).__name__}: {e}"})
+        return
+    results.append({"index": index, "slow": slow, "frames": frames, "latencies": latencies})
+
+
+def summarize(label, rows, duration):
+    ok = [r for r in rows if "error" not in r]
+    if not ok:
+        print(f"{label}: no successful clients")
+        return
+    rates = [r["frames"] / duration for r in ok]
+    latencies = sorted(l for r in ok for l in r["latencies"])
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    print(f"{label}: {len(ok)} clients, frames/s mean {statistics.mean(rates):.2f} "
+          f"min {min(rates):.2f}, latency p50 {p50:.1f} ms p99 {p99:.1f} ms")
+
+
+async def test_websocket_load(host, clients, slow_fraction, duration, max_rate):
+    uri = f"ws://{host}/ws"
+    results = []
+    n_slow = int(clients * slow_fraction)
+    print(f"Connecting {clients} clients to {uri} ({n_slow} slow), {duration}s at {max_rate} Hz")
+
+    tasks = [
+        run_client(uri, i, i < n_slow, duration, max_rate, results)
+        for i in range(clients)
+    ]
+
+    async def sample_server_stats():
+        # Sample while clients are still connected; sessions vanish on close
+        await asyncio.sleep(duration * 0.8)
+        await asyncio.to_thread(print_server_stats, host)
+
+    await asyncio.gather(*tasks, sample_server_stats())
+
+    errors = [r for r in results if "error" in r]
+    summarize("Fast clients", [r for r in results if not r["slow"]], duration)
+    summarize("Slow clients", [r for r in results if r["slow"]], duration)
+    if errors:
+        print(f"{len(errors)} clients failed, first error: {errors[0]['error']}")
+
+
+def print_server_stats(host):
+    try:
+        stats = requests.get(f"http://{host}/ws_clients/", timeout=5).json()
+    except Exception as e:
+        print(f"Could not fetch /ws_clients/: {e}")
+        return
+    clients = stats.get("clients", [])
+    print(f"Server: {len(clients)} sessions, policy {stats.get('policy')}")
+    if clients:
+        worst = max(clients, key=lambda c: c["lag_max_ms"])
+        print(f"  total dropped {sum(c['dropped'] for c in clients)}, "
+              f"coalesced {sum(c['coalesced'] for c in clients)}, "
+              f"worst lag {worst['lag_max_ms']} ms ({worst['client']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket fan-out load test")
+    parser.add_argument("--host", default="192.168.2.1:8000")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--slow", type=float, default=0.1, help="fraction of slow clients")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--max-rate", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print("WebSocket Load Test")
+    print("=" * 50)
+    asyncio.run(test_websocket_load(args.host, args.clients, args.slow, args.duration, args.max_rate))
@@ -78,13 +78,58 @@ CREATE TABLE IF NOT EXISTS run_videos (
 );
 """)
 
+# RUN_SAMPLES table (narrow time-series, bulk-loaded with COPY by the MCU)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS run_samples (
+    run_id INTEGER NOT NULL,
+    device VARCHAR(16) NOT NULL,
+    ts DOUBLE PRECISION NOT NULL,
+    channel VARCHAR(64) NOT NULL,
+    value DOUBLE PRECISION,
+    FOREIGN KEY (run_id) REFERENCES runs(run_id) ON DELETE CASCADE
+);
+""")
+
+# VIDEO_SEGMENTS table (one row per recorded file, written by the MCU recorder)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS video_segments (
+    segment_id SERIAL PRIMARY KEY,
+    run_id INTEGER,
+    video_path VARCHAR(255) NOT NULL UNIQUE,
+    segment INTEGER NOT NULL,
+    start_ts DOUBLE PRECISION,
+    end_ts DOUBLE PRECISION,
+    frame_count INTEGER NOT NULL,
+    fps REAL,
+    width INTEGER,
+    height INTEGER,
+    codec VARCHAR(8),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (run_id) REFERENCES runs(run_id) ON DELETE SET NULL
+);
+""")
+
+# VIDEO_FRAMES table (frame number -> capture time, same clock as run_samples.ts)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS video_frames (
+    segment_id INTEGER NOT NULL,
+    frame INTEGER NOT NULL,
+    ts DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (segment_id, frame),
+    FOREIGN KEY (segment_id) REFERENCES video_segments(segment_id) ON DELETE CASCADE
+);
+""")
+
 # INDEXES
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_experiments_project_id ON experiments(project_id);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_experiment_id ON runs(experiment_id);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_project_id ON runs(project_id);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_videos_run_id ON run_videos(run_id);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_status ON runs(run_status);")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_samples_run_device_ts ON run_samples(run_id, device, ts);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_project_experiment ON runs(project_id, experiment_id);")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_video_segments_start ON video_segments(start_ts);")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_video_segments_run ON video_segments(run_id, start_ts);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_experiments_params ON experiments USING GIN (experiment_params);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_params ON runs USING GIN (run_params);")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_params ON projects USING GIN (project_params);")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Replay benchmark for the SDU packet decoder.
+
+Feeds a captured Teensy byte stream (or a synthetic one) through the old
+bytes-concatenation parser and through PacketRingBuffer, in serial-sized
+chunks, and reports decoded samples per second for each.
+
+    python3 decoder_bench.py                    # synthetic stream
+    python3 decoder_bench.py --record 5 cap.bin # capture 5 s from the Teensy
+    python3 decoder_bench.py cap.bin            # replay a capture
+"""
+import argparse
+import io
+import random
+import struct
+import time
+
+from packet_buffer import PacketRingBuffer, PACKET_SIZE, SYNC_BYTE
+
+SERIAL_PORT = "/dev/ttyACM0"
+BAUD_RATE = 6000000
+
+
+class LegacyParser:
+    """The pre-ring-buffer read_sensors() loop, one packet per call."""
+
+    def __init__(self):
+        self.data_buffer = b''
+
+    def feed(self, data):
+        self.data_buffer += data
+
+    def read_one(self):
+        while len(self.data_buffer) >= PACKET_SIZE:
+            if self.data_buffer[PACKET_SIZE - 1] == ord(SYNC_BYTE):
+                packet = self.data_buffer[:PACKET_SIZE]
+                self.data_buffer = self.data_buffer[PACKET_SIZE:]
+                return struct.unpack('<hhh', packet[:-1])
+            sync_pos = self.data_buffer.find(SYNC_BYTE)
+            if sync_pos == -1:
+                self.data_buffer = b''
+                break
+            self.data_buffer = self.data_buffer[sync_pos + 1:]
+        return None
+
+
+def synthetic_stream(samples, corrupt_every=5000, seed=1):
+    rng = random.Random(seed)
+    out = bytearray()
+    pack = struct.Struct('<hhh').pack
+    for i in range(samples):
+        out += pack(rng.randint(0, 3000), rng.randint(0, 3000), rng.randint(0, 3000))
+        out += SYNC_BYTE
+        if corrupt_every and i % corrupt_every == corrupt_every - 1:
+            out += b'\x01\x02\x03'  # partial packet to force a resync
+    return bytes(out)
+
+
+def record(seconds, path):
+    import serial
+    ser = serial.Serial(port=SERIAL_PORT, baudrate=BAUD_RATE, timeout=0, exclusive=True)
+    captured = bytearray()
+    end = time.time() + seconds
+    while time.time() < end:
+        waiting = ser.in_waiting
+        if waiting:
+            captured += ser.read(waiting)
+        else:
+            time.sleep(0.0005)
+    ser.close()
+    with open(path, 'wb') as f:
+        f.write(captured)
+    print(f"Captured {len(captured)} bytes ({len(captured) // PACKET_SIZE} packets) to {path}")
+
+
+def bench_legacy(stream, chunk):
+    parser = LegacyParser()
+    samples = 0
+    start = time.perf_counter()
+    for i in range(0, len(stream), chunk):
+        parser.feed(stream[i:i + chunk])
+        while parser.read_one() is not None:
+            samples += 1
+    return samples, time.perf_counter() - start
+
+
+def bench_ring(stream, chunk):
+    rx = PacketRingBuffer(PACKET_SIZE * 8192)
+    src = io.BytesIO(stream)
+    samples = 0
+    start = time.perf_counter()
+    while rx.fill(src, chunk):
+        samples += len(rx.decode())
+    return samples, time.perf_counter() - start, rx
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SDU packet decoder replay benchmark")
+    parser.add_argument("capture", nargs="?", help="raw byte capture to replay")
+    parser.add_argument("--record", type=float, metavar="SECONDS",
+                        help="capture SECONDS of serial data to the capture path first")
+    parser.add_argument("--samples", type=int, default=200000,
+                        help="synthetic stream length when no capture is given")
+    parser.add_argument("--chunk", type=int, nargs="+", default=[350, 4096, 65536],
+                        help="bytes handed to the parser per read")
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.capture:
+            parser.error("--record needs a capture path")
+        record(args.record, args.capture)
+
+    if args.capture:
+        with open(args.capture, 'rb') as f:
+            stream = f.read()
+        print(f"Replaying {args.capture}: {len(stream)} bytes")
+    else:
+        stream = synthetic_stream(args.samples)
+        print(f"Synthetic stream: {len(stream)} bytes, {args.samples} packets")
+
+    print(f"{'chunk':>8} {'legacy sps':>14} {'ring sps':>14} {'speedup':>8} {'samples':>10} {'resyncs':>8}")
+    for chunk in args.chunk:
+        legacy_n, legacy_t = bench_legacy(stream, chunk)
+        ring_n, ring_t, rx = bench_ring(stream, chunk)
+        legacy_sps = legacy_n / legacy_t if legacy_t > 0 else 0
+        ring_sps = ring_n / ring_t if ring_t > 0 else 0
+        speedup = ring_sps / legacy_sps if legacy_sps > 0 else 0
+        print(f"{chunk:>8} {legacy_sps:>14,.0f} {ring_sps:>14,.0f} {speedup:>7.1f}x "
+              f"{ring_n:>10} {rx.resyncs:>8}")
+        if legacy_n != ring_n:
+            print(f"  note: legacy decoded {legacy_n} samples, ring buffer {ring_n}")
+
+
+if __name__ == "__main__":
+    main()
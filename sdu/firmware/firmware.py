@@ -2,10 +2,15 @@ import time
 import json
 import threading
 import serial
-import struct
 import os
+import math
+import operator
 import paho.mqtt.client as mqtt
-from collections import deque
+
+from packet_buffer import PacketRingBuffer, PACKET_SIZE
+from run_logger import RunLogger
+from clock_sync import ClockClient
+import telemetry_codec
 
 try:
     os.nice(-20)
@@ -16,13 +21,35 @@ BROKER_IP = "192.168.2.1"
 DEVICE_ID = "sdu"
 SERIAL_PORT = "/dev/ttyACM0"
 BAUD_RATE = 6000000
-PACKET_SIZE = 7
-SYNC_BYTE = b'\n'
 AMP_SCALE = 100.0
-BATCH_SIZE = 50
+RX_BUFFER_SIZE = PACKET_SIZE * 8192
+
+# Telemetry publishing: "sample" sends the latest reading every 10 ms,
+# "window" sends every decoded sample of a window in one message.
+# All three can be changed at runtime through sdu/cmd.
+PUBLISH_MODES = ("sample", "window")
+PUBLISH_MODE = "window"
+PUBLISH_WINDOW = 0.1          # seconds per window message
+PUBLISH_AGGREGATES = ("min", "max", "mean", "rms")
+PUBLISH_MAX_BLOCK = 0         # max samples per channel in a window, 0 = all
+TELEMETRY_ENCODING = "json"   # "json" or "binary", see telemetry_codec.py
+
+# Every decoded sample is logged locally while a run is active (mode 2 on sdu/cmd)
+RUN_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_logs")
+RUN_LOG_FIELDS = (("drill", "h"), ("power", "h"), ("linear", "h"))  # raw, / AMP_SCALE for amps
+RUN_MODE = 2
+
+CHANNELS = ("DRILL", "POWER", "LINEAR")
+AGGREGATES = {
+    "min": min,
+    "max": max,
+    "mean": lambda xs: sum(xs) / len(xs),
+    "rms": lambda xs: math.sqrt(sum(map(operator.mul, xs, xs)) / len(xs)),
+}
 
 class SensorController:
     def __init__(self):
+        self.clock = ClockClient()
         self.client = mqtt.Client()
         self.client.connect(BROKER_IP, 1883, 60)
         self.client.loop_start()
@@ -39,104 +66,161 @@ class SensorController:
         )
         time.sleep(2)
 
-        self.data_buffer = b''
+        self.rx = PacketRingBuffer(RX_BUFFER_SIZE)
+        self.publish_mode = PUBLISH_MODE
+        self.window_length = PUBLISH_WINDOW
+        self.aggregates = PUBLISH_AGGREGATES
+        self.max_block = PUBLISH_MAX_BLOCK
+        self.run_logger = RunLogger(RUN_LOG_DIR, DEVICE_ID, RUN_LOG_FIELDS)
+        self.run_marked = False  # log started by an MCU run_marker: only its stop marker ends it
         self.running = True
         threading.Thread(target=self.publish_status, daemon=True).start()
 
     def read_sensors(self):
-        try:
-            if self.ser.in_waiting > 0:
-                self.data_buffer += self.ser.read(self.ser.in_waiting)
-            
-            while len(self.data_buffer) >= PACKET_SIZE:
-                if len(self.data_buffer) >= PACKET_SIZE and self.data_buffer[PACKET_SIZE - 1] == ord(SYNC_BYTE):
-                    packet = self.data_buffer[:PACKET_SIZE]
-                    self.data_buffer = self.data_buffer[PACKET_SIZE:]
-                    
-                    raw_drill, raw_power, raw_linear = struct.unpack('<hhh', packet[:-1])
-                    return {
-                        "DRILL": float(raw_drill) / AMP_SCALE,
-                        "POWER": float(raw_power) / AMP_SCALE,
-                        "LINEAR": float(raw_linear) / AMP_SCALE
-                    }
-                else:
-                    sync_pos = self.data_buffer.find(SYNC_BYTE)
-                    if sync_pos == -1:
-                        self.data_buffer = b''
-                        break
-                    else:
-                        self.data_buffer = self.data_buffer[sync_pos + 1:]
-            
-            if len(self.data_buffer) > PACKET_SIZE * 10:
-                self.data_buffer = self.data_buffer[-PACKET_SIZE:]
-                
-        except Exception as e:
-            self.send_error(f"Sensor read error: {e}")
-        return None
+        """Drain the serial port and decode every complete packet.
 
-    def read_sensors_batch(self):
-        """Read multiple packets at once like speed_test.py"""
+        Returns a list of raw (drill, power, linear) int16 tuples, oldest
+        first. Divide by AMP_SCALE for amps.
+        """
         try:
-            if self.ser.in_waiting >= PACKET_SIZE * BATCH_SIZE:
-                data = self.ser.read(PACKET_SIZE * BATCH_SIZE)
-                self.data_buffer += data
-                
-                while len(self.data_buffer) >= PACKET_SIZE:
-                    if self.data_buffer[PACKET_SIZE - 1] == ord(SYNC_BYTE):
-                        packet = self.data_buffer[:PACKET_SIZE]
-                        self.data_buffer = self.data_buffer[PACKET_SIZE:]
-                        
-                        raw_drill, raw_power, raw_linear = struct.unpack('<hhh', packet[:-1])
-                        return {
-                            "DRILL": float(raw_drill) / AMP_SCALE,
-                            "POWER": float(raw_power) / AMP_SCALE,
-                            "LINEAR": float(raw_linear) / AMP_SCALE
-                        }
-                    else:
-                        sync_pos = self.data_buffer.find(SYNC_BYTE)
-                        if sync_pos == -1:
-                            self.data_buffer = b''
-                            break
-                        self.data_buffer = self.data_buffer[sync_pos + 1:]
-                
-                if self.ser.in_waiting > 0:
-                    self.data_buffer += self.ser.read(self.ser.in_waiting)
-                    
-            if len(self.data_buffer) > PACKET_SIZE * 20:
-                self.data_buffer = self.data_buffer[-PACKET_SIZE:]
-                
+            waiting = self.ser.in_waiting
+            if waiting > 0:
+                self.rx.fill(self.ser, waiting)
+            return self.rx.decode()
         except Exception as e:
-            self.send_error(f"Batch sensor read error: {e}")
-        return None
+            self.send_error(f"Sensor read error: {e}")
+        return []
 
     def on_message(self, client, userdata, msg):
         try:
             data = json.loads(msg.payload.decode())
+            if "clock_ping" in data:
+                self.client.publish(f"{DEVICE_ID}/clock", json.dumps(self.clock.on_ping(data)))
+                return
+            if "run_marker" in data:
+                self.handle_run_marker(data)
+                return
+            if "mode" in data and not self.run_marked:  # the MCU's run markers own a marked log
+                if data["mode"] == RUN_MODE:
+                    run_id = data.get("run_id")
+                    if not self.run_logger.running or (run_id and run_id != self.run_logger.run_id):
+                        self.run_logger.start(run_id)
+                else:
+                    self.run_logger.stop()
+            if not data.keys() & {"publish_mode", "window", "aggregates", "max_block"}:
+                return
+            if "publish_mode" in data:
+                if data["publish_mode"] not in PUBLISH_MODES:
+                    raise ValueError(f"Unknown publish_mode {data['publish_mode']}")
+                self.publish_mode = data["publish_mode"]
+            if "window" in data:
+                window = float(data["window"])
+                if window <= 0:
+                    raise ValueError("window must be > 0")
+                self.window_length = window
+            if "aggregates" in data:
+                unknown = set(data["aggregates"]) - set(AGGREGATES)
+                if unknown:
+                    raise ValueError(f"Unknown aggregates {sorted(unknown)}")
+                self.aggregates = tuple(data["aggregates"])
+            if "max_block" in data:
+                self.max_block = max(int(data["max_block"]), 0)
+            print(f"Publish config: mode={self.publish_mode}, window={self.window_length}s, "
+                  f"aggregates={self.aggregates}, max_block={self.max_block}")
         except (json.JSONDecodeError, ValueError, TypeError) as e:
             self.send_error(f"MQTT command error: {e}")
 
+    def handle_run_marker(self, data):
+        """MCU run start/stop marker: log under the shared run_id and report our clock offset."""
+        received = self.clock.now()
+        run_id = data.get("run_id")
+        if data["run_marker"] == "start":
+            self.run_logger.start(run_id)
+            self.run_marked = True
+        else:
+            self.run_logger.stop()
+            self.run_marked = False
+        self.client.publish(f"{DEVICE_ID}/run", json.dumps({
+            "run_id": run_id,
+            "event": data["run_marker"],
+            "offset": received - data.get("mcu_time", received),
+        }))
+
+    def build_window(self, samples, t_start, t_end):
+        """One message for a whole window: per-channel sample block + stats."""
+        columns = list(zip(*samples)) if samples else [(), (), ()]
+        block = {}
+        stats = {}
+        stride = 1
+        if self.max_block and len(samples) > self.max_block:
+            stride = -(-len(samples) // self.max_block)
+        for name, column in zip(CHANNELS, columns):
+            block[name] = list(column[::stride])
+            stats[name] = {
+                agg: round(AGGREGATES[agg](column) / AMP_SCALE, 4) if column else 0.0
+                for agg in self.aggregates
+            }
+
+        last = samples[-1] if samples else (0, 0, 0)
+        return {
+            "DRILL_CURRENT": last[0] / AMP_SCALE,
+            "POWER_CURRENT": last[1] / AMP_SCALE,
+            "LINEAR_CURRENT": last[2] / AMP_SCALE,
+            "window": {
+                "t_start": round(t_start, 6),
+                "t_end": round(t_end, 6),
+                "count": len(samples),
+                "stride": stride,
+                "scale": AMP_SCALE,
+                "samples": block,
+                "stats": stats,
+            },
+        }
+
     def publish_status(self):
-        last_publish_time = time.time()
-        publish_interval = 0.01  # Publish every 10ms
+        last_publish_time = self.clock.now()
+        last_read_time = last_publish_time
+        window_start = last_publish_time
+        window = []
         consecutive_failures = 0
         
         while self.running:
             try:
-                meas = self.read_sensors_batch()
-                if not meas:
-                    meas = self.read_sensors()
-                
-                current_time = time.time()
+                samples = self.read_sensors()
                 
-                if meas:
+                current_time = self.clock.now()
+                if samples:
+                    self.run_logger.log_block(last_read_time, current_time, samples)
+                last_read_time = current_time
+
+                if self.publish_mode == "window":
+                    window.extend(samples)
+                    if current_time - window_start >= self.window_length:
+                        status = self.build_window(window, window_start, current_time)
+                        status["ts"] = self.clock.stamp(current_time)
+                        self.client.publish(f"{DEVICE_ID}/data", telemetry_codec.dumps("sdu_window", status, TELEMETRY_ENCODING))
+                        if not window:
+                            consecutive_failures += 1
+                            if consecutive_failures > 100:
+                                print(f"Warning: No sensor data for {consecutive_failures} windows")
+                                consecutive_failures = 0
+                        else:
+                            consecutive_failures = 0
+                        window = []
+                        window_start = current_time
+                        last_publish_time = current_time
+
+                elif samples:
                     consecutive_failures = 0
+                    drill, power, linear = samples[-1]
                     status = {
-                        "DRILL_CURRENT": float(meas["DRILL"]),
-                        "POWER_CURRENT": float(meas["POWER"]),
-                        "LINEAR_CURRENT": float(meas["LINEAR"]),
+                        "DRILL_CURRENT": drill / AMP_SCALE,
+                        "POWER_CURRENT": power / AMP_SCALE,
+                        "LINEAR_CURRENT": linear / AMP_SCALE,
+                        "ts": self.clock.stamp(current_time),
                     }
                     
-                    self.client.publish(f"{DEVICE_ID}/data", json.dumps(status))
+                    self.client.publish(f"{DEVICE_ID}/data", telemetry_codec.dumps("sdu_sample", status, TELEMETRY_ENCODING))
                     last_publish_time = current_time
                     
                 else:
@@ -146,8 +230,9 @@ class SensorController:
                             "DRILL_CURRENT": 0.0,
                             "POWER_CURRENT": 0.0,
                             "LINEAR_CURRENT": 0.0,
+                            "ts": self.clock.stamp(current_time),
                         }
-                        self.client.publish(f"{DEVICE_ID}/data", json.dumps(status))
+                        self.client.publish(f"{DEVICE_ID}/data", telemetry_codec.dumps("sdu_sample", status, TELEMETRY_ENCODING))
                         last_publish_time = current_time
                         
                         if consecutive_failures > 100:
@@ -170,6 +255,7 @@ class SensorController:
 
     def stop(self):
         self.running = False
+        self.run_logger.stop(wait=True)  # flush the run to disk before exiting
         self.client.loop_stop()
         if self.ser.is_open:
             self.ser.close()
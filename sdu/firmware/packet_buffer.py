@@ -0,0 +1,118 @@
+import struct
+
+PACKET_SIZE = 7
+SYNC_BYTE = b'\n'
+PACKET_STRUCT = struct.Struct('<hhhx')  # 3 x int16 + sync byte (skipped)
+
+
+class PacketRingBuffer:
+    """Preallocated receive buffer for the Teensy's 7-byte packet stream.
+
+    Bytes are read straight into a fixed bytearray with readinto() and
+    decoded in place through a memoryview, so no per-packet slicing or
+    bytes concatenation happens. Only the trailing partial packet (< 7
+    bytes) is ever moved, when the write cursor reaches the end.
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.read_pos = 0
+        self.write_pos = 0
+
+        self.packets = 0
+        self.resyncs = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return self.write_pos - self.read_pos
+
+    def free(self):
+        return self.capacity - len(self)
+
+    def _compact(self):
+        pending = len(self)
+        if self.read_pos and pending:
+            # bytes() copy: source and destination may overlap
+            self.buf[:pending] = bytes(self.view[self.read_pos:self.write_pos])
+        self.read_pos = 0
+        self.write_pos = pending
+
+    def _reserve(self, n):
+        if self.capacity - self.write_pos >= n:
+            return
+        self._compact()
+        if self.capacity - self.write_pos < n:
+            # Decoder fell behind: drop the oldest bytes, keep the newest
+            drop = min(n - (self.capacity - self.write_pos), len(self))
+            self.read_pos += drop
+            self.dropped_bytes += drop
+            self._compact()
+
+    def fill(self, stream, max_bytes):
+        """readinto() up to max_bytes from stream; returns bytes read.
+
+        Never reads more than fits; the remainder stays in the OS serial
+        buffer for the next call instead of being discarded.
+        """
+        if self.capacity - self.write_pos < max_bytes:
+            self._compact()
+        max_bytes = min(max_bytes, self.capacity - self.write_pos)
+        if max_bytes <= 0:
+            return 0
+        n = stream.readinto(self.view[self.write_pos:self.write_pos + max_bytes]) or 0
+        self.write_pos += n
+        return n
+
+    def feed(self, data):
+        """Copy an in-memory chunk in (replay/testing path)."""
+        if len(data) > self.capacity:
+            self.dropped_bytes += len(data) - self.capacity
+            data = data[-self.capacity:]
+        n = len(data)
+        self._reserve(n)
+        self.buf[self.write_pos:self.write_pos + n] = data
+        self.write_pos += n
+
+    def decode(self):
+        """Decode every complete packet in the buffer.
+
+        Returns a list of raw (drill, power, linear) int16 tuples. Aligned
+        runs are unpacked in one struct.iter_unpack() call; a missing sync
+        byte skips ahead to the next '\\n' without copying the buffer.
+        """
+        out = []
+        buf, view = self.buf, self.view
+        sync = SYNC_BYTE[0]
+        r, w = self.read_pos, self.write_pos
+
+        while w - r >= PACKET_SIZE:
+            count = (w - r) // PACKET_SIZE
+            end = r + count * PACKET_SIZE
+            if buf[r + PACKET_SIZE - 1] == sync:
+                # Check every sync position in one strided pass
+                syncs = buf[r + PACKET_SIZE - 1:end:PACKET_SIZE]
+                good = count - len(syncs.lstrip(SYNC_BYTE))
+            else:
+                good = 0
+
+            if good:
+                stop = r + good * PACKET_SIZE
+                out.extend(PACKET_STRUCT.iter_unpack(view[r:stop]))
+                r = stop
+                continue
+
+            # Misaligned: resume just past the next sync byte
+            self.resyncs += 1
+            pos = buf.find(SYNC_BYTE, r, w)
+            if pos == -1:
+                r = w
+                break
+            r = pos + 1
+
+        self.read_pos, self.write_pos = r, w
+        if r == w:
+            self.read_pos = self.write_pos = 0
+        self.packets += len(out)
+        return out
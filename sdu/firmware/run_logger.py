@@ -0,0 +1,422 @@
+"""
+On-device binary run logger.
+
+Records are fixed width: a float64 timestamp followed by the unit's typed
+fields, packed with struct (little-endian). They go into preallocated,
+memory-mapped segment files; when a segment fills, the logger rotates to
+the next one. Each segment starts with a 512-byte header carrying the
+field layout and the number of valid records, which is refreshed every
+FLUSH_INTERVAL, so a crash loses at most that much data.
+
+The acquisition thread only appends to a deque: log() for one record,
+log_block() for a chunk of samples received between two timestamps (the
+writer thread spreads timestamps across the chunk). Packing, rotation and
+msync all happen on the writer thread. If the writer falls behind by more
+than `max_pending` records, new records are dropped and counted rather
+than blocking acquisition.
+
+start() and stop() don't touch files either (both are called from the
+paho thread): they queue a run marker in the same deque, under the lock
+log() appends with, so every record lands in the run that was active
+when it was logged and nothing is accepted after stop(). The writer
+opens and closes segments when it reaches a marker. stop(wait=True)
+blocks until the run is on disk, for shutdown.
+
+Retention never touches the run being written: a long run keeps every
+segment. Before each segment is opened, finished runs of this device
+are deleted oldest first while there are more than `keep_runs` of them
+or the disk would be left with less than `min_free_bytes` free. Each
+deletion is printed and counted (pruned_runs / pruned_bytes in stats()).
+If that still leaves no room, the segment is not opened and the run's
+records are counted as lost instead of filling the disk.
+
+Kept identical in lcu/, dcu/ and sdu/firmware; each unit deploys its own
+firmware directory. Run as a script to convert logs or benchmark:
+
+    python3 run_logger.py convert run_logs/sdu_<run_id>_*.rlog --csv out.csv
+    python3 run_logger.py convert run_logs/sdu_<run_id>_*.rlog --parquet out.parquet
+    python3 run_logger.py bench --rate 50000 --seconds 10
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+MAGIC = b"RLOG"
+LOG_VERSION = 1
+HEADER_SIZE = 512
+HEADER = struct.Struct('<4sHHIQd')  # magic, version, header size, record size, record count, updated
+SEGMENT_BYTES = 64 * 1024 * 1024
+FLUSH_INTERVAL = 1.0
+KEEP_RUNS = 50                   # finished runs kept per device; 0 keeps all
+MIN_FREE_BYTES = 512 * 1024 * 1024  # free space left after reserving a segment
+WRITER_BATCH = 4096  # records packed per writer pass before checking the clock
+
+
+class RunLogger:
+    def __init__(self, directory, device, fields, segment_bytes=SEGMENT_BYTES,
+                 keep_runs=KEEP_RUNS, min_free_bytes=MIN_FREE_BYTES, max_pending=1_000_000):
+        """fields: sequence of (name, struct code), e.g. (("load", "f"), ("pos_ticks", "i"))."""
+        self.directory = directory
+        self.device = device
+        self.fields = tuple(fields)
+        self.record = struct.Struct('<d' + ''.join(code for _, code in self.fields))
+        self.records_per_segment = (segment_bytes - HEADER_SIZE) // self.record.size
+        self.segment_bytes = HEADER_SIZE + self.records_per_segment * self.record.size
+        self.keep_runs = keep_runs  # 0 = keep all
+        self.min_free_bytes = min_free_bytes
+        self.max_pending = max_pending
+
+        self.pending = deque()  # records, and (None, "start"/"stop", arg) run markers
+        self.lock = threading.Lock()  # running flag + appends, so no record slips past stop()
+        # Never reset, so queued - drained is always the backlog
+        self.queued = 0    # acquisition side, under the lock
+        self.drained = 0   # writer side
+        self.run_id = None
+        self.running = False
+        self.thread = None
+
+        self.writing = None  # run_id the writer is on
+        self.file = None
+        self.mm = None
+        self.segment = 0
+        self.segment_count = 0  # records in the open segment
+        self.segments = []
+
+        self.records = 0
+        self.dropped = 0
+        self.lost = 0  # records that reached the writer with no segment open (it could not be created)
+        self.write_time = 0.0
+        self.pruned_runs = 0   # finished runs deleted for retention, never reset
+        self.pruned_bytes = 0
+
+    # --- acquisition side: never blocks ---
+
+    def log(self, t, values):
+        with self.lock:
+            if not self.running:
+                return
+            if self.queued - self.drained >= self.max_pending:
+                self.dropped += 1
+                return
+            self.pending.append((t, None, values))
+            self.queued += 1
+
+    def log_block(self, t_start, t_end, rows):
+        """Rows sampled evenly between t_start and t_end, oldest first."""
+        if not rows:
+            return
+        with self.lock:
+            if not self.running:
+                return
+            if self.queued - self.drained >= self.max_pending:
+                self.dropped += len(rows)
+                return
+            self.pending.append((t_start, t_end, rows))
+            self.queued += len(rows)
+
+    # --- run control: only queues markers ---
+
+    def start(self, run_id=None):
+        with self.lock:
+            if self.running:
+                self.pending.append((None, "stop", (None, self.dropped)))
+            self.run_id = run_id or time.strftime("%Y%m%d_%H%M%S")
+            self.dropped = 0
+            self.pending.append((None, "start", self.run_id))
+            self.running = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        print(f"[RunLogger] {self.device} logging run {self.run_id} to {self.directory}")
+
+    def stop(self, wait=False, timeout=10.0):
+        """End the run; the writer drains what was logged before this call and closes the file."""
+        done = threading.Event()
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            self.pending.append((None, "stop", (done, self.dropped)))
+        if wait:
+            done.wait(timeout)
+
+    # --- writer thread ---
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            if not self.pending:
+                time.sleep(0.005)
+            else:
+                self._drain(WRITER_BATCH)
+            now = time.monotonic()
+            if now - last_flush >= FLUSH_INTERVAL:
+                self._flush()
+                last_flush = now
+
+    def _drain(self, limit):
+        start = time.perf_counter()
+        written = 0
+        pending = self.pending
+        while pending and written < limit:
+            t, t_end, values = pending.popleft()
+            if t is None:
+                if t_end == "start":
+                    self._begin(values)
+                else:
+                    self._end(*values)
+                continue
+            if t_end is None:
+                self._write(t, values)
+                written += 1
+            else:
+                step = (t_end - t) / len(values)
+                for i, row in enumerate(values):
+                    self._write(t + i * step, row)
+                written += len(values)
+        self.drained += written
+        self.write_time += time.perf_counter() - start
+
+    def _begin(self, run_id):
+        self.writing = run_id
+        self.segment = 0
+        self.segments = []
+        self.records = 0
+        self.lost = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._open_segment()
+        except (OSError, ValueError) as e:
+            print(f"[RunLogger] {self.device} cannot log run {run_id}: {e}")
+            self._close_segment()
+
+    def _end(self, done, dropped):
+        self._close_segment()
+        print(f"[RunLogger] {self.device} run {self.writing}: {self.records} records, "
+              f"{len(self.segments)} segment(s), {dropped} dropped, {self.lost} lost")
+        if done is not None:
+            done.set()
+
+    def _write(self, t, values):
+        if self.mm is not None and self.segment_count >= self.records_per_segment:
+            self._close_segment()
+            self.segment += 1
+            try:
+                self._open_segment()
+            except OSError as e:
+                print(f"[RunLogger] {self.device} cannot open segment {self.segment}: {e}")
+                self._close_segment()
+        if self.mm is None:
+            self.lost += 1  # no segment could be opened for this run
+            return
+        self.record.pack_into(self.mm, HEADER_SIZE + self.segment_count * self.record.size, t, *values)
+        self.segment_count += 1
+        self.records += 1
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, f"{self.device}_{self.writing}_{index:04d}.rlog")
+
+    def _finished_runs(self):
+        """{run_id: [paths]} of this device's runs on disk other than the one being written, oldest first."""
+        prefix = f"{self.device}_"
+        runs = {}
+        for name in os.listdir(self.directory):
+            if not (name.startswith(prefix) and name.endswith(".rlog")):
+                continue
+            run_id = name[len(prefix):-len("_0000.rlog")]
+            if run_id != self.writing:
+                runs.setdefault(run_id, []).append(os.path.join(self.directory, name))
+        mtime = {run_id: min(os.path.getmtime(p) for p in paths) for run_id, paths in runs.items()}
+        return {run_id: runs[run_id] for run_id in sorted(runs, key=mtime.get)}
+
+    def _free_bytes(self):
+        st = os.statvfs(self.directory)
+        return st.f_bavail * st.f_frsize
+
+    def _prune(self):
+        """Delete finished runs, oldest first, until retention and free space allow another segment."""
+        runs = self._finished_runs()
+        needed = self.segment_bytes + self.min_free_bytes
+        while runs and ((self.keep_runs and len(runs) > self.keep_runs) or self._free_bytes() < needed):
+            run_id, paths = next(iter(runs.items()))
+            del runs[run_id]
+            freed = 0
+            for path in paths:
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    freed += size
+                except OSError as e:
+                    print(f"[RunLogger] Could not remove {path}: {e}")
+            self.pruned_runs += 1
+            self.pruned_bytes += freed
+            print(f"[RunLogger] {self.device} removed finished run {run_id} "
+                  f"({len(paths)} segment(s), {freed / 1e6:.1f} MB) for retention")
+        if self._free_bytes() < needed:
+            raise OSError(f"less than {needed / 1e6:.0f} MB free in {self.directory} "
+                          f"and no finished run left to remove")
+
+    def _open_segment(self):
+        self._prune()
+        path = self._segment_path(self.segment)
+        self.file = open(path, "w+b")
+        fd = self.file.fileno()
+        try:
+            os.posix_fallocate(fd, 0, self.segment_bytes)  # reserve the blocks up front
+        except (AttributeError, OSError):
+            os.ftruncate(fd, self.segment_bytes)
+        self.mm = mmap.mmap(fd, self.segment_bytes)
+        meta = json.dumps({
+            "device": self.device,
+            "run_id": self.writing,
+            "segment": self.segment,
+            "fields": [["t", "d"]] + [list(f) for f in self.fields],
+        }).encode()
+        if HEADER.size + len(meta) > HEADER_SIZE:
+            raise ValueError("run log field list does not fit in the segment header")
+        self.mm[HEADER.size:HEADER.size + len(meta)] = meta
+        self.segment_count = 0
+        self._write_header()
+        self.segments.append(path)
+
+    def _write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, LOG_VERSION, HEADER_SIZE, self.record.size,
+                         self.segment_count, time.time())
+
+    def _flush(self):
+        if self.mm is not None:
+            self._write_header()
+            self.mm.flush()
+
+    def _close_segment(self):
+        if self.mm is None:
+            if self.file is not None:  # _open_segment failed part way
+                self.file.close()
+                self.file = None
+            return
+        self._write_header()
+        self.mm.flush()
+        self.mm.close()
+        # Give back the unused preallocated tail
+        self.file.truncate(HEADER_SIZE + self.segment_count * self.record.size)
+        self.file.close()
+        self.mm = None
+        self.file = None
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "run_id": self.run_id,
+            "records": self.records,
+            "pending": self.queued - self.drained,
+            "dropped": self.dropped,
+            "lost": self.lost,
+            "segments": len(self.segments),
+            "pruned_runs": self.pruned_runs,
+            "pruned_bytes": self.pruned_bytes,
+            "write_time_s": round(self.write_time, 3),
+        }
+
+
+def read_segment(path):
+    """Returns (meta, field names, list of record tuples) for one segment file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, header_size, record_size, count, created = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a run log segment")
+    meta = json.loads(data[HEADER.size:header_size].rstrip(b"\0"))
+    record = struct.Struct('<' + ''.join(code for _, code in meta["fields"]))
+    if record.size != record_size:
+        raise ValueError(f"{path}: record size {record_size} does not match its field list")
+    # The header count may lag a crash by up to FLUSH_INTERVAL; trust it over file length
+    body = data[header_size:header_size + count * record_size]
+    names = [name for name, _ in meta["fields"]]
+    return meta, names, list(record.iter_unpack(body))
+
+
+def convert(paths, csv_path=None, parquet_path=None):
+    names = None
+    rows = []
+    for path in sorted(paths):
+        meta, seg_names, seg_rows = read_segment(path)
+        if names is None:
+            names = seg_names
+        elif seg_names != names:
+            raise ValueError(f"{path} has a different field layout")
+        rows.extend(seg_rows)
+    if names is None:
+        print("No segments given")
+        return
+    if csv_path:
+        import csv
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(rows)
+        print(f"Wrote {len(rows)} rows to {csv_path}")
+    if parquet_path:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("Parquet output needs pyarrow (pip install pyarrow)")
+            return
+        columns = list(zip(*rows)) if rows else [[] for _ in names]
+        table = pa.table({name: list(col) for name, col in zip(names, columns)})
+        pq.write_table(table, parquet_path)
+        print(f"Wrote {len(rows)} rows to {parquet_path}")
+
+
+def bench(directory, rate, seconds, block):
+    """Feed SDU-shaped records at `rate` per second and report writer headroom."""
+    logger = RunLogger(directory, "bench", (("drill", "h"), ("power", "h"), ("linear", "h")))
+    logger.start()
+    chunk = [(i % 1000, -i % 1000, 7) for i in range(block)]
+    interval = block / rate
+    log_cost = 0.0
+    calls = 0
+    next_t = start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        now = time.time()
+        t0 = time.perf_counter()
+        logger.log_block(now - interval, now, chunk)
+        log_cost += time.perf_counter() - t0
+        calls += 1
+        next_t += interval
+        delay = next_t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    backlog = logger.queued - logger.drained
+    logger.stop(wait=True, timeout=None)
+    elapsed = time.monotonic() - start
+    print(f"target rate:        {rate:,.0f} records/s in blocks of {block}")
+    print(f"written:            {logger.records:,} records ({logger.records / elapsed:,.0f}/s)")
+    print(f"dropped:            {logger.dropped:,}, backlog at stop {backlog:,}")
+    print(f"writer busy:        {logger.write_time / elapsed * 100:.1f}% of one core")
+    print(f"log_block() cost:   {log_cost / calls * 1e6:.2f} us per call")
+    print(f"segments:           {logger.segments}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run log converter and benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="convert .rlog segments to CSV/Parquet")
+    p_convert.add_argument("segments", nargs="+")
+    p_convert.add_argument("--csv")
+    p_convert.add_argument("--parquet")
+    p_bench = sub.add_parser("bench", help="sustained write benchmark")
+    p_bench.add_argument("--dir", default="run_logs")
+    p_bench.add_argument("--rate", type=float, default=50000, help="records per second")
+    p_bench.add_argument("--seconds", type=float, default=10)
+    p_bench.add_argument("--block", type=int, default=500, help="records per log_block() call")
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert(args.segments, args.csv, args.parquet)
+    else:
+        bench(args.dir, args.rate, args.seconds, args.block)